@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, Response
 import os
 import aiohttp
 import asyncio
@@ -15,15 +15,22 @@ import atexit
 import json
 import time
 import re
-from datetime import datetime
 import logging
 from processing_monitor import processing_monitor
 from sse_notifications import get_sse_response, send_notification
 import uuid
-import threading
 import m3u_editor
 from channel_manager import setup_channel_manager
 from proxy_api import register_proxy_api
+from search_api import register_search_api, start_search_index_build
+from search_index import search_index
+from channel_store import channel_store
+from library_scanner import LibraryScanner, scan_content_dirs
+from refresh_scheduler import RefreshScheduler, MANUAL_PRIORITY
+from job_queue import STATUS_QUEUED, STATUS_RUNNING
+from proxy_sync import ProxySync
+from coordination import LeaderLease
+from shard_queue import start_worker_thread as start_shard_worker
 
 # Configure logging
 logging.basicConfig(
@@ -68,11 +75,17 @@ scheduler.start()
 
 # Initialize proxy
 proxy_manager = m3u_editor.M3UProxyManager()
+
+# Keeps proxies created from a URL in step with their upstream playlist
+proxy_sync = ProxySync(proxy_manager)
 register_proxy_api(app)
 
 # Initialize Channel Manager
 setup_channel_manager(app)
 
+# Initialize search
+register_search_api(app)
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -209,7 +222,7 @@ def download_m3u(url, save_path):
             'message': f'Unexpected error during download: {str(e)}'
         }
 
-async def async_process_m3u(file_path, user_path=None, url=None, job_id=None):
+async def async_process_m3u(file_path, user_path=None, url=None, job_id=None, checkpoint=None):
     """Process an M3U file asynchronously with enhanced error handling and debugging"""
     logger.info(f'Starting optimized M3U processing: {file_path}')
     
@@ -268,7 +281,7 @@ async def async_process_m3u(file_path, user_path=None, url=None, job_id=None):
             batch_size = config.get("processing_batch_size", 100)
             
             # Process using optimized method
-            stats = await process_m3u_optimized(file_path, content_path, url, batch_size)
+            stats = await process_m3u_optimized(file_path, content_path, url, batch_size, job_id, checkpoint=checkpoint)
             
             logger.info(f'Processing completed with stats: {stats}')
             
@@ -327,13 +340,13 @@ async def async_process_m3u(file_path, user_path=None, url=None, job_id=None):
             'message': f'Unexpected error processing M3U file: {str(e)}'
         }
 
-def process_m3u(file_path, user_path=None, url=None, job_id=None):
+def process_m3u(file_path, user_path=None, url=None, job_id=None, checkpoint=None):
     """Synchronous wrapper for async_process_m3u with better error handling"""
     try:
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         try:
-            return loop.run_until_complete(async_process_m3u(file_path, user_path, url, job_id))
+            return loop.run_until_complete(async_process_m3u(file_path, user_path, url, job_id, checkpoint))
         finally:
             loop.close()
     except Exception as e:
@@ -343,19 +356,27 @@ def process_m3u(file_path, user_path=None, url=None, job_id=None):
             'message': f'Unexpected error during M3U processing: {str(e)}'
         }
 
-async def async_check_m3u_update(url, filename, output_path=None):
+async def async_check_m3u_update(url, filename, output_path=None, job_id=None, checkpoint=None):
     """Check if M3U file needs to be updated asynchronously"""
     logger.info(f'Checking for updates to M3U file: {url}')
     
     save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    download_result = await async_download_m3u(url, save_path)
+    
+    if checkpoint and checkpoint.can_resume(save_path):
+        # An interrupted run already downloaded this file; finish it instead of starting over
+        logger.info(f'Resuming interrupted update of {url} from entry {checkpoint.index}')
+        download_result = {'status': 'success', 'path': save_path}
+    else:
+        # Limit concurrent downloads from the same provider host
+        with refresh_scheduler.host_slot(url):
+            download_result = await async_download_m3u(url, save_path)
     
     if download_result['status'] == 'success':
         # Get content before processing
         content_before = _scan_content_dirs()
         
         # Process the file - note we pass the URL here
-        process_result = await async_process_m3u(save_path, output_path, url)
+        process_result = await async_process_m3u(save_path, output_path, url, job_id, checkpoint)
         
         # Get content after processing
         content_after = _scan_content_dirs()
@@ -393,54 +414,26 @@ async def async_check_m3u_update(url, filename, output_path=None):
             'message': download_result["message"]
         }
 
-def check_m3u_update(url, filename, output_path=None):
+def check_m3u_update(url, filename, output_path=None, job_id=None, checkpoint=None):
     """Synchronous wrapper for async_check_m3u_update"""
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
-        return loop.run_until_complete(async_check_m3u_update(url, filename, output_path))
+        return loop.run_until_complete(async_check_m3u_update(url, filename, output_path, job_id, checkpoint))
     finally:
         loop.close()
 
+def run_m3u_job(job, checkpoint):
+    """Run a job claimed from the refresh queue: a scheduled refresh, a proxy sync or an uploaded playlist"""
+    if job['kind'] == 'refresh':
+        return check_m3u_update(job['url'], job['filename'], job.get('output_path'), job['job_id'], checkpoint)
+    if job['kind'] == 'proxy_sync':
+        return proxy_sync.sync(job['filename'], host_slot=refresh_scheduler.host_slot)
+    return process_m3u(job['filename'], job.get('output_path'), job['url'], job['job_id'], checkpoint)
+
 def _scan_content_dirs():
     """Scan content directories to build a list of current files"""
-    config = db.load_config()
-    content_path = config.get("output_path", "content")
-    
-    content = {
-        "movies": set(),
-        "tv": set()
-    }
-    
-    # Scan movies
-    movie_path = os.path.join(content_path, 'Movies')
-    if os.path.exists(movie_path):
-        for movie_dir in os.listdir(movie_path):
-            movie_full_path = os.path.join(movie_path, movie_dir)
-            if os.path.isdir(movie_full_path):
-                for file in os.listdir(movie_full_path):
-                    if file.endswith(".strm"):
-                        content["movies"].add(os.path.join(movie_dir, file))
-    
-    # Scan TV shows
-    tv_path = os.path.join(content_path, 'TV Shows')
-    if os.path.exists(tv_path):
-        for show_dir in os.listdir(tv_path):
-            show_full_path = os.path.join(tv_path, show_dir)
-            if os.path.isdir(show_full_path):
-                for season_or_file in os.listdir(show_full_path):
-                    season_full_path = os.path.join(show_full_path, season_or_file)
-                    
-                    if os.path.isdir(season_full_path):
-                        # This is a season directory
-                        for episode_file in os.listdir(season_full_path):
-                            if episode_file.endswith(".strm"):
-                                content["tv"].add(os.path.join(show_dir, season_or_file, episode_file))
-                    elif season_or_file.endswith(".strm"):
-                        # This is a direct episode file
-                        content["tv"].add(os.path.join(show_dir, season_or_file))
-    
-    return content
+    return scan_content_dirs()
 
 def _detect_content_changes(before, after):
     """Detect content changes by comparing before and after scans"""
@@ -459,27 +452,16 @@ def _detect_content_changes(before, after):
         "updated": 0  # We don't track updates here
     }
 
-async def async_schedule_m3u_check(url, filename, output_path=None, hours=24):
-    """Schedule a check for M3U updates asynchronously"""
-    job = scheduler.add_job(
-        check_m3u_update,
-        'interval',
-        hours=hours,
-        args=[url, filename, output_path]
-    )
-    
-    # Update next check time
-    next_check = (datetime.now() + job.trigger.interval).strftime("%Y-%m-%d %H:%M:%S")
-    await db.async_update_m3u_link_next_check(url, next_check)
-
 def schedule_m3u_check(url, filename, output_path=None, hours=24):
-    """Synchronous wrapper for async_schedule_m3u_check"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        loop.run_until_complete(async_schedule_m3u_check(url, filename, output_path, hours))
-    finally:
-        loop.close()
+    """Schedule periodic refreshes of an M3U link through the refresh queue"""
+    refresh_scheduler.schedule(url, hours)
+
+# Only one worker process (the leader) turns scheduled checks into jobs
+scheduler_leader = LeaderLease('scheduler')
+scheduler_leader.start()
+
+# Scheduled checks and uploads are queued in SQLite and run with global and per-host concurrency limits
+refresh_scheduler = RefreshScheduler.from_config(scheduler, run_m3u_job, leader=scheduler_leader)
 
 # Load saved M3U links and schedule checks on startup
 for link in db.load_m3u_links():
@@ -490,6 +472,19 @@ for link in db.load_m3u_links():
         link.get('update_frequency', 24)
     )
 
+# Schedule syncs of proxies that follow their upstream playlist
+for proxy_id, proxy_url, sync_hours in proxy_sync.synced_proxies():
+    refresh_scheduler.schedule_proxy_sync(proxy_id, proxy_url, sync_hours)
+
+# Pick up jobs interrupted by the last shutdown
+refresh_scheduler.start()
+
+# In distributed worker mode, also process playlist shards queued by a coordinator
+start_shard_worker()
+
+# Index the existing library for search if this is the first start with search
+start_search_index_build()
+
 @app.route('/')
 def index():
     config = db.load_config()
@@ -523,6 +518,7 @@ def status():
 
 @app.route('/remove_link/<path:url>')
 def remove_link(url):
+    refresh_scheduler.unschedule(url)
     if db.remove_m3u_link(url):
         flash(f'Removed scheduled updates for: {url}')
     else:
@@ -596,11 +592,13 @@ def scan_content():
         if not os.path.exists(tv_path):
             os.makedirs(tv_path)
         
-        # Count movies and TV shows
-        movie_count = sum(1 for f in os.listdir(movie_path) if os.path.isdir(os.path.join(movie_path, f)))
-        tv_count = sum(1 for f in os.listdir(tv_path) if os.path.isdir(os.path.join(tv_path, f)))
-        
-        flash(f'Content scanned: Found {movie_count} movies and {tv_count} TV shows in {content_path}')
+        # Rescan the library (refreshes the scan cache) and count movies and TV shows
+        scanner = LibraryScanner(content_path)
+        content = scanner.scan()
+        movie_count, tv_count = scanner.count_titles()
+
+        flash(f'Content scanned: Found {movie_count} movies and {tv_count} TV shows '
+              f'({len(content["movies"]) + len(content["tv"])} STRM files) in {content_path}')
     except Exception as e:
         logger.error(f"Error scanning content: {str(e)}")
         flash(f'Error scanning content: {str(e)}')
@@ -693,17 +691,17 @@ def check_now(url):
         flash(f'Error: Could not find link {url}')
         return redirect(url_for('status'))
         
-    # Run the check
+    # Run the check ahead of any scheduled refreshes
     try:
-        result = check_m3u_update(
-            link_data['url'], 
-            link_data['filename'], 
-            link_data.get('output_path')
-        )
+        result = refresh_scheduler.run_now(link_data['url'])
         
-        if result['status'] == 'success':
+        if result['status'] == 'success' and 'changes' in result:
             changes = result['changes']
             flash(f'Check completed: {changes["added"]} items added, {changes["removed"]} items removed')
+        elif result['status'] == 'success':
+            flash(f'Check completed: {result["message"]}')
+        elif result['status'] in (STATUS_QUEUED, STATUS_RUNNING):
+            flash(f'Check is still {result["status"]} in the background (job {result["job_id"]})')
         else:
             flash(f'Error checking URL: {result["message"]}')
     except Exception as e:
@@ -739,6 +737,7 @@ def api_status():
                     'path': content_path
                 },
                 'links': links,
+                'refresh_queue': refresh_scheduler.get_status(),
                 'recent_changes': recent_changes
             }
         })
@@ -749,6 +748,36 @@ def api_status():
             'message': str(e)
         }), 500
     
+@app.route('/api/links/priority', methods=['POST'])
+def set_link_priority():
+    """API endpoint for setting the refresh priority of a scheduled link"""
+    try:
+        data = request.get_json() or {}
+        url = data.get('url')
+        priority = int(data.get('priority', 0))
+        
+        if not url or not db.update_m3u_link_priority(url, priority):
+            return jsonify({
+                'status': 'error',
+                'message': f'Could not find link {url}'
+            }), 404
+        
+        return jsonify({
+            'status': 'success',
+            'message': f'Priority for {url} set to {priority}'
+        })
+    except (TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'message': 'Priority must be an integer'
+        }), 400
+    except Exception as e:
+        logger.error(f"Error setting link priority: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
 @app.route('/events')
 def events():
     """SSE endpoint for real-time notifications"""
@@ -836,23 +865,8 @@ def upload_file():
                 # Send initial notification
                 send_notification("Processing Started", f"Started processing file: {filename}", "info")
                 
-                # Process the file (async)
-                def process_async():
-                    try:
-                        result = process_m3u(file_path, output_path, None, job_id)
-                        
-                        # Flash message just in case the user reloads the page
-                        if result['status'] == 'success':
-                            flash(f'File processed successfully: {result["processed_movies"]} movies and {result["processed_tv"]} TV shows created, {result["skipped"]} entries skipped')
-                        else:
-                            flash(f'Error processing file: {result["message"]}')
-                    except Exception as e:
-                        logger.error(f"Error in async processing thread: {str(e)}")
-                
-                # Start processing in background thread
-                processing_thread = threading.Thread(target=process_async)
-                processing_thread.daemon = True
-                processing_thread.start()
+                # Queue the file; the job survives restarts and resumes from its checkpoint
+                refresh_scheduler.enqueue_import(job_id, file_path, None, output_path)
                 
                 # Redirect to the processing status page
                 return redirect(url_for('processing_page'))
@@ -893,43 +907,26 @@ def upload_file():
                 schedule_updates = 'schedule_update' in request.form
                 logger.info(f"Schedule updates checkbox value: {schedule_updates}")
                 
-                # Process the file (async)
-                def process_url_async():
+                # Queue the file; the job survives restarts and resumes from its checkpoint
+                refresh_scheduler.enqueue_import(job_id, file_path, url, output_path)
+                
+                # Save the URL for periodic updates if checkbox is checked
+                if schedule_updates:
+                    logger.info(f"Scheduling updates for URL: {url}")
+                    config = db.load_config()
+                    update_frequency = config.get("update_frequency", 24)
+                    
                     try:
-                        result = process_m3u(file_path, output_path, url, job_id)
+                        db.save_m3u_link(url, filename, output_path, update_frequency)
+                        logger.info(f"Saved M3U link to database: {url}")
                         
-                        # Save the URL for periodic updates if checkbox is checked
-                        if schedule_updates:
-                            logger.info(f"Scheduling updates for URL: {url}")
-                            config = db.load_config()
-                            update_frequency = config.get("update_frequency", 24)
-                            
-                            # Save to database with explicit commit
-                            try:
-                                db.save_m3u_link(url, filename, output_path, update_frequency)
-                                logger.info(f"Saved M3U link to database: {url}")
-                                
-                                # Schedule the check
-                                schedule_m3u_check(url, filename, output_path, update_frequency)
-                                logger.info(f"Scheduled check for URL: {url}")
-                                
-                                flash(f'URL scheduled for updates every {update_frequency} hours')
-                            except Exception as db_error:
-                                logger.error(f"Error saving M3U link: {str(db_error)}")
-                                flash(f'Error scheduling updates: {str(db_error)}')
+                        schedule_m3u_check(url, filename, output_path, update_frequency)
+                        logger.info(f"Scheduled check for URL: {url}")
                         
-                        # Flash message just in case the user reloads the page
-                        if result['status'] == 'success':
-                            flash(f'URL processed successfully: {result["processed_movies"]} movies and {result["processed_tv"]} TV shows created, {result["skipped"]} entries skipped')
-                        else:
-                            flash(f'Error processing URL: {result["message"]}')
-                    except Exception as e:
-                        logger.error(f"Error in async URL processing thread: {str(e)}")
-                
-                # Start processing in background thread
-                processing_thread = threading.Thread(target=process_url_async)
-                processing_thread.daemon = True
-                processing_thread.start()
+                        flash(f'URL scheduled for updates every {update_frequency} hours')
+                    except Exception as db_error:
+                        logger.error(f"Error saving M3U link: {str(db_error)}")
+                        flash(f'Error scheduling updates: {str(db_error)}')
                 
                 # Redirect to the processing status page
                 return redirect(url_for('processing_page'))
@@ -995,6 +992,7 @@ def update_provider_name():
             
             # Update the name
             manager.set_provider_name(provider_url, name)
+            search_index.rename_provider(provider_id, name)
             
             return jsonify({'status': 'success', 'message': 'Provider name updated'})
         else:
@@ -1249,6 +1247,13 @@ def save_filter_settings():
         elif language_mode == 'multiple':
             config["skip_non_english"] = True
             config["included_languages"] = [lang.strip() for lang in request.form.get('included_languages', 'EN').split(',') if lang.strip()]
+        config["language_mode"] = language_mode
+        config["excluded_languages"] = [lang.strip() for lang in request.form.get('excluded_languages', '').split(',') if lang.strip()]
+        
+        # Group and pattern rules (one per line)
+        config["included_groups"] = [g.strip() for g in request.form.get('included_groups', '').splitlines() if g.strip()]
+        config["excluded_groups"] = [g.strip() for g in request.form.get('excluded_groups', '').splitlines() if g.strip()]
+        config["exclude_patterns"] = [p.strip() for p in request.form.get('exclude_patterns', '').splitlines() if p.strip()]
         
         # Content detection settings
         movie_keywords = request.form.get('movie_keywords', '')
@@ -1309,6 +1314,7 @@ def proxy_create():
     m3u_url = request.form.get('url', '').strip()
     m3u_name = request.form.get('name', '').strip()
     filter_vod = 'filter_vod' in request.form
+    sync = 'sync' in request.form
     
     if not m3u_url and 'file' not in request.files:
         flash("Please provide an M3U URL or upload a file")
@@ -1324,16 +1330,19 @@ def proxy_create():
                 # Create M3U editor instance
                 m3u_editor_obj = m3u_editor.M3UEditor(m3u_file=file_path, m3u_url=m3u_url)
                 
-                # Filter VOD content if requested
-                if filter_vod:
-                    original_count = len(m3u_editor_obj.channels)
-                    m3u_editor_obj.filter_vod_content(keep_live_only=True)
-                    filtered_count = len(m3u_editor_obj.channels)
-                    logger.info(f"VOD filtering removed {original_count - filtered_count} channels")
-                
                 # Save it to proxy manager
                 proxy_id = proxy_manager.save_m3u(m3u_editor_obj, name=m3u_name or None)
                 
+                # Filter VOD content if requested; as an edit, so syncs apply it to new channels too
+                if filter_vod:
+                    result = proxy_manager.filter_vod_content(proxy_id, keep_live_only=True)
+                    logger.info(f"VOD filtering removed {result['changed']} channels")
+                
+                # Keep the proxy in step with the URL
+                if sync:
+                    settings = proxy_sync.configure(proxy_id, True)
+                    refresh_scheduler.schedule_proxy_sync(proxy_id, m3u_url, settings['hours'])
+                
                 # Clean up temporary file
                 if os.path.exists(file_path):
                     os.remove(file_path)
@@ -1380,24 +1389,44 @@ def proxy_create():
 @app.route('/proxy/m3u/<proxy_id>/playlist.m3u')
 def serve_proxy_m3u(proxy_id):
     """Serve the proxied M3U file"""
-    m3u = proxy_manager.get_m3u(proxy_id)
-    
-    if not m3u:
+    # Players poll this URL; the playlist is only rendered again after it changes
+    try:
+        rendered = proxy_manager.get_rendered(proxy_id)
+    except OSError as e:
+        # The rendered files can't be written: stream the export instead
+        logger.error(f"Error rendering proxy playlist {proxy_id}: {str(e)}")
+        m3u = proxy_manager.get_m3u(proxy_id)
+        if not m3u:
+            return "M3U not found", 404
+        response = Response(m3u.iter_export(), mimetype="audio/x-mpegurl")
+        response.headers["Content-Disposition"] = "attachment; filename=playlist.m3u"
+        return response
+    
+    if not rendered:
         return "M3U not found", 404
     
-    # Generate the content
-    content = m3u.export_to_string()
-    
-    # Serve as a downloadable M3U file
-    response = make_response(content)
-    response.headers["Content-Type"] = "audio/x-mpegurl"
-    response.headers["Content-Disposition"] = f"attachment; filename=playlist.m3u"
+    # Each encoding is a separate representation with its own strong ETag
+    use_gzip = request.accept_encodings['gzip'] > 0
+    
+    # Serve as a downloadable M3U file, answering If-None-Match with 304
+    response = send_file(
+        rendered.gzip_path if use_gzip else rendered.path,
+        mimetype="audio/x-mpegurl",
+        as_attachment=True,
+        download_name="playlist.m3u",
+        etag=f"{rendered.etag}-gzip" if use_gzip else rendered.etag,
+        conditional=True
+    )
+    if use_gzip and response.status_code != 304:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
     
     return response
 
 @app.route('/proxy/delete/<proxy_id>')
 def proxy_delete(proxy_id):
     """Delete a proxied M3U"""
+    refresh_scheduler.unschedule_proxy_sync(proxy_id)
     if proxy_manager.delete_m3u(proxy_id):
         flash(f"Successfully deleted M3U proxy")
     else:
@@ -1415,21 +1444,16 @@ def proxy_api_optimize():
     if not proxy_id:
         return jsonify({'status': 'error', 'message': 'No proxy ID provided'})
     
-    m3u = proxy_manager.get_m3u(proxy_id)
-    
-    if not m3u:
-        return jsonify({'status': 'error', 'message': 'M3U not found'})
-    
     # Optimize channel names
-    m3u.optimize_channel_names(options)
+    result = proxy_manager.optimize_channel_names(proxy_id, options)
     
-    # Save changes
-    proxy_manager.save_m3u(m3u)
+    if not result:
+        return jsonify({'status': 'error', 'message': 'M3U not found'})
     
     return jsonify({
         'status': 'success', 
         'message': 'Channel names optimized',
-        'channel_count': len(m3u.channels)
+        'channel_count': result['channel_count']
     })
 
 @app.route('/proxy/api/renumber', methods=['POST'])
@@ -1437,27 +1461,32 @@ def proxy_api_renumber():
     """API endpoint to renumber channels"""
     data = request.get_json()
     proxy_id = data.get('proxy_id')
-    start_number = int(data.get('start_number', 1))
     by_group = data.get('by_group', False)
+    group_order = data.get('group_order') or []
+    preserve_existing = data.get('preserve_existing', False)
+    try:
+        start_number = int(data.get('start_number', 1))
+        group_starts = {group: int(number) for group, number in (data.get('group_starts') or {}).items()}
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({'status': 'error', 'message': 'Channel numbers must be integers'})
     
     if not proxy_id:
         return jsonify({'status': 'error', 'message': 'No proxy ID provided'})
     
-    m3u = proxy_manager.get_m3u(proxy_id)
-    
-    if not m3u:
-        return jsonify({'status': 'error', 'message': 'M3U not found'})
-    
     # Renumber channels
-    m3u.renumber_channels(start_number=start_number, by_group=by_group)
+    result = proxy_manager.renumber_channels(
+        proxy_id, start_number=start_number, by_group=by_group, group_order=group_order,
+        group_starts=group_starts, preserve_existing=preserve_existing
+    )
     
-    # Save changes
-    proxy_manager.save_m3u(m3u)
+    if not result:
+        return jsonify({'status': 'error', 'message': 'M3U not found'})
     
     return jsonify({
         'status': 'success', 
         'message': 'Channels renumbered',
-        'channel_count': len(m3u.channels)
+        'channel_count': result['channel_count'],
+        'changed_count': result['changed']
     })
 
 @app.route('/proxy/api/filter', methods=['POST'])
@@ -1471,31 +1500,25 @@ def proxy_api_filter():
     if not proxy_id:
         return jsonify({'status': 'error', 'message': 'No proxy ID provided'})
     
-    m3u = proxy_manager.get_m3u(proxy_id)
-    
-    if not m3u:
-        return jsonify({'status': 'error', 'message': 'M3U not found'})
-    
-    # Remember original channel count
-    original_count = len(m3u.channels)
-    
-    # Filter channels
-    filtered_m3u = m3u.filter_channels(group=group, name_contains=name_contains)
-    
-    # Save as a new M3U
+    # Save the matching channels as a new M3U
     filter_name = f"Filtered playlist"
     if group:
         filter_name += f" - Group: {group}"
     if name_contains:
         filter_name += f" - Search: {name_contains}"
     
-    new_proxy_id = proxy_manager.save_m3u(filtered_m3u, name=filter_name)
+    result = proxy_manager.filter_channels(proxy_id, group=group, name_contains=name_contains, name=filter_name)
+    
+    if not result:
+        return jsonify({'status': 'error', 'message': 'M3U not found'})
+    
+    new_proxy_id, filtered_count = result
     
     return jsonify({
         'status': 'success', 
         'message': 'Channels filtered',
-        'original_count': original_count,
-        'filtered_count': len(filtered_m3u.channels),
+        'original_count': channel_store.count(proxy_id),
+        'filtered_count': filtered_count,
         'new_proxy_id': new_proxy_id
     })
 
@@ -1522,21 +1545,14 @@ def proxy_api_filter_vod():
     if not proxy_id:
         return jsonify({'status': 'error', 'message': 'No proxy ID provided'})
     
-    m3u = proxy_manager.get_m3u(proxy_id)
-    
-    if not m3u:
-        return jsonify({'status': 'error', 'message': 'M3U not found'})
-    
-    # Remember original channel count
-    original_count = len(m3u.channels)
-    
     # Filter VOD content
-    m3u.filter_vod_content(keep_live_only=keep_live_only)
+    result = proxy_manager.filter_vod_content(proxy_id, keep_live_only=keep_live_only)
     
-    # Save changes
-    proxy_manager.save_m3u(m3u)
+    if not result:
+        return jsonify({'status': 'error', 'message': 'M3U not found'})
     
-    filtered_count = len(m3u.channels)
+    original_count = result['channel_count'] + result['changed']
+    filtered_count = result['channel_count']
     filter_type = "live channels" if keep_live_only else "VOD content"
     
     return jsonify({
@@ -1546,8 +1562,67 @@ def proxy_api_filter_vod():
         'filtered_count': filtered_count
     })
 
+@app.route('/proxy/api/sync', methods=['POST'])
+def proxy_api_sync():
+    """API endpoint to sync a proxy with its upstream playlist now"""
+    data = request.get_json()
+    proxy_id = data.get('proxy_id')
+    
+    if not proxy_id:
+        return jsonify({'status': 'error', 'message': 'No proxy ID provided'})
+    
+    metadata = proxy_manager.get_metadata(proxy_id)
+    if not metadata:
+        return jsonify({'status': 'error', 'message': 'M3U not found'})
+    if not metadata.get('original_url'):
+        return jsonify({'status': 'error', 'message': 'Proxy was not created from a URL'})
+    
+    # Run the sync ahead of any scheduled jobs
+    future = refresh_scheduler.enqueue_proxy_sync(proxy_id, metadata['original_url'], priority=MANUAL_PRIORITY)
+    result = refresh_scheduler.wait(future)
+    if result['status'] in (STATUS_QUEUED, STATUS_RUNNING):
+        # Still going; the client can follow the job by its job_id
+        return jsonify(result), 202
+    return jsonify(result)
+
+@app.route('/proxy/api/sync_settings', methods=['GET', 'POST'])
+def proxy_api_sync_settings():
+    """API endpoint to get or change whether a proxy follows its upstream playlist"""
+    if request.method == 'GET':
+        proxy_id = request.args.get('proxy_id')
+        metadata = proxy_manager.get_metadata(proxy_id) if proxy_id else None
+        if not metadata:
+            return jsonify({'status': 'error', 'message': 'M3U not found'})
+        return jsonify({'status': 'success', 'sync': proxy_sync.settings(proxy_id)})
+    
+    data = request.get_json()
+    proxy_id = data.get('proxy_id')
+    enabled = bool(data.get('enabled', True))
+    try:
+        hours = int(data.get('hours', 24))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'hours must be a number'})
+    
+    if not proxy_id:
+        return jsonify({'status': 'error', 'message': 'No proxy ID provided'})
+    
+    metadata = proxy_manager.get_metadata(proxy_id)
+    if not metadata:
+        return jsonify({'status': 'error', 'message': 'M3U not found'})
+    if enabled and not metadata.get('original_url'):
+        return jsonify({'status': 'error', 'message': 'Proxy was not created from a URL'})
+    
+    settings = proxy_sync.configure(proxy_id, enabled, max(hours, 1))
+    if enabled:
+        refresh_scheduler.schedule_proxy_sync(proxy_id, metadata['original_url'], settings['hours'])
+    else:
+        refresh_scheduler.unschedule_proxy_sync(proxy_id)
+    
+    return jsonify({'status': 'success', 'sync': settings})
+
 # Register a function to be called when the app shuts down
 atexit.register(lambda: scheduler.shutdown())
+atexit.register(scheduler_leader.release)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=8768)
\ No newline at end of file
@@ -1,10 +1,11 @@
 import os
 import re
 import json
-import uuid
 import sqlite3
-from flask import Blueprint, request, jsonify, current_app, url_for, send_from_directory
-from werkzeug.utils import secure_filename
+from datetime import datetime
+from flask import Blueprint, request, jsonify, current_app, url_for, redirect, send_file, send_from_directory
+from channel_store import channel_store
+from image_store import image_store, CACHE_MAX_AGE, DEFAULT_THUMBNAIL_SIZE, THUMBNAIL_SIZES
 
 # Create blueprint
 channel_api = Blueprint('channel_api', __name__)
@@ -38,18 +39,33 @@ def init_channel_manager_db():
         )
         ''')
         
-        # Create channel images table
-        cursor.execute('''
+        # Create channel images table, one image per channel of a proxy
+        channel_images_table = '''
         CREATE TABLE IF NOT EXISTS channel_images (
-            channel_id TEXT PRIMARY KEY,
             proxy_id TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            image_hash TEXT,
             image_path TEXT,
             image_url TEXT,
             created_at TEXT NOT NULL,
             updated_at TEXT NOT NULL,
-            UNIQUE(channel_id, proxy_id)
+            PRIMARY KEY (proxy_id, channel_id)
         )
-        ''')
+        '''
+        cursor.execute(channel_images_table)
+        
+        # The first release keyed images by channel_id alone, so channels of different proxies overwrote each other
+        key_columns = {row['name'] for row in cursor.execute('PRAGMA table_info(channel_images)') if row['pk']}
+        if key_columns != {'proxy_id', 'channel_id'}:
+            cursor.execute('ALTER TABLE channel_images RENAME TO channel_images_old')
+            cursor.execute(channel_images_table)
+            cursor.execute('''
+            INSERT OR IGNORE INTO channel_images (proxy_id, channel_id, image_path, image_url, created_at, updated_at)
+            SELECT proxy_id, channel_id, image_path, image_url, created_at, updated_at FROM channel_images_old
+            ''')
+            cursor.execute('DROP TABLE channel_images_old')
+        if 'image_hash' not in {row['name'] for row in cursor.execute('PRAGMA table_info(channel_images)')}:
+            cursor.execute('ALTER TABLE channel_images ADD COLUMN image_hash TEXT')
         
         # Create channel to user category mapping table
         cursor.execute('''
@@ -63,32 +79,70 @@ def init_channel_manager_db():
             FOREIGN KEY (category_id) REFERENCES user_categories (id) ON DELETE CASCADE
         )
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_channel_categories_channel ON channel_categories (proxy_id, channel_id)')
         
         conn.commit()
+    
+    # Images and categories saved under the old running-counter channel IDs follow their channels' keys
+    channel_store.migrate_channel_keys(dependents=('channel_images', 'channel_categories'))
+    import_uploaded_images()
 
-# Ensure upload directory exists
-def ensure_upload_dir():
-    upload_dir = os.path.join(current_app.static_folder, 'channel_images')
-    if not os.path.exists(upload_dir):
-        os.makedirs(upload_dir)
-    return upload_dir
+def import_uploaded_images():
+    """Move images uploaded to static/channel_images before the image store into the store"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT proxy_id, channel_id, image_path FROM channel_images
+        WHERE image_path IS NOT NULL AND image_hash IS NULL
+        ''')
+        imported = []
+        for row in cursor.fetchall():
+            path = os.path.join(current_app.static_folder, row['image_path'])
+            try:
+                with open(path, 'rb') as f:
+                    image_hash = image_store.store(f.read())
+            except (OSError, ValueError) as e:
+                current_app.logger.warning(f"Could not import channel image {path}: {str(e)}")
+                continue
+            cursor.execute('''
+            UPDATE channel_images SET image_hash = ?, image_path = NULL
+            WHERE proxy_id = ? AND channel_id = ?
+            ''', (image_hash, row['proxy_id'], row['channel_id']))
+            imported.append(path)
+        conn.commit()
+    
+    # The store has its own copies now
+    for path in set(imported):
+        os.remove(path)
 
 # Helper for handling image uploads
 def handle_image_upload(file):
+    """Store an uploaded image (once per content) and return its hash; raises ValueError for non-images"""
     if file:
-        # Generate a unique filename
-        filename = secure_filename(file.filename)
-        filename = f"{uuid.uuid4()}_{filename}"
-        
-        # Save the file
-        upload_dir = ensure_upload_dir()
-        file_path = os.path.join(upload_dir, filename)
-        file.save(file_path)
-        
-        # Return the relative path
-        return os.path.join('channel_images', filename)
+        return image_store.store(file.read())
     return None
 
+def stored_image_url(image_hash, size=None):
+    """URL of a stored image, or of its thumbnail of the given size"""
+    if size:
+        return url_for('channel_api.get_image', image_hash=image_hash, size=size, _external=True)
+    return url_for('channel_api.get_image', image_hash=image_hash, _external=True)
+
+def channel_image_urls(image, cached=None, size=DEFAULT_THUMBNAIL_SIZE):
+    """
+    (image URL, thumbnail URL) of a channel_images row. Remote images in
+    cached (hashes by URL, from image_store.cached) are served from the store.
+    """
+    if image['image_hash']:
+        return stored_image_url(image['image_hash']), stored_image_url(image['image_hash'], size)
+    if image['image_path']:
+        url = url_for('static', filename=image['image_path'], _external=True)
+        return url, url
+    if image['image_url'] and cached and image['image_url'] in cached:
+        image_hash = cached[image['image_url']]
+        return stored_image_url(image_hash), stored_image_url(image_hash, size)
+    return image['image_url'], None
+
 # API Routes
 
 @channel_api.route('/api/channels', methods=['GET'])
@@ -112,42 +166,24 @@ def get_channels():
     if sort_dir not in ['asc', 'desc']:
         sort_dir = 'asc'
     
-    # Get the M3U data
-    m3u_path = os.path.join('data/m3u_proxy', proxy_id, 'playlist.m3u')
-    if not os.path.exists(m3u_path):
+    # Make sure the indexed copy of the M3U is current
+    if not channel_store.ensure_indexed(proxy_id):
         return jsonify({"error": "M3U file not found"}), 404
     
-    # Parse the M3U file
-    channels = parse_m3u_channels(m3u_path)
-    
-    # Apply search filter
-    if search:
-        search_lower = search.lower()
-        channels = [c for c in channels if search_lower in c['name'].lower()]
-    
-    # Apply category filter
-    if category:
-        channels = [c for c in channels if c['group'] == category]
-    
-    # Get total count before pagination
-    total_channels = len(channels)
-    
-    # Apply sorting
-    reverse = sort_dir == 'desc'
-    if sort_by == 'name':
-        channels.sort(key=lambda x: x['name'].lower(), reverse=reverse)
-    elif sort_by == 'number':
-        channels.sort(key=lambda x: x['number'] or 0, reverse=reverse)
-    elif sort_by == 'group':
-        channels.sort(key=lambda x: x['group'].lower(), reverse=reverse)
-    
-    # Add image URLs to channels
-    channels = add_channel_images(channels, proxy_id)
-    
-    # Apply pagination
-    start_idx = (page - 1) * page_size
-    end_idx = start_idx + page_size
-    paginated_channels = channels[start_idx:end_idx]
+    # Filter, sort and paginate in the database
+    total_channels = channel_store.count(proxy_id, search=search, group=category)
+    paginated_channels = channel_store.query(
+        proxy_id,
+        search=search,
+        group=category,
+        sort_by=sort_by,
+        sort_dir=sort_dir,
+        limit=page_size,
+        offset=max(page - 1, 0) * page_size
+    )
+    
+    # Add image URLs to the page's channels
+    paginated_channels = add_channel_images(paginated_channels, proxy_id)
     
     # Calculate total pages
     total_pages = (total_channels + page_size - 1) // page_size
@@ -166,14 +202,12 @@ def get_categories():
     if not proxy_id:
         return jsonify({"error": "proxy_id is required"}), 400
     
-    # Get the M3U data
-    m3u_path = os.path.join('data/m3u_proxy', proxy_id, 'playlist.m3u')
-    if not os.path.exists(m3u_path):
+    # Make sure the indexed copy of the M3U is current
+    if not channel_store.ensure_indexed(proxy_id):
         return jsonify({"error": "M3U file not found"}), 404
     
-    # Parse the M3U file and extract unique categories
-    channels = parse_m3u_channels(m3u_path)
-    categories = sorted(list(set(c['group'] for c in channels if c['group'])))
+    # Unique categories come straight from the group index
+    categories = channel_store.groups(proxy_id)
     
     return jsonify(categories)
 
@@ -355,53 +389,44 @@ def set_channel_image(channel_id):
     if not proxy_id:
         return jsonify({"error": "proxy_id is required"}), 400
     
+    # Handle file upload if present
+    image_hash = None
+    if 'image' in request.files:
+        file = request.files['image']
+        if file and file.filename:
+            try:
+                image_hash = handle_image_upload(file)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+    
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        image_path = None
         
-        # Handle file upload if present
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename:
-                image_path = handle_image_upload(file)
-        
-        # Check if the channel already has an image
+        # Insert the image record, or replace the channel's image
         cursor.execute('''
-        SELECT * FROM channel_images
-        WHERE channel_id = ? AND proxy_id = ?
-        ''', (channel_id, proxy_id))
-        
-        existing_image = cursor.fetchone()
-        
-        if existing_image:
-            # Update existing image
-            cursor.execute('''
-            UPDATE channel_images
-            SET image_path = ?, image_url = ?, updated_at = ?
-            WHERE channel_id = ? AND proxy_id = ?
-            ''', (image_path, image_url, now, channel_id, proxy_id))
-        else:
-            # Insert new image record
-            cursor.execute('''
-            INSERT INTO channel_images (channel_id, proxy_id, image_path, image_url, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (channel_id, proxy_id, image_path, image_url, now, now))
+        INSERT INTO channel_images (proxy_id, channel_id, image_hash, image_path, image_url, created_at, updated_at)
+        VALUES (?, ?, ?, NULL, ?, ?, ?)
+        ON CONFLICT(proxy_id, channel_id) DO UPDATE SET
+            image_hash = excluded.image_hash, image_path = NULL,
+            image_url = excluded.image_url, updated_at = excluded.updated_at
+        ''', (proxy_id, channel_id, image_hash, image_url, now, now))
         
         conn.commit()
-        
-        # Generate image URL for response
-        image_url_response = None
-        if image_path:
-            image_url_response = url_for('static', filename=image_path, _external=True)
-        elif image_url:
-            image_url_response = image_url
-        
-        return jsonify({
-            "message": "Channel image updated successfully",
-            "imageUrl": image_url_response
-        })
+    
+    # Cache a new remote image in the background, if that is turned on
+    if not image_hash and image_url:
+        image_store.enqueue([image_url])
+    
+    image_url_response, thumbnail_url = channel_image_urls({
+        'image_hash': image_hash, 'image_path': None, 'image_url': image_url
+    })
+    return jsonify({
+        "message": "Channel image updated successfully",
+        "imageUrl": image_url_response,
+        "thumbnailUrl": thumbnail_url
+    })
 
 @channel_api.route('/api/channels/<channel_id>/image', methods=['GET'])
 def get_channel_image(channel_id):
@@ -424,97 +449,76 @@ def get_channel_image(channel_id):
         
         if not image:
             return jsonify({"error": "Image not found"}), 404
-        
-        # Generate image URL for response
-        image_url_response = None
-        if image['image_path']:
-            image_url_response = url_for('static', filename=image['image_path'], _external=True)
-        elif image['image_url']:
-            image_url_response = image['image_url']
-        
-        return jsonify({
-            "imageUrl": image_url_response
-        })
+    
+    image_url_response, thumbnail_url = channel_image_urls(image, image_store.cached([image['image_url']]))
+    return jsonify({
+        "imageUrl": image_url_response,
+        "thumbnailUrl": thumbnail_url
+    })
+
+@channel_api.route('/api/images/<image_hash>')
+@channel_api.route('/api/images/<image_hash>/<int:size>')
+def get_image(image_hash, size=None):
+    """Serve a stored image or one of its thumbnails; the URL always names the same bytes, so it is cached for good"""
+    if not re.fullmatch(r'[0-9a-f]{64}', image_hash):
+        return jsonify({"error": "Image not found"}), 404
+    if size is not None and size not in THUMBNAIL_SIZES:
+        return jsonify({"error": f"size must be one of {', '.join(map(str, THUMBNAIL_SIZES))}"}), 400
+    
+    content_type = image_store.content_type(image_hash)
+    if content_type is None or not os.path.exists(image_store.path(image_hash)):
+        return jsonify({"error": "Image not found"}), 404
+    
+    image = (image_store.path(image_hash), content_type)
+    if size is not None:
+        image = image_store.thumbnail(image_hash, size)
+        if image is None:
+            # No thumbnail (yet): don't let the original be cached for good under the thumbnail's URL
+            return redirect(stored_image_url(image_hash))
+    
+    # Absolute, since Flask's send_file resolves relative paths against the app
+    response = send_file(
+        os.path.abspath(image[0]),
+        mimetype=image[1],
+        etag=f"{image_hash}-{size}" if size else image_hash,
+        conditional=True,
+        max_age=CACHE_MAX_AGE
+    )
+    response.cache_control.immutable = True
+    return response
 
 # Helper functions
 
-def parse_m3u_channels(m3u_path):
-    """Parse an M3U file and extract channels"""
-    channels = []
-    
-    with open(m3u_path, 'r', encoding='utf-8', errors='ignore') as f:
-        lines = f.readlines()
-    
-    channel_id = 0
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        if line.startswith('#EXTINF:'):
-            channel_id += 1
-            
-            # Extract channel properties
-            # tvg-id, tvg-name, tvg-logo, group-title, tvg-chno
-            tvg_id_match = re.search(r'tvg-id="([^"]*)"', line)
-            tvg_name_match = re.search(r'tvg-name="([^"]*)"', line)
-            tvg_logo_match = re.search(r'tvg-logo="([^"]*)"', line)
-            group_match = re.search(r'group-title="([^"]*)"', line)
-            tvg_chno_match = re.search(r'tvg-chno="([^"]*)"', line)
-            
-            # Extract channel name (everything after the last comma)
-            name_parts = line.split(',')
-            name = name_parts[-1].strip() if len(name_parts) > 1 else ""
-            
-            # Get the URL from the next line
-            if i + 1 < len(lines):
-                url = lines[i + 1].strip()
-                
-                channel = {
-                    'id': str(channel_id),
-                    'name': name,
-                    'url': url,
-                    'group': group_match.group(1) if group_match else "",
-                    'number': int(tvg_chno_match.group(1)) if tvg_chno_match else channel_id,
-                    'tvg_id': tvg_id_match.group(1) if tvg_id_match else "",
-                    'tvg_name': tvg_name_match.group(1) if tvg_name_match else name,
-                    'tvg_logo': tvg_logo_match.group(1) if tvg_logo_match else ""
-                }
-                
-                channels.append(channel)
-                i += 2  # Skip the URL line
-            else:
-                i += 1
-        else:
-            i += 1
+def add_channel_images(channels, proxy_id, thumbnail_size=DEFAULT_THUMBNAIL_SIZE):
+    """Add image and thumbnail URLs and user category IDs to channels from the database"""
+    if not channels:
+        return channels
     
-    return channels
-
-def add_channel_images(channels, proxy_id):
-    """Add image URLs to channels from the database"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
-        # Get all channel images for this proxy
+        # Look up just these channels by (proxy_id, channel_id), in the page's order
         cursor.execute('''
-        SELECT channel_id, image_path, image_url FROM channel_images
-        WHERE proxy_id = ?
-        ''', (proxy_id,))
-        
-        images = cursor.fetchall()
-        
-        # Convert to dict for easy lookup
-        image_dict = {img['channel_id']: img for img in images}
-        
-        # Add image URLs to channels
-        for channel in channels:
-            channel['imageUrl'] = None
-            
-            if channel['id'] in image_dict:
-                img = image_dict[channel['id']]
-                if img['image_path']:
-                    channel['imageUrl'] = url_for('static', filename=img['image_path'], _external=True)
-                elif img['image_url']:
-                    channel['imageUrl'] = img['image_url']
+        SELECT ci.image_hash, ci.image_path, ci.image_url,
+               (SELECT json_group_array(cc.category_id) FROM channel_categories cc
+                WHERE cc.proxy_id = ? AND cc.channel_id = page.value) AS category_ids
+        FROM json_each(?) page
+        LEFT JOIN channel_images ci ON ci.proxy_id = ? AND ci.channel_id = page.value
+        ORDER BY page.key
+        ''', (proxy_id, json.dumps([channel['id'] for channel in channels]), proxy_id))
+        rows = cursor.fetchall()
+    
+    # Remote images (the channel's image URL, else its tvg-logo) served from the store once cached
+    remote = [row['image_url'] or channel.get('tvg_logo') for channel, row in zip(channels, rows)]
+    cached = image_store.cached(remote)
+    
+    # Add image URLs and categories to channels
+    for channel, row, url in zip(channels, rows, remote):
+        channel['imageUrl'], channel['thumbnailUrl'] = channel_image_urls(row, cached, thumbnail_size)
+        if channel['thumbnailUrl'] is None and url in cached:
+            channel['thumbnailUrl'] = stored_image_url(cached[url], thumbnail_size)
+        channel['userCategories'] = json.loads(row['category_ids'])
+    image_store.enqueue(url for url in remote if url and url not in cached)
     
     return channels
 
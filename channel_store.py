@@ -0,0 +1,988 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+import db
+from search_index import search_index
+from m3u_editor import (
+    EXTINF_ATTRIBUTE_PATTERN, EXTINF_DURATION_PATTERN, assign_channel_numbers, existing_channel_number,
+    format_extinf, is_vod_entry
+)
+
+logger = logging.getLogger(__name__)
+
+# Where proxied playlists are stored (see m3u_editor.M3UProxyManager)
+PROXY_STORAGE_DIR = 'data/m3u_proxy'
+
+# Columns a channel list can be sorted by, mapped to their indexed sort keys
+SORT_COLUMNS = {
+    'name': 'name_lower',
+    'number': 'number',
+    'group': 'group_lower',
+    'position': 'position'
+}
+
+# Trigram search needs at least this many characters; shorter searches scan the proxy's rows
+MIN_FTS_SEARCH_LENGTH = 3
+
+# Channels inserted per executemany batch while indexing
+INDEX_BATCH_SIZE = 5000
+
+# Channels fetched per batch while writing playlist.m3u from the table
+MATERIALIZE_BATCH_SIZE = 5000
+
+# Channels edited since the search indexes were last refreshed (name is NULL for removed channels)
+PENDING_TABLE = 'proxy_channel_pending'
+
+ATTRIBUTE_PATTERNS = {
+    'tvg_id': re.compile(r'tvg-id="([^"]*)"'),
+    'tvg_name': re.compile(r'tvg-name="([^"]*)"'),
+    'tvg_logo': re.compile(r'tvg-logo="([^"]*)"'),
+    'group': re.compile(r'group-title="([^"]*)"'),
+    'tvg_chno': re.compile(r'tvg-chno="([^"]*)"')
+}
+
+def channel_number(tvg_chno, position):
+    """Number of a channel: its tvg-chno, or its (1-based) position for channels without a usable one"""
+    try:
+        return int(tvg_chno) if tvg_chno is not None else position
+    except ValueError:
+        return position
+
+def entry_hash(extinf_line, url):
+    """Short fingerprint of a playlist entry, to tell when an upstream channel changed"""
+    return hashlib.blake2b(f'{extinf_line}\n{url}'.encode('utf-8'), digest_size=8).hexdigest()
+
+def channel_key(tvg_id, tvg_name, url):
+    """
+    Stable ID of a channel, from its tvg-id, tvg-name and the host and path
+    of its URL, so it survives reordering, renumbering and rotating tokens
+    in the query string or credentials
+    """
+    location = (url or '').split('://', 1)[-1].split('?', 1)[0].split('#', 1)[0]
+    host, _, path = location.partition('/')
+    host = host.rpartition('@')[2].lower()
+    return hashlib.blake2b(f'{tvg_id}\n{tvg_name}\n{host}/{path}'.encode('utf-8'), digest_size=8).hexdigest()
+
+def unique_channel_keys(entries):
+    """Channel keys of (tvg_id, tvg_name, url) entries in playlist order; repeats of a key get -2, -3... appended"""
+    seen = {}
+    keys = []
+    for tvg_id, tvg_name, url in entries:
+        key = channel_key(tvg_id, tvg_name, url)
+        count = seen[key] = seen.get(key, 0) + 1
+        keys.append(key if count == 1 else f'{key}-{count}')
+    return keys
+
+def parse_m3u_playlist(m3u_path):
+    """Parse an M3U file into its header lines and channels"""
+    headers = []
+    channels = []
+
+    with open(m3u_path, 'r', encoding='utf-8', errors='ignore') as f:
+        lines = f.readlines()
+
+    position = 0
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+
+        if line.startswith('#EXTINF:'):
+            position += 1
+
+            # Extract channel properties
+            # tvg-id, tvg-name, tvg-logo, group-title, tvg-chno
+            attributes = {}
+            for key, pattern in ATTRIBUTE_PATTERNS.items():
+                match = pattern.search(line)
+                attributes[key] = match.group(1) if match else None
+
+            # Extract channel name (everything after the last comma)
+            name_parts = line.split(',')
+            name = name_parts[-1].strip() if len(name_parts) > 1 else ""
+
+            # Get the URL from the next line
+            if i + 1 < len(lines):
+                url = lines[i + 1].strip()
+
+                # Duration and all attributes, in order, so the playlist can be written back
+                duration = EXTINF_DURATION_PATTERN.search(line)
+
+                channel = {
+                    'name': name,
+                    'url': url,
+                    'group': attributes['group'] or "",
+                    'number': channel_number(attributes['tvg_chno'], position),
+                    'tvg_id': attributes['tvg_id'] or "",
+                    'tvg_name': attributes['tvg_name'] if attributes['tvg_name'] is not None else name,
+                    'tvg_logo': attributes['tvg_logo'] or "",
+                    'duration': duration.group(1) if duration else "-1",
+                    'attributes': dict(EXTINF_ATTRIBUTE_PATTERN.findall(line)),
+                    'source_hash': entry_hash(line, url)
+                }
+
+                channels.append(channel)
+                i += 2  # Skip the URL line
+            else:
+                i += 1
+        else:
+            # Header lines (#EXTM3U and other directives) are kept as they are
+            if line and (line.startswith('#') or not headers and not channels):
+                headers.append(line)
+            i += 1
+
+    keys = unique_channel_keys((channel['tvg_id'], channel['tvg_name'], channel['url']) for channel in channels)
+    for channel, key in zip(channels, keys):
+        channel['id'] = key
+
+    return headers, channels
+
+def parse_m3u_channels(m3u_path):
+    """Parse an M3U file and extract channels"""
+    return parse_m3u_playlist(m3u_path)[1]
+
+class ChannelStore:
+    """
+    Each proxy's channels as a table, the version the proxy edits work on.
+
+    A proxy's playlist.m3u is parsed into the proxy_channels table the first
+    time it is used, and again only when the file's mtime or size changes,
+    so each request costs a stat. Filtering, sorting and paging run in
+    SQLite on indexes over group, number and lowercased name, and searches
+    use an FTS5 trigram index, which keeps the substring matching of the
+    old in-memory filter.
+
+    Edits (renames, renumbering, filters) are applied to the table as set
+    updates, bump the proxy's revision and are recorded in the
+    proxy_operations log. playlist.m3u is only written again by
+    materialize(), when the playlist is served or loaded. The channels an
+    edit touched are applied to the trigram and search indexes in the
+    background; until then the proxy's searches scan its rows.
+    """
+
+    def __init__(self, db_file=db.DB_FILE, storage_dir=PROXY_STORAGE_DIR):
+        """Create the channel tables if needed"""
+        self.db_file = db_file
+        self.storage_dir = storage_dir
+        self.lock = threading.Lock()
+        # Source keys of proxies known to be indexed, so most requests skip the sources query
+        self._indexed = {}
+        self.fts_enabled = True
+
+        with self._connect() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS proxy_channels (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                proxy_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                channel_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                name_lower TEXT NOT NULL,
+                url TEXT,
+                group_title TEXT NOT NULL,
+                group_lower TEXT NOT NULL,
+                number INTEGER,
+                tvg_id TEXT,
+                tvg_name TEXT,
+                tvg_logo TEXT,
+                duration TEXT,
+                attributes TEXT,
+                source_hash TEXT
+            )
+            ''')
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_proxy_channels_position ON proxy_channels (proxy_id, position)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_proxy_channels_name ON proxy_channels (proxy_id, name_lower, position)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_proxy_channels_number ON proxy_channels (proxy_id, number, position)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_proxy_channels_group ON proxy_channels (proxy_id, group_lower, position)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_proxy_channels_group_title ON proxy_channels (proxy_id, group_title, position)')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS proxy_channel_sources (
+                proxy_id TEXT PRIMARY KEY,
+                source_mtime_ns INTEGER NOT NULL,
+                source_size INTEGER NOT NULL,
+                channel_count INTEGER NOT NULL,
+                indexed_at TEXT NOT NULL,
+                headers TEXT,
+                revision INTEGER NOT NULL DEFAULT 0,
+                materialized_revision INTEGER NOT NULL DEFAULT 0
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS proxy_operations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                proxy_id TEXT NOT NULL,
+                revision INTEGER NOT NULL,
+                operation TEXT NOT NULL,
+                params TEXT,
+                affected INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_proxy_operations_proxy ON proxy_operations (proxy_id, id)')
+            conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {PENDING_TABLE} (
+                id INTEGER PRIMARY KEY,
+                proxy_id TEXT NOT NULL,
+                ref TEXT NOT NULL,
+                name TEXT
+            )
+            ''')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_proxy_channel_pending_proxy ON {PENDING_TABLE} (proxy_id)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_proxy_channel_pending_ref ON {PENDING_TABLE} (ref)')
+
+            # Columns added after the first release; proxies indexed without them are parsed again
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(proxy_channels)')}
+            if 'attributes' not in existing:
+                conn.execute('ALTER TABLE proxy_channels ADD COLUMN duration TEXT')
+                conn.execute('ALTER TABLE proxy_channels ADD COLUMN attributes TEXT')
+                conn.execute('DELETE FROM proxy_channel_sources')
+            if 'source_hash' not in existing:
+                conn.execute('ALTER TABLE proxy_channels ADD COLUMN source_hash TEXT')
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(proxy_channel_sources)')}
+            for column, definition in (
+                ('headers', 'TEXT'),
+                ('revision', 'INTEGER NOT NULL DEFAULT 0'),
+                ('materialized_revision', 'INTEGER NOT NULL DEFAULT 0'),
+                # 0 while the proxy's channel IDs are still running counters (see migrate_channel_keys)
+                ('channel_keys', 'INTEGER NOT NULL DEFAULT 0')
+            ):
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE proxy_channel_sources ADD COLUMN {column} {definition}')
+
+            try:
+                # rowid of each row is the id of its proxy_channels row
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS proxy_channels_fts USING fts5(name, tokenize='trigram')")
+            except sqlite3.OperationalError as e:
+                logger.warning(f"FTS5 trigram search unavailable, channel search will scan: {str(e)}")
+                self.fts_enabled = False
+
+    def _connect(self):
+        """Open a connection that waits for other writers instead of failing"""
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def playlist_path(self, proxy_id):
+        return os.path.join(self.storage_dir, proxy_id, 'playlist.m3u')
+
+    def _source(self, conn, proxy_id):
+        return conn.execute(
+            '''SELECT source_mtime_ns, source_size, channel_count, headers, revision, materialized_revision
+               FROM proxy_channel_sources WHERE proxy_id = ?''',
+            (proxy_id,)
+        ).fetchone()
+
+    def ensure_indexed(self, proxy_id):
+        """
+        Index the proxy's playlist if it changed since it was last indexed;
+        returns False if the proxy doesn't exist. Edits not yet written to
+        playlist.m3u make the table the current version.
+        """
+        try:
+            stat = os.stat(self.playlist_path(proxy_id))
+            source_key = (stat.st_mtime_ns, stat.st_size)
+        except (FileNotFoundError, NotADirectoryError):
+            source_key = None
+        if source_key is not None and self._indexed.get(proxy_id) == source_key:
+            return True
+
+        with self.lock, self._connect() as conn:
+            row = self._source(conn, proxy_id)
+            if row is not None and row['revision'] != row['materialized_revision']:
+                return True
+            if source_key is None:
+                return False
+            if row is None or (row['source_mtime_ns'], row['source_size']) != source_key:
+                self._index(conn, proxy_id, source_key)
+        self._indexed[proxy_id] = source_key
+        return True
+
+    def reload(self, proxy_id, source_hashes=None):
+        """
+        Index the proxy's playlist.m3u after it was replaced, discarding
+        edits not written to it. When playlist.m3u was written from an
+        upstream playlist, source_hashes are the entry_hash of each of its
+        channels upstream, in order, so the first sync compares channels
+        with what upstream had rather than with the rewritten lines.
+        """
+        stat = os.stat(self.playlist_path(proxy_id))
+        source_key = (stat.st_mtime_ns, stat.st_size)
+        with self.lock, self._connect() as conn:
+            self._index(conn, proxy_id, source_key, force=True, source_hashes=source_hashes)
+        self._indexed[proxy_id] = source_key
+
+    def _index(self, conn, proxy_id, source_key, force=False, source_hashes=None):
+        """Replace the proxy's rows with a fresh parse of its playlist"""
+        headers, channels = parse_m3u_playlist(self.playlist_path(proxy_id))
+        if source_hashes is not None:
+            if len(source_hashes) == len(channels):
+                for channel, source_hash in zip(channels, source_hashes):
+                    channel['source_hash'] = source_hash
+            else:
+                logger.warning(f"Proxy {proxy_id} has {len(channels)} channels but {len(source_hashes)} upstream hashes, keeping its own")
+
+        conn.execute('BEGIN IMMEDIATE')
+        row = self._source(conn, proxy_id)
+        if not force and row is not None and (
+                (row['source_mtime_ns'], row['source_size']) == source_key or row['revision'] != row['materialized_revision']):
+            # Another worker process indexed this version or edited the proxy meanwhile
+            conn.rollback()
+            return
+
+        self._delete_rows(conn, proxy_id)
+        self._insert_channels(conn, proxy_id, channels)
+        search_index.replace_channels(conn, proxy_id)
+        # The revision carries on, so the operation log stays in order
+        revision = row['revision'] if row is not None else 0
+        conn.execute(
+            '''INSERT OR REPLACE INTO proxy_channel_sources
+               (proxy_id, source_mtime_ns, source_size, channel_count, indexed_at, headers, revision, materialized_revision,
+                channel_keys)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)''',
+            (proxy_id, source_key[0], source_key[1], len(channels), datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+             json.dumps(headers), revision, revision)
+        )
+        conn.commit()
+        logger.info(f"Indexed {len(channels)} channels of proxy {proxy_id}")
+
+    @staticmethod
+    def _insert_rows(conn, proxy_id, positioned_channels):
+        """Insert (position, channel) pairs, channels being dicts shaped like parse_m3u_playlist's"""
+        conn.executemany(
+            '''INSERT INTO proxy_channels
+               (proxy_id, position, channel_id, name, name_lower, url, group_title, group_lower,
+                number, tvg_id, tvg_name, tvg_logo, duration, attributes, source_hash)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            [
+                (proxy_id, position, channel['id'], channel['name'], channel['name'].lower(), channel['url'],
+                 channel['group'], channel['group'].lower(), channel['number'],
+                 channel['tvg_id'], channel['tvg_name'], channel['tvg_logo'],
+                 channel['duration'], json.dumps(channel['attributes']), channel.get('source_hash'))
+                for position, channel in positioned_channels
+            ]
+        )
+
+    def _insert_channels(self, conn, proxy_id, channels):
+        """Insert channels (dicts shaped like parse_m3u_playlist's) in playlist order"""
+        for start in range(0, len(channels), INDEX_BATCH_SIZE):
+            self._insert_rows(conn, proxy_id, enumerate(channels[start:start + INDEX_BATCH_SIZE], start=start))
+        if self.fts_enabled:
+            conn.execute(
+                'INSERT INTO proxy_channels_fts (rowid, name) SELECT id, name FROM proxy_channels WHERE proxy_id = ?',
+                (proxy_id,)
+            )
+
+    def _delete_rows(self, conn, proxy_id):
+        if self.fts_enabled:
+            conn.execute(
+                f'''DELETE FROM proxy_channels_fts WHERE rowid IN (
+                       SELECT id FROM proxy_channels WHERE proxy_id = ?
+                       UNION ALL SELECT id FROM {PENDING_TABLE} WHERE proxy_id = ? AND name IS NULL)''',
+                (proxy_id, proxy_id)
+            )
+        conn.execute(f'DELETE FROM {PENDING_TABLE} WHERE proxy_id = ?', (proxy_id,))
+        conn.execute('DELETE FROM proxy_channels WHERE proxy_id = ?', (proxy_id,))
+
+    def drop(self, proxy_id):
+        """Forget a deleted proxy's channels"""
+        self._indexed.pop(proxy_id, None)
+        with self.lock, self._connect() as conn:
+            self._delete_rows(conn, proxy_id)
+            search_index.drop_channels(conn, proxy_id)
+            conn.execute('DELETE FROM proxy_channel_sources WHERE proxy_id = ?', (proxy_id,))
+            conn.execute('DELETE FROM proxy_operations WHERE proxy_id = ?', (proxy_id,))
+
+    def reindex_search(self, only_missing=False):
+        """Index every stored proxy, then rebuild the search documents of indexed proxies (only_missing: those without any)"""
+        if not search_index.enabled:
+            return
+        if os.path.isdir(self.storage_dir):
+            for proxy_id in os.listdir(self.storage_dir):
+                self.ensure_indexed(proxy_id)
+        query = 'SELECT proxy_id FROM proxy_channel_sources'
+        if only_missing:
+            query += " WHERE proxy_id NOT IN (SELECT scope FROM search_documents WHERE kind = 'channel')"
+        with self.lock, self._connect() as conn:
+            proxy_ids = [row['proxy_id'] for row in conn.execute(query)]
+            for proxy_id in proxy_ids:
+                search_index.replace_channels(conn, proxy_id)
+            conn.commit()
+
+    def migrate_channel_keys(self, dependents=()):
+        """
+        Replace the running-counter channel IDs given before channel keys
+        with the channels' keys, in proxy_channels and in the dependents
+        (tables with proxy_id and channel_id columns), in one transaction.
+        Proxies that were never indexed are mapped from a parse of their
+        playlist. Returns the number of proxies migrated.
+        """
+        with self.lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            indexed = [row['proxy_id'] for row in conn.execute('SELECT proxy_id FROM proxy_channel_sources WHERE channel_keys = 0')]
+            unindexed = set()
+            for table in dependents:
+                unindexed.update(row['proxy_id'] for row in conn.execute(
+                    f'''SELECT DISTINCT proxy_id FROM {table}
+                        WHERE channel_id NOT GLOB '*[^0-9]*'
+                          AND proxy_id NOT IN (SELECT proxy_id FROM proxy_channel_sources)'''
+                ))
+            if not indexed and not unindexed:
+                conn.rollback()
+                return 0
+
+            conn.execute('CREATE TABLE IF NOT EXISTS temp.channel_key_map (proxy_id TEXT, old_id TEXT, new_id TEXT, PRIMARY KEY (proxy_id, old_id))')
+            conn.execute('DELETE FROM temp.channel_key_map')
+            for proxy_id in indexed:
+                rows = conn.execute(
+                    'SELECT channel_id, tvg_id, tvg_name, url FROM proxy_channels WHERE proxy_id = ? ORDER BY position',
+                    (proxy_id,)
+                ).fetchall()
+                keys = unique_channel_keys((row['tvg_id'], row['tvg_name'], row['url']) for row in rows)
+                conn.executemany(
+                    'INSERT OR IGNORE INTO temp.channel_key_map VALUES (?, ?, ?)',
+                    [(proxy_id, row['channel_id'], key) for row, key in zip(rows, keys)]
+                )
+            for proxy_id in unindexed:
+                try:
+                    _, channels = parse_m3u_playlist(self.playlist_path(proxy_id))
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+                # The old ID of a channel was its position in the playlist
+                conn.executemany(
+                    'INSERT OR IGNORE INTO temp.channel_key_map VALUES (?, ?, ?)',
+                    [(proxy_id, str(position), channel['id']) for position, channel in enumerate(channels, start=1)]
+                )
+
+            conn.execute(
+                '''UPDATE proxy_channels SET channel_id = m.new_id
+                   FROM temp.channel_key_map m
+                   WHERE proxy_channels.proxy_id = m.proxy_id AND proxy_channels.channel_id = m.old_id'''
+            )
+            conn.execute(
+                f'''UPDATE {PENDING_TABLE} SET ref = m.proxy_id || ':' || m.new_id
+                    FROM temp.channel_key_map m
+                    WHERE {PENDING_TABLE}.ref = m.proxy_id || ':' || m.old_id'''
+            )
+            for table in dependents:
+                # OR IGNORE: a row whose key is taken by another row of the channel is left as it was
+                conn.execute(
+                    f'''UPDATE OR IGNORE {table} SET channel_id = m.new_id
+                        FROM temp.channel_key_map m
+                        WHERE {table}.proxy_id = m.proxy_id AND {table}.channel_id = m.old_id'''
+                )
+            for proxy_id in indexed:
+                search_index.replace_channels(conn, proxy_id)
+            conn.execute('UPDATE proxy_channel_sources SET channel_keys = 1 WHERE channel_keys = 0')
+            conn.commit()
+
+        migrated = len(indexed) + len(unindexed)
+        logger.info(f"Moved the channels of {migrated} proxies to stable channel keys")
+        return migrated
+
+    # Edits
+
+    def _log_edit(self, conn, proxy_id, operation, params, affected):
+        """Record an edit in the operation log, bumping the revision if it changed anything"""
+        if affected:
+            conn.execute(
+                '''UPDATE proxy_channel_sources
+                   SET revision = revision + 1,
+                       channel_count = (SELECT COUNT(*) FROM proxy_channels WHERE proxy_id = ?)
+                   WHERE proxy_id = ?''',
+                (proxy_id, proxy_id)
+            )
+        row = self._source(conn, proxy_id)
+        self._append_operation(conn, proxy_id, row['revision'], operation, params, affected)
+        pending = conn.execute(f'SELECT 1 FROM {PENDING_TABLE} WHERE proxy_id = ? LIMIT 1', (proxy_id,)).fetchone()
+        conn.commit()
+        if pending:
+            threading.Thread(target=self.refresh_indexes, args=(proxy_id,), daemon=True).start()
+        return {'changed': affected, 'channel_count': row['channel_count'], 'revision': row['revision']}
+
+    @staticmethod
+    def _append_operation(conn, proxy_id, revision, operation, params, affected):
+        conn.execute(
+            '''INSERT INTO proxy_operations (proxy_id, revision, operation, params, affected, created_at)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            (proxy_id, revision, operation, json.dumps(params), affected, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        )
+
+    def rename_channels(self, proxy_id, rename, operation='rename', params=None):
+        """
+        Apply rename (a function of the channel name) to every channel of a
+        proxy. rename runs once per distinct name and only channels whose
+        name changes are written. Returns the edit's result, or None if the
+        proxy doesn't exist.
+        """
+        if not self.ensure_indexed(proxy_id):
+            return None
+        with self.lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            names = [row[0] for row in conn.execute('SELECT DISTINCT name FROM proxy_channels WHERE proxy_id = ?', (proxy_id,))]
+            renamed = []
+            for name in names:
+                new_name = rename(name)
+                if new_name != name:
+                    renamed.append((name, new_name, new_name.lower()))
+
+            conn.execute('CREATE TABLE IF NOT EXISTS temp.renamed_names (name TEXT PRIMARY KEY, new_name TEXT, new_name_lower TEXT)')
+            conn.execute('DELETE FROM temp.renamed_names')
+            conn.executemany('INSERT INTO temp.renamed_names VALUES (?, ?, ?)', renamed)
+            conn.execute(
+                f'''INSERT OR REPLACE INTO {PENDING_TABLE} (id, proxy_id, ref, name)
+                    SELECT pc.id, pc.proxy_id, pc.proxy_id || ':' || pc.channel_id, r.new_name
+                    FROM proxy_channels pc JOIN temp.renamed_names r ON r.name = pc.name
+                    WHERE pc.proxy_id = ?''',
+                (proxy_id,)
+            )
+            # The tvg-name attribute is always written with the channel name
+            affected = conn.execute(
+                '''UPDATE proxy_channels
+                   SET name = r.new_name, name_lower = r.new_name_lower, tvg_name = r.new_name
+                   FROM temp.renamed_names r
+                   WHERE proxy_channels.proxy_id = ? AND proxy_channels.name = r.name''',
+                (proxy_id,)
+            ).rowcount
+            return self._log_edit(conn, proxy_id, operation, params or {}, affected)
+
+    def renumber_channels(self, proxy_id, start_number=1, by_group=False, group_order=None,
+                          group_starts=None, preserve_existing=False):
+        """
+        Renumber channels as M3UEditor.renumber_channels does (see
+        assign_channel_numbers); only channels whose number changes are
+        written. Returns the edit's result, or None if the proxy doesn't exist.
+        """
+        if not self.ensure_indexed(proxy_id):
+            return None
+        with self.lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                '''SELECT id, group_title, json_extract(attributes, '$."tvg-chno"') AS tvg_chno
+                   FROM proxy_channels WHERE proxy_id = ? ORDER BY position''',
+                (proxy_id,)
+            ).fetchall()
+            channels = [(row['group_title'], existing_channel_number(row['tvg_chno'])) for row in rows]
+            numbers = [
+                (rows[index]['id'], number)
+                for index, number in assign_channel_numbers(channels, start_number, by_group, group_order,
+                                                            group_starts, preserve_existing)
+                if rows[index]['tvg_chno'] != str(number)
+            ]
+
+            affected = self._write_numbers(conn, numbers)
+            return self._log_edit(conn, proxy_id, 'renumber', {
+                'start_number': start_number,
+                'by_group': by_group,
+                'group_order': list(group_order or ()),
+                'group_starts': group_starts or {},
+                'preserve_existing': preserve_existing
+            }, affected)
+
+    @staticmethod
+    def _write_numbers(conn, numbers):
+        """Set the number and tvg-chno of rows given as (row id, number); returns the rows written"""
+        conn.execute('CREATE TABLE IF NOT EXISTS temp.channel_numbers (id INTEGER PRIMARY KEY, number INTEGER)')
+        conn.execute('DELETE FROM temp.channel_numbers')
+        conn.executemany('INSERT INTO temp.channel_numbers VALUES (?, ?)', numbers)
+        return conn.execute(
+            '''UPDATE proxy_channels
+               SET number = n.number, attributes = json_set(attributes, '$."tvg-chno"', CAST(n.number AS TEXT))
+               FROM temp.channel_numbers n
+               WHERE proxy_channels.id = n.id'''
+        ).rowcount
+
+    def filter_vod(self, proxy_id, keep_live_only=True):
+        """
+        Remove VOD entries (or live channels when keep_live_only is False).
+        Returns the edit's result, or None if the proxy doesn't exist.
+        """
+        if not self.ensure_indexed(proxy_id):
+            return None
+        with self.lock, self._connect() as conn:
+            conn.create_function('is_vod', 3, is_vod_entry, deterministic=True)
+            conn.execute('BEGIN IMMEDIATE')
+            removed = conn.execute(
+                f'''INSERT OR REPLACE INTO {PENDING_TABLE} (id, proxy_id, ref, name)
+                    SELECT id, proxy_id, proxy_id || ':' || channel_id, NULL FROM proxy_channels
+                    WHERE proxy_id = ? AND is_vod(url, group_title, tvg_id) = ?''',
+                (proxy_id, 1 if keep_live_only else 0)
+            ).rowcount
+            if removed:
+                conn.execute(
+                    f'''DELETE FROM proxy_channels
+                        WHERE id IN (SELECT id FROM {PENDING_TABLE} WHERE proxy_id = ? AND name IS NULL)''',
+                    (proxy_id,)
+                )
+            affected = removed
+            return self._log_edit(conn, proxy_id, 'filter_vod', {'keep_live_only': keep_live_only}, affected)
+
+    def copy_filtered(self, proxy_id, new_proxy_id, group=None, name_contains=None):
+        """
+        Create new_proxy_id from the channels of proxy_id in group and/or
+        whose name contains name_contains, with the operation log of
+        proxy_id followed by the copy. Its playlist.m3u is written when
+        first served. Returns the number of channels copied, or None if the
+        proxy doesn't exist.
+        """
+        if not self.ensure_indexed(proxy_id):
+            return None
+        clauses = ['proxy_id = ?']
+        params = [proxy_id]
+        if group:
+            clauses.append('group_title = ?')
+            params.append(group)
+        if name_contains:
+            clauses.append('instr(name_lower, ?) > 0')
+            params.append(name_contains.lower())
+
+        with self.lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            source = self._source(conn, proxy_id)
+            rows = conn.execute(
+                f'''SELECT channel_id, name, url, group_title, tvg_id, tvg_name, tvg_logo, duration, attributes, source_hash
+                    FROM proxy_channels WHERE {' AND '.join(clauses)} ORDER BY position''',
+                params
+            ).fetchall()
+            # Channels keep their keys, and are numbered as a fresh parse of the new playlist would number them
+            channels = []
+            for position, row in enumerate(rows, start=1):
+                attributes = json.loads(row['attributes'])
+                channels.append({
+                    'id': row['channel_id'],
+                    'name': row['name'],
+                    'url': row['url'],
+                    'group': row['group_title'],
+                    'number': channel_number(attributes.get('tvg-chno'), position),
+                    'tvg_id': row['tvg_id'],
+                    'tvg_name': row['tvg_name'],
+                    'tvg_logo': row['tvg_logo'],
+                    'duration': row['duration'],
+                    'attributes': attributes,
+                    'source_hash': row['source_hash']
+                })
+            self._delete_rows(conn, new_proxy_id)
+            self._insert_channels(conn, new_proxy_id, channels)
+            search_index.replace_channels(conn, new_proxy_id)
+            # Revision 1 is not written yet
+            conn.execute(
+                '''INSERT OR REPLACE INTO proxy_channel_sources
+                   (proxy_id, source_mtime_ns, source_size, channel_count, indexed_at, headers, revision, materialized_revision,
+                    channel_keys)
+                   VALUES (?, 0, 0, ?, ?, ?, 1, 0, 1)''',
+                (new_proxy_id, len(channels), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), source['headers'])
+            )
+            # The copy inherits the source's upstream url, so it inherits the recipe a sync replays too
+            conn.execute('DELETE FROM proxy_operations WHERE proxy_id = ?', (new_proxy_id,))
+            conn.execute(
+                '''INSERT INTO proxy_operations (proxy_id, revision, operation, params, affected, created_at)
+                   SELECT ?, 1, operation, params, affected, created_at FROM proxy_operations
+                   WHERE proxy_id = ? AND operation != 'sync' ORDER BY id''',
+                (new_proxy_id, proxy_id)
+            )
+            self._append_operation(conn, new_proxy_id, 1, 'copy_filtered', {
+                'source_proxy_id': proxy_id, 'group': group, 'name_contains': name_contains
+            }, len(channels))
+            conn.commit()
+            return len(channels)
+
+    def sync_channels(self, proxy_id, headers, channels, prepare, renumber=None):
+        """
+        Bring a proxy up to date with a fresh parse of its upstream playlist
+        (parse_m3u_playlist's headers and channels), matching channels by
+        tvg-id and URL. Channels unchanged upstream keep their rows as
+        edited. New and changed ones go through prepare, a function
+        returning those of them to keep (edited in place). They are then
+        numbered with renumber (renumber_channels' options) around the
+        numbers in use, or keep their upstream number when renumber is None.
+        Returns the edit's result with the channels added, updated and
+        removed, or None if the proxy doesn't exist.
+        """
+        if not self.ensure_indexed(proxy_id):
+            return None
+        with self.lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                '''SELECT id, channel_id, position, tvg_id, url, source_hash,
+                          json_extract(attributes, '$."tvg-chno"') AS tvg_chno
+                   FROM proxy_channels WHERE proxy_id = ? ORDER BY position''',
+                (proxy_id,)
+            ).fetchall()
+
+            # Rows by key, last first, so channels repeating a key pair up with its rows in order
+            existing = {}
+            for row in reversed(rows):
+                existing.setdefault((row['tvg_id'], row['url']), []).append(row)
+            matches = []
+            for channel in channels:
+                same = existing.get((channel['tvg_id'], channel['url']))
+                matches.append((same.pop() if same else None, channel))
+
+            fresh = [channel for row, channel in matches if row is None or row['source_hash'] != channel['source_hash']]
+            prepared = {id(channel) for channel in prepare(fresh)}
+            entries = [
+                (row, channel) for row, channel in matches
+                if id(channel) in prepared or (row is not None and row['source_hash'] == channel['source_hash'])
+            ]
+
+            # Numbers: rows keep theirs; new channels get free ones (or keep upstream's)
+            if renumber is not None:
+                numbering = []
+                for row, channel in entries:
+                    if row is not None:
+                        number = existing_channel_number(row['tvg_chno'])
+                    elif renumber.get('preserve_existing'):
+                        number = existing_channel_number(channel['attributes'].get('tvg-chno'))
+                    else:
+                        number = None
+                    numbering.append((channel['group'], number))
+                    if row is not None and number is not None and id(channel) in prepared:
+                        channel['attributes']['tvg-chno'] = str(number)
+                        channel['number'] = number
+                numbers = []
+                for index, number in assign_channel_numbers(
+                        numbering, renumber.get('start_number', 1), renumber.get('by_group', False),
+                        renumber.get('group_order'), renumber.get('group_starts'), preserve_existing=True):
+                    row, channel = entries[index]
+                    if id(channel) in prepared:
+                        channel['attributes']['tvg-chno'] = str(number)
+                        channel['number'] = number
+                    else:
+                        numbers.append((row['id'], number))
+            else:
+                numbers = []
+
+            kept_ids = {row['id'] for row, _ in entries if row is not None}
+            removed = [row for row in rows if row['id'] not in kept_ids]
+            changed = [(row, channel) for row, channel in entries if row is not None and id(channel) in prepared]
+            added = [(position, channel) for position, (row, channel) in enumerate(entries) if row is None]
+            # New channels keep their parsed keys, with the next free suffix if a kept row has the key
+            taken = {row['channel_id'] for row, _ in entries if row is not None}
+            for _, channel in added:
+                if channel['id'] in taken:
+                    key, count = channel['id'].split('-')[0], 2
+                    while f'{key}-{count}' in taken:
+                        count += 1
+                    channel['id'] = f'{key}-{count}'
+                taken.add(channel['id'])
+
+            conn.executemany(
+                f'INSERT OR REPLACE INTO {PENDING_TABLE} (id, proxy_id, ref, name) VALUES (?, ?, ?, NULL)',
+                [(row['id'], proxy_id, f"{proxy_id}:{row['channel_id']}") for row in removed]
+            )
+            conn.executemany('DELETE FROM proxy_channels WHERE id = ?', [(row['id'],) for row in removed])
+
+            # Positions are unique, so rows that move are parked on negative ones first
+            moved = [(row['id'], position) for position, (row, _) in enumerate(entries) if row is not None and row['position'] != position]
+            conn.execute('CREATE TABLE IF NOT EXISTS temp.channel_positions (id INTEGER PRIMARY KEY, position INTEGER)')
+            conn.execute('DELETE FROM temp.channel_positions')
+            conn.executemany('INSERT INTO temp.channel_positions VALUES (?, ?)', moved)
+            conn.execute('UPDATE proxy_channels SET position = -1 - position WHERE id IN (SELECT id FROM temp.channel_positions)')
+            conn.execute(
+                '''UPDATE proxy_channels SET position = p.position
+                   FROM temp.channel_positions p WHERE proxy_channels.id = p.id'''
+            )
+
+            conn.executemany(
+                '''UPDATE proxy_channels
+                   SET name = ?, name_lower = ?, url = ?, group_title = ?, group_lower = ?, number = ?,
+                       tvg_id = ?, tvg_name = ?, tvg_logo = ?, duration = ?, attributes = ?, source_hash = ?
+                   WHERE id = ?''',
+                [
+                    (channel['name'], channel['name'].lower(), channel['url'], channel['group'], channel['group'].lower(),
+                     channel['number'], channel['tvg_id'], channel['tvg_name'], channel['tvg_logo'],
+                     channel['duration'], json.dumps(channel['attributes']), channel['source_hash'], row['id'])
+                    for row, channel in changed
+                ]
+            )
+            last_id = conn.execute('SELECT MAX(id) FROM proxy_channels').fetchone()[0] or 0
+            self._insert_rows(conn, proxy_id, added)
+            conn.executemany(
+                f'INSERT OR REPLACE INTO {PENDING_TABLE} (id, proxy_id, ref, name) VALUES (?, ?, ?, ?)',
+                [(row['id'], proxy_id, f"{proxy_id}:{row['channel_id']}", channel['name']) for row, channel in changed]
+            )
+            conn.execute(
+                f'''INSERT OR REPLACE INTO {PENDING_TABLE} (id, proxy_id, ref, name)
+                    SELECT id, proxy_id, proxy_id || ':' || channel_id, name FROM proxy_channels
+                    WHERE proxy_id = ? AND id > ?''',
+                (proxy_id, last_id)
+            )
+            renumbered = self._write_numbers(conn, numbers)
+
+            headers_json = json.dumps(headers)
+            headers_changed = self._source(conn, proxy_id)['headers'] != headers_json
+            if headers_changed:
+                conn.execute('UPDATE proxy_channel_sources SET headers = ? WHERE proxy_id = ?', (headers_json, proxy_id))
+
+            counts = {'added': len(added), 'updated': len(changed), 'removed': len(removed), 'renumbered': renumbered}
+            # New headers alone are also a new revision of the playlist
+            affected = sum(counts.values()) + (1 if headers_changed else 0)
+            result = self._log_edit(conn, proxy_id, 'sync', counts, affected)
+            result.update(counts)
+            return result
+
+    def refresh_indexes(self, proxy_id):
+        """Apply the proxy's pending channel edits to the trigram and search indexes"""
+        try:
+            with self.lock, self._connect() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                if self.fts_enabled:
+                    conn.execute(
+                        f'DELETE FROM proxy_channels_fts WHERE rowid IN (SELECT id FROM {PENDING_TABLE} WHERE proxy_id = ?)',
+                        (proxy_id,)
+                    )
+                    conn.execute(
+                        f'''INSERT INTO proxy_channels_fts (rowid, name)
+                            SELECT id, name FROM {PENDING_TABLE} WHERE proxy_id = ? AND name IS NOT NULL''',
+                        (proxy_id,)
+                    )
+                search_index.apply_channel_edits(conn, PENDING_TABLE, proxy_id)
+                conn.execute(f'DELETE FROM {PENDING_TABLE} WHERE proxy_id = ?', (proxy_id,))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error refreshing channel indexes of proxy {proxy_id}: {str(e)}")
+
+    def has_pending_edits(self, proxy_id):
+        with self._connect() as conn:
+            return conn.execute(f'SELECT 1 FROM {PENDING_TABLE} WHERE proxy_id = ? LIMIT 1', (proxy_id,)).fetchone() is not None
+
+    def operations(self, proxy_id):
+        """The proxy's operation log, oldest first"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                '''SELECT revision, operation, params, affected, created_at
+                   FROM proxy_operations WHERE proxy_id = ? ORDER BY id''',
+                (proxy_id,)
+            ).fetchall()
+            return [dict(row, params=json.loads(row['params'] or '{}')) for row in rows]
+
+    def materialize(self, proxy_id):
+        """
+        Write playlist.m3u from the table if the proxy was edited since it
+        was last written; returns True if it was written.
+        """
+        with self._connect() as conn:
+            row = self._source(conn, proxy_id)
+        if row is None or row['revision'] == row['materialized_revision']:
+            return False
+
+        path = self.playlist_path(proxy_id)
+        with self.lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = self._source(conn, proxy_id)
+            if row is None or row['revision'] == row['materialized_revision']:
+                # Another worker process wrote it meanwhile
+                conn.rollback()
+                return False
+
+            # Same bytes as M3UEditor.save_to_file for the same playlist
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                with open(tmp_path, 'wb') as f:
+                    headers = json.loads(row['headers'] or '[]')
+                    separator = '\n' if headers else ''
+                    f.write('\n'.join(headers).encode('utf-8'))
+                    cursor = conn.execute(
+                        'SELECT name, url, duration, attributes FROM proxy_channels WHERE proxy_id = ? ORDER BY position',
+                        (proxy_id,)
+                    )
+                    while True:
+                        batch = cursor.fetchmany(MATERIALIZE_BATCH_SIZE)
+                        if not batch:
+                            break
+                        lines = []
+                        for channel in batch:
+                            lines.append(format_extinf(channel['duration'], json.loads(channel['attributes']), channel['name']))
+                            lines.append(channel['url'])
+                        f.write((separator + '\n'.join(lines)).encode('utf-8'))
+                        separator = '\n'
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            # The file now matches the table, so it isn't parsed again
+            stat = os.stat(path)
+            source_key = (stat.st_mtime_ns, stat.st_size)
+            conn.execute(
+                '''UPDATE proxy_channel_sources
+                   SET source_mtime_ns = ?, source_size = ?, materialized_revision = revision
+                   WHERE proxy_id = ?''',
+                (source_key[0], source_key[1], proxy_id)
+            )
+            conn.commit()
+        self._indexed[proxy_id] = source_key
+        logger.info(f"Wrote playlist of proxy {proxy_id} at revision {row['revision']}")
+        return True
+
+    def _filters(self, proxy_id, search=None, group=None):
+        """WHERE clause and parameters shared by query() and count()"""
+        clauses = ['pc.proxy_id = ?']
+        params = [proxy_id]
+        if search:
+            if self.fts_enabled and len(search) >= MIN_FTS_SEARCH_LENGTH and not self.has_pending_edits(proxy_id):
+                # A quoted trigram phrase matches the search anywhere in the name
+                clauses.append('pc.id IN (SELECT rowid FROM proxy_channels_fts WHERE proxy_channels_fts MATCH ?)')
+                params.append('"' + search.replace('"', '""') + '"')
+            else:
+                escaped = search.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                clauses.append("pc.name_lower LIKE ? ESCAPE '\\'")
+                params.append(f'%{escaped}%')
+        if group:
+            clauses.append('pc.group_title = ?')
+            params.append(group)
+        return ' AND '.join(clauses), params
+
+    def count(self, proxy_id, search=None, group=None):
+        """Number of channels matching the filters"""
+        where, params = self._filters(proxy_id, search, group)
+        with self._connect() as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM proxy_channels pc WHERE {where}', params).fetchone()[0]
+
+    def query(self, proxy_id, search=None, group=None, sort_by='name', sort_dir='asc', limit=25, offset=0):
+        """
+        One page of channels in the dict shape of parse_m3u_channels.
+        Ties keep playlist order, as the old stable in-memory sort did.
+        """
+        sort_column = SORT_COLUMNS.get(sort_by, 'name_lower')
+        direction = 'DESC' if sort_dir == 'desc' else 'ASC'
+        where, params = self._filters(proxy_id, search, group)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'''SELECT pc.channel_id, pc.name, pc.url, pc.group_title, pc.number, pc.tvg_id, pc.tvg_name, pc.tvg_logo
+                    FROM proxy_channels pc
+                    WHERE {where}
+                    ORDER BY pc.{sort_column} {direction}, pc.position
+                    LIMIT ? OFFSET ?''',
+                params + [limit, offset]
+            ).fetchall()
+            return [
+                {
+                    'id': row['channel_id'],
+                    'name': row['name'],
+                    'url': row['url'],
+                    'group': row['group_title'],
+                    'number': row['number'],
+                    'tvg_id': row['tvg_id'],
+                    'tvg_name': row['tvg_name'],
+                    'tvg_logo': row['tvg_logo']
+                }
+                for row in rows
+            ]
+
+    def groups(self, proxy_id):
+        """Sorted distinct non-empty group titles of a proxy"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT group_title FROM proxy_channels WHERE proxy_id = ? AND group_title != '' ORDER BY group_title",
+                (proxy_id,)
+            ).fetchall()
+            return [row['group_title'] for row in rows]
+
+# Global instance
+channel_store = ChannelStore()
@@ -0,0 +1,98 @@
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+import db
+
+logger = logging.getLogger(__name__)
+
+# Bytes hashed per read when fingerprinting a playlist
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Hashes already computed, keyed by (path, size, mtime) so an unchanged file is hashed once
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+def playlist_hash(filename):
+    """SHA-1 of a playlist's content; a checkpoint only applies to the exact same content"""
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    with _hashes_lock:
+        cached = _hashes.get(key)
+    if cached:
+        return cached
+
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    result = digest.hexdigest()
+
+    with _hashes_lock:
+        _hashes.clear()
+        _hashes[key] = result
+    return result
+
+class StoredCheckpoint:
+    """
+    Pipeline checkpoint keyed by job ID, kept in the pipeline_checkpoints
+    table. Running the same job ID again on a playlist with the same
+    content hash resumes after the last committed entry.
+    """
+
+    def __init__(self, job_id, db_file=db.DB_FILE):
+        """Load the checkpoint stored for job_id, if any"""
+        self.job_id = job_id
+        self.db_file = db_file
+        self.index = 0
+        self.playlist_hash = None
+
+        with sqlite3.connect(self.db_file) as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+                job_id TEXT PRIMARY KEY,
+                playlist_hash TEXT NOT NULL,
+                entry_index INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            ''')
+            row = conn.execute(
+                'SELECT playlist_hash, entry_index FROM pipeline_checkpoints WHERE job_id = ?',
+                (job_id,)
+            ).fetchone()
+        if row:
+            self.playlist_hash, self.index = row
+
+    def can_resume(self, filename):
+        """True if filename has the content the checkpoint was recorded for"""
+        return bool(self.index) and os.path.exists(filename) and playlist_hash(filename) == self.playlist_hash
+
+    def resume_index(self, filename):
+        """Entry index to resume filename from (0 to start over)"""
+        if not self.index:
+            return 0
+        if not self.can_resume(filename):
+            logger.info(f"Playlist changed since job {self.job_id} was checkpointed, starting over")
+            return 0
+        return self.index
+
+    def save(self, index, filename):
+        """Record that every entry of filename before index has been committed"""
+        self.index = index
+        self.playlist_hash = playlist_hash(filename)
+        with sqlite3.connect(self.db_file) as conn:
+            conn.execute(
+                '''INSERT OR REPLACE INTO pipeline_checkpoints
+                   (job_id, playlist_hash, entry_index, updated_at)
+                   VALUES (?, ?, ?, ?)''',
+                (self.job_id, self.playlist_hash, index, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+
+    def clear(self):
+        """Forget the checkpoint once the job has finished"""
+        self.index = 0
+        self.playlist_hash = None
+        with sqlite3.connect(self.db_file) as conn:
+            conn.execute('DELETE FROM pipeline_checkpoints WHERE job_id = ?', (self.job_id,))
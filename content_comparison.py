@@ -1,11 +1,31 @@
 import os
+import copy
 import json
 import hashlib
+import threading
+import functools
+from contextlib import contextmanager
 from datetime import datetime
 import logging
+from search_index import search_index
+from coordination import registry_lock
 
 logger = logging.getLogger(__name__)
 
+# Number of striped locks used to serialise work on the same content item
+CONTENT_LOCK_STRIPES = 64
+
+# Registry sections holding content items, by content type
+CONTENT_SECTIONS = {"movie": "movies", "tv_show": "tv_shows"}
+
+def _synchronized(method):
+    """Run a ContentRegistry method while holding the registry lock"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class ProviderManager:
     """Manages M3U providers and their friendly names"""
     
@@ -92,10 +112,32 @@ class ProviderManager:
         return
 
 class ContentRegistry:
-    """A registry to track and compare content across multiple M3U providers"""
+    """
+    A registry to track and compare content across multiple M3U providers.
+
+    All methods are thread-safe. Saving can be deferred with deferred_save()
+    so bulk processing writes the registry file once instead of per item.
+    Items and providers changed since the last write are pushed to the
+    search index along with it, unless index_search is False.
+
+    A shared registry (the one several worker processes write) is written
+    under coordination.registry_lock, and only for as long as the write
+    takes: if another process wrote the file since it was loaded, the items
+    and providers changed here are merged into that version first.
+    """
     
-    def __init__(self, registry_path="data/content_registry.json"):
+    def __init__(self, registry_path="data/content_registry.json", index_search=True, shared=False):
         self.registry_path = registry_path
+        self.index_search = index_search
+        self.shared = shared
+        self._search_changes = {"movies": set(), "tv_shows": set(), "providers": set()}
+        # Keys changed since the last write, merged into newer versions of the file
+        self._unsaved = {"movies": set(), "tv_shows": set(), "providers": set()}
+        self.lock = threading.RLock()
+        self._content_locks = [threading.Lock() for _ in range(CONTENT_LOCK_STRIPES)]
+        self._defer_depth = 0
+        self._dirty = False
+        self._loaded_mtime_ns = None
         self.registry = self._load_registry()
         self.provider_manager = ProviderManager()
         
@@ -103,6 +145,7 @@ class ContentRegistry:
         """Load existing content registry"""
         if os.path.exists(self.registry_path):
             try:
+                self._loaded_mtime_ns = os.stat(self.registry_path).st_mtime_ns
                 with open(self.registry_path, 'r') as f:
                     registry = json.load(f)
                     # Make sure we have the correct structure
@@ -120,10 +163,154 @@ class ContentRegistry:
             return {"movies": {}, "tv_shows": {}, "providers": {}}
         
     def _save_registry(self):
-        """Save content registry to disk"""
+        """Save content registry to disk, or mark it dirty while saving is deferred"""
+        with self.lock:
+            self._dirty = True
+            if self._defer_depth > 0:
+                return
+            self._write_registry()
+    
+    def _write_registry(self):
+        """Atomically write the registry file (caller holds the lock)"""
+        if self.shared:
+            with registry_lock.hold():
+                self._merge_newer_file()
+                self._write_file()
+        else:
+            self._write_file()
+        self._unsaved = {"movies": set(), "tv_shows": set(), "providers": set()}
+        self._index_search_changes()
+    
+    def _write_file(self):
+        """Write the registry file through a temporary file (caller holds the lock)"""
         os.makedirs(os.path.dirname(self.registry_path), exist_ok=True)
-        with open(self.registry_path, 'w') as f:
+        tmp_path = f"{self.registry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
             json.dump(self.registry, f, indent=2)
+        os.replace(tmp_path, self.registry_path)
+        self._loaded_mtime_ns = os.stat(self.registry_path).st_mtime_ns
+        self._dirty = False
+    
+    def _merge_newer_file(self):
+        """
+        If another process wrote the registry file since it was loaded, load
+        that version and merge the items and providers changed here into it
+        (caller holds the lock and registry_lock)
+        """
+        if not os.path.exists(self.registry_path) or os.stat(self.registry_path).st_mtime_ns == self._loaded_mtime_ns:
+            return
+        try:
+            mtime_ns = os.stat(self.registry_path).st_mtime_ns
+            with open(self.registry_path, 'r') as f:
+                newer = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading the content registry written by another process, overwriting it: {str(e)}")
+            return
+        for section in ("movies", "tv_shows", "providers"):
+            newer.setdefault(section, {})
+        
+        for provider_id in self._unsaved["providers"]:
+            provider = self.registry["providers"].get(provider_id)
+            if provider is not None:
+                # Content counts come from the items merged below
+                merged = newer["providers"].setdefault(provider_id, dict(provider, content_count=0))
+                merged.update({key: value for key, value in provider.items() if key != "content_count"})
+        for section in CONTENT_SECTIONS.values():
+            for content_hash in self._unsaved[section]:
+                item = self.registry[section].get(content_hash)
+                if item is not None:
+                    self.merge_item(newer, section, content_hash, item)
+        
+        logger.info(f"Merged {sum(len(keys) for keys in self._unsaved.values())} registry changes into the version written by another process")
+        self.registry = newer
+        self._loaded_mtime_ns = mtime_ns
+    
+    def merge_item(self, data, section, content_hash, item):
+        """
+        Merge a version of an item into registry data: providers are added
+        or updated (counting the item for providers new to it), and the
+        better resolution wins (caller holds the lock)
+        """
+        items = data[section]
+        merged = items.get(content_hash)
+        if merged is None:
+            items[content_hash] = copy.deepcopy(item)
+            attached = item['providers']
+        else:
+            attached = [provider_id for provider_id in item['providers'] if provider_id not in merged['providers']]
+            for provider_id, provider in item['providers'].items():
+                existing = merged['providers'].get(provider_id)
+                if existing is None:
+                    merged['providers'][provider_id] = dict(provider)
+                else:
+                    existing['url'] = provider['url']
+                    existing['last_updated'] = provider['last_updated']
+            if self._is_better_resolution(item.get('resolution'), merged.get('resolution')):
+                merged['resolution'] = item['resolution']
+                merged['preferred_provider'] = item['preferred_provider']
+            merged['last_updated'] = max(merged.get('last_updated', ''), item.get('last_updated', ''))
+        
+        for provider_id in attached:
+            provider = data['providers'].get(provider_id)
+            if provider is not None:
+                provider['content_count'] = provider.get('content_count', 0) + 1
+    
+    def mark_changed(self, section, key):
+        """Note an item (by content hash) or provider (by id) changed since the last write"""
+        if key:
+            self._unsaved[section].add(key)
+    
+    def mark_search_changed(self, section, key):
+        """Queue an item (by content hash) or provider (by id) for the search index"""
+        self.mark_changed(section, key)
+        if self.index_search and key:
+            self._search_changes[section].add(key)
+    
+    def _index_search_changes(self):
+        """Push queued changes to the search index (caller holds the lock)"""
+        if not any(self._search_changes.values()):
+            return
+        changes = self._search_changes
+        self._search_changes = {"movies": set(), "tv_shows": set(), "providers": set()}
+        try:
+            search_index.index_registry_changes(self.registry, changes)
+        except Exception as e:
+            logger.error(f"Error updating search index: {str(e)}")
+    
+    def flush(self):
+        """Write pending changes to disk"""
+        with self.lock:
+            if self._dirty:
+                self._write_registry()
+    
+    @contextmanager
+    def deferred_save(self):
+        """Batch registry writes: changes are only written when the outermost block exits"""
+        with self.lock:
+            self._defer_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._defer_depth -= 1
+                if self._defer_depth == 0:
+                    self.flush()
+    
+    def reload_if_stale(self):
+        """Reload from disk if the file was changed by someone else and we have no pending changes"""
+        with self.lock:
+            if self._dirty or self._defer_depth > 0 or not os.path.exists(self.registry_path):
+                return
+            if os.stat(self.registry_path).st_mtime_ns != self._loaded_mtime_ns:
+                self.registry = self._load_registry()
+    
+    def content_lock(self, content_type, title, year=None, season=None, episode=None):
+        """
+        Lock guarding a single content item, so check-then-update sequences
+        (exists? better resolution? write STRM) are atomic per title/episode
+        """
+        content_hash = self.generate_content_hash(title, year, season, episode)
+        return self._content_locks[int(content_hash[:8], 16) % CONTENT_LOCK_STRIPES]
             
     def generate_content_hash(self, title, year=None, season=None, episode=None):
         """Generate a unique hash for content based on its metadata"""
@@ -134,6 +321,7 @@ class ContentRegistry:
             content_str += f"_s{season}e{episode}"
         return hashlib.md5(content_str.encode()).hexdigest()
         
+    @_synchronized
     def content_exists(self, content_type, title, year=None, season=None, episode=None):
         """Check if content already exists in the registry"""
         content_hash = self.generate_content_hash(title, year, season, episode)
@@ -144,6 +332,7 @@ class ContentRegistry:
             return content_hash in self.registry["tv_shows"]
         return False
     
+    @_synchronized
     def get_provider_id(self, provider_url):
         """Get or create a provider ID"""
         if not provider_url:
@@ -160,10 +349,12 @@ class ContentRegistry:
                 "first_seen": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "content_count": 0
             }
+            self.mark_search_changed("providers", provider_id)
             self._save_registry()
         
         return provider_id
     
+    @_synchronized
     def get_content_resolution(self, content_type, title, year=None, season=None, episode=None):
         """Get the current resolution of content"""
         content_hash = self.generate_content_hash(title, year, season, episode)
@@ -181,6 +372,7 @@ class ContentRegistry:
         current_rank = res_rank.get(current_res, 0)
         return new_rank > current_rank
     
+    @_synchronized
     def get_provider_name(self, provider_url):
         """Get friendly name for a provider URL"""
         if not provider_url:
@@ -191,6 +383,7 @@ class ContentRegistry:
             return self.registry["providers"][provider_id]["name"]
         return "Unknown"
     
+    @_synchronized
     def register_content(self, content_type, title, url, filepath, provider_url, year=None, season=None, episode=None, resolution=None):
         """Register new content in the registry"""
         content_hash = self.generate_content_hash(title, year, season, episode)
@@ -228,6 +421,7 @@ class ContentRegistry:
                 (resolution and self._is_better_resolution(resolution, current_res))):
                 self.registry["movies"][content_hash]["preferred_provider"] = provider_id
                 self.registry["movies"][content_hash]["resolution"] = resolution
+            self.mark_search_changed("movies", content_hash)
             
         elif content_type == "tv_show":
             if content_hash not in self.registry["tv_shows"]:
@@ -258,11 +452,13 @@ class ContentRegistry:
                 (resolution and self._is_better_resolution(resolution, current_res))):
                 self.registry["tv_shows"][content_hash]["preferred_provider"] = provider_id
                 self.registry["tv_shows"][content_hash]["resolution"] = resolution
+            self.mark_search_changed("tv_shows", content_hash)
         
         # Update provider content count
         if provider_id:
             self.registry["providers"][provider_id]["content_count"] = self.registry["providers"][provider_id].get("content_count", 0) + 1
             self.registry["providers"][provider_id]["last_updated"] = now
+            self.mark_search_changed("providers", provider_id)
             
         self._save_registry()
         return {
@@ -271,6 +467,7 @@ class ContentRegistry:
             "provider_name": provider_name
         }
     
+    @_synchronized
     def update_content(self, content_type, title, url, filepath, provider_url, year=None, season=None, episode=None, resolution=None):
         """Update existing content with new URL and possibly better resolution"""
         content_hash = self.generate_content_hash(title, year, season, episode)
@@ -286,6 +483,7 @@ class ContentRegistry:
                 if self._is_better_resolution(resolution, current_res):
                     self.registry["movies"][content_hash]["resolution"] = resolution
                     self.registry["movies"][content_hash]["preferred_provider"] = provider_id
+                    self.mark_search_changed("movies", content_hash)
                     updated = True
             
             # Add or update provider for this content
@@ -298,6 +496,7 @@ class ContentRegistry:
             
             # Update last_updated timestamp
             self.registry["movies"][content_hash]["last_updated"] = now
+            self.mark_changed("movies", content_hash)
                 
         elif content_type == "tv_show" and content_hash in self.registry["tv_shows"]:
             # Update URL and resolution if better
@@ -306,6 +505,7 @@ class ContentRegistry:
                 if self._is_better_resolution(resolution, current_res):
                     self.registry["tv_shows"][content_hash]["resolution"] = resolution
                     self.registry["tv_shows"][content_hash]["preferred_provider"] = provider_id
+                    self.mark_search_changed("tv_shows", content_hash)
                     updated = True
             
             # Add or update provider for this content
@@ -318,10 +518,12 @@ class ContentRegistry:
             
             # Update last_updated timestamp
             self.registry["tv_shows"][content_hash]["last_updated"] = now
+            self.mark_changed("tv_shows", content_hash)
         
         # Update provider information
         if provider_id and provider_id in self.registry["providers"]:
             self.registry["providers"][provider_id]["last_updated"] = now
+            self.mark_changed("providers", provider_id)
             # Only increment content count if this is a new relationship between content and provider
             if ((content_type == "movie" and content_hash in self.registry["movies"] and 
                  provider_id not in self.registry["movies"][content_hash]["providers"]) or
@@ -332,6 +534,7 @@ class ContentRegistry:
         self._save_registry()
         return updated
     
+    @_synchronized
     def add_provider_to_content(self, content_type, title, url, provider_url, year=None, season=None, episode=None, resolution=None):
         """Add a provider as a source for existing content without changing preferred provider"""
         if not provider_url:
@@ -352,15 +555,18 @@ class ContentRegistry:
                     "added": now,
                     "last_updated": now
                 }
+                self.mark_changed("movies", content_hash)
                 
                 # Update provider content count
                 self.registry["providers"][provider_id]["content_count"] = self.registry["providers"][provider_id].get("content_count", 0) + 1
                 self.registry["providers"][provider_id]["last_updated"] = now
+                self.mark_search_changed("providers", provider_id)
                 
                 added = True
             else:
                 # Update existing provider entry
                 self.registry["movies"][content_hash]["providers"][provider_id]["last_updated"] = now
+                self.mark_changed("movies", content_hash)
                 if self.registry["movies"][content_hash]["providers"][provider_id]["url"] != url:
                     self.registry["movies"][content_hash]["providers"][provider_id]["url"] = url
                     added = True
@@ -374,15 +580,18 @@ class ContentRegistry:
                     "added": now,
                     "last_updated": now
                 }
+                self.mark_changed("tv_shows", content_hash)
                 
                 # Update provider content count
                 self.registry["providers"][provider_id]["content_count"] = self.registry["providers"][provider_id].get("content_count", 0) + 1
                 self.registry["providers"][provider_id]["last_updated"] = now
+                self.mark_search_changed("providers", provider_id)
                 
                 added = True
             else:
                 # Update existing provider entry
                 self.registry["tv_shows"][content_hash]["providers"][provider_id]["last_updated"] = now
+                self.mark_changed("tv_shows", content_hash)
                 if self.registry["tv_shows"][content_hash]["providers"][provider_id]["url"] != url:
                     self.registry["tv_shows"][content_hash]["providers"][provider_id]["url"] = url
                     added = True
@@ -392,6 +601,7 @@ class ContentRegistry:
             
         return added
     
+    @_synchronized
     def get_preferred_url(self, content_type, title, year=None, season=None, episode=None):
         """Get the preferred URL for content"""
         content_hash = self.generate_content_hash(title, year, season, episode)
@@ -408,6 +618,7 @@ class ContentRegistry:
                 return content["providers"][preferred_id]["url"]
         return None
     
+    @_synchronized
     def get_content_stats(self):
         """Get statistics about content and providers"""
         stats = {
@@ -431,6 +642,7 @@ class ContentRegistry:
         """Get all registered content"""
         return self.registry
     
+    @_synchronized
     def get_content_provider_info(self, content_type, title, year=None, season=None, episode=None):
         """Get information about providers for specific content"""
         content_hash = self.generate_content_hash(title, year, season, episode)
@@ -457,6 +669,22 @@ class ContentRegistry:
             }
         return None
 
+_shared_registry = None
+_shared_registry_lock = threading.Lock()
+
+def get_content_registry():
+    """
+    Get the process-wide ContentRegistry shared by all processing threads,
+    reloading it if the registry file was changed outside this process
+    """
+    global _shared_registry
+    with _shared_registry_lock:
+        if _shared_registry is None:
+            _shared_registry = ContentRegistry(shared=True)
+        else:
+            _shared_registry.reload_if_stale()
+        return _shared_registry
+
 def get_provider_stats():
     """Get statistics about providers"""
     registry = ContentRegistry()
@@ -1,4 +1,5 @@
 import os
+import re
 import logging
 import hashlib
 import json
@@ -6,6 +7,7 @@ from datetime import datetime
 from flask import Blueprint, request, jsonify, url_for, render_template, flash, redirect
 import db
 from content_comparison import ContentRegistry, ProviderManager
+from library_scanner import LibraryScanner
 
 logger = logging.getLogger(__name__)
 
@@ -31,105 +33,86 @@ class ContentSynchronizer:
         """Scan content directories to build registry of existing content"""
         logger.info("Scanning existing content...")
         
-        # Scan movies directory
+        scanner = LibraryScanner(self.content_path)
+        content = scanner.scan(read_urls=True)
         movie_path = os.path.join(self.content_path, 'Movies')
-        if os.path.exists(movie_path):
-            for movie_dir in os.listdir(movie_path):
-                movie_full_path = os.path.join(movie_path, movie_dir)
-                if os.path.isdir(movie_full_path):
-                    # Extract movie details from directory name
-                    movie_title = movie_dir
-                    year = None
-                    
-                    # Try to extract year if present in brackets
-                    import re
-                    year_match = re.search(r'\((\d{4})\)', movie_title)
-                    if year_match:
-                        year = year_match.group(1)
-                        movie_title = movie_title.replace(f"({year})", "").strip()
-                    
-                    # Find STRM file to get URL
-                    for file in os.listdir(movie_full_path):
-                        if file.endswith(".strm"):
-                            strm_path = os.path.join(movie_full_path, file)
-                            
-                            # Extract resolution if present in filename
-                            resolution = None
-                            res_match = re.search(r'(720p|1080p|2160p|4K|UHD)', file)
-                            if res_match:
-                                resolution = res_match.group(1)
-                            
-                            # Read URL from STRM file
-                            with open(strm_path, 'r') as f:
-                                url = f.read().strip()
-                                
-                            # Register in content registry
-                            provider_url = "unknown"  # Default for existing content
-                            self.content_registry.register_content(
-                                "movie", 
-                                movie_title, 
-                                url, 
-                                strm_path, 
-                                provider_url,
-                                year=year,
-                                resolution=resolution
-                            )
-                            logger.debug(f"Registered existing movie: {movie_title} ({year}) - {resolution}")
-                            break
-        
-        # Scan TV Shows directory
         tv_path = os.path.join(self.content_path, 'TV Shows')
-        if os.path.exists(tv_path):
-            for show_dir in os.listdir(tv_path):
-                show_full_path = os.path.join(tv_path, show_dir)
-                if os.path.isdir(show_full_path):
-                    show_title = show_dir
-                    
-                    # Process seasons
-                    for season_dir in os.listdir(show_full_path):
-                        season_path = os.path.join(show_full_path, season_dir)
-                        if os.path.isdir(season_path):
-                            # Extract season number
-                            season_number = None
-                            if season_dir.startswith("Season "):
-                                season_number = season_dir[7:].strip().zfill(2)
-                            
-                            # Process episodes
-                            for episode_file in os.listdir(season_path):
-                                if episode_file.endswith(".strm"):
-                                    episode_path = os.path.join(season_path, episode_file)
-                                    
-                                    # Try to extract episode info
-                                    import re
-                                    episode_number = None
-                                    episode_match = re.search(r'S\d+E(\d+)', episode_file)
-                                    if episode_match:
-                                        episode_number = episode_match.group(1)
-                                    
-                                    # Extract resolution if present
-                                    resolution = None
-                                    res_match = re.search(r'(720p|1080p|2160p|4K|UHD)', episode_file)
-                                    if res_match:
-                                        resolution = res_match.group(1)
-                                    
-                                    # Read URL from STRM file
-                                    with open(episode_path, 'r') as f:
-                                        url = f.read().strip()
-                                    
-                                    # Register in content registry
-                                    provider_url = "unknown"  # Default for existing content
-                                    if season_number and episode_number:
-                                        self.content_registry.register_content(
-                                            "tv_show", 
-                                            show_title, 
-                                            url, 
-                                            episode_path, 
-                                            provider_url,
-                                            season=season_number,
-                                            episode=episode_number,
-                                            resolution=resolution
-                                        )
-                                        logger.debug(f"Registered existing TV episode: {show_title} S{season_number}E{episode_number} - {resolution}")
+        provider_url = "unknown"  # Default for existing content
+        
+        # Register one STRM file per movie directory
+        registered_movies = set()
+        for rel_path in sorted(content["movies"]):
+            movie_dir, file = os.path.split(rel_path)
+            url = content["movies"][rel_path]
+            if movie_dir in registered_movies or url is None:
+                continue
+            registered_movies.add(movie_dir)
+            
+            # Extract movie details from directory name
+            movie_title = movie_dir
+            year = None
+            
+            # Try to extract year if present in brackets
+            year_match = re.search(r'\((\d{4})\)', movie_title)
+            if year_match:
+                year = year_match.group(1)
+                movie_title = movie_title.replace(f"({year})", "").strip()
+            
+            # Extract resolution if present in filename
+            resolution = None
+            res_match = re.search(r'(720p|1080p|2160p|4K|UHD)', file)
+            if res_match:
+                resolution = res_match.group(1)
+            
+            # Register in content registry
+            self.content_registry.register_content(
+                "movie", 
+                movie_title, 
+                url, 
+                os.path.join(movie_path, rel_path), 
+                provider_url,
+                year=year,
+                resolution=resolution
+            )
+            logger.debug(f"Registered existing movie: {movie_title} ({year}) - {resolution}")
+        
+        # Register TV episodes found in season directories
+        for rel_path, url in content["tv"].items():
+            parts = rel_path.split(os.sep)
+            if len(parts) != 3 or url is None:
+                continue
+            show_title, season_dir, episode_file = parts
+            
+            # Extract season number
+            season_number = None
+            if season_dir.startswith("Season "):
+                season_number = season_dir[7:].strip().zfill(2)
+            
+            # Try to extract episode info
+            episode_number = None
+            episode_match = re.search(r'S\d+E(\d+)', episode_file)
+            if episode_match:
+                episode_number = episode_match.group(1)
+            
+            # Extract resolution if present
+            resolution = None
+            res_match = re.search(r'(720p|1080p|2160p|4K|UHD)', episode_file)
+            if res_match:
+                resolution = res_match.group(1)
+            
+            # Register in content registry
+            if season_number and episode_number:
+                self.content_registry.register_content(
+                    "tv_show", 
+                    show_title, 
+                    url, 
+                    os.path.join(tv_path, rel_path), 
+                    provider_url,
+                    season=season_number,
+                    episode=episode_number,
+                    resolution=resolution
+                )
+                logger.debug(f"Registered existing TV episode: {show_title} S{season_number}E{episode_number} - {resolution}")
         
         logger.info("Content scan completed")
         return self.content_registry
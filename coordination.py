@@ -0,0 +1,133 @@
+import os
+import time
+import socket
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+import db
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Lock file serialising registry writers across worker processes
+REGISTRY_LOCK_FILE = 'data/registry.lock'
+
+def process_name():
+    """Identifies this process among the app's workers"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class LeaderLease:
+    """
+    Leader election between the worker processes sharing one database.
+
+    Every process tries to take or renew a named lease row; the holder is
+    the leader until it stops renewing and the lease expires. A background
+    thread renews the lease every ttl/3 seconds.
+    """
+
+    def __init__(self, name, ttl_seconds=60, db_file=db.DB_FILE):
+        """Create the leases table if needed (call start() to begin campaigning)"""
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.db_file = db_file
+        self.owner = process_name()
+        self.is_leader = False
+        self.thread = None
+
+        with sqlite3.connect(self.db_file, timeout=30) as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS leader_leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            ''')
+
+    def try_acquire(self):
+        """Take the lease if it is free, expired or already ours; returns whether we hold it"""
+        now = time.time()
+        try:
+            with sqlite3.connect(self.db_file, timeout=30) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute(
+                    'SELECT owner, expires_at FROM leader_leases WHERE name = ?',
+                    (self.name,)
+                ).fetchone()
+                if row is None or row[0] == self.owner or row[1] < now:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO leader_leases (name, owner, expires_at) VALUES (?, ?, ?)',
+                        (self.name, self.owner, now + self.ttl_seconds)
+                    )
+                    leader = True
+                else:
+                    leader = False
+        except sqlite3.Error as e:
+            logger.error(f"Error renewing {self.name} lease: {str(e)}")
+            leader = False
+
+        if leader != self.is_leader:
+            logger.info(f"{self.owner} {'is now' if leader else 'is no longer'} the {self.name} leader")
+        self.is_leader = leader
+        return leader
+
+    def release(self):
+        """Give up the lease so another process can take over immediately"""
+        self.is_leader = False
+        with sqlite3.connect(self.db_file, timeout=30) as conn:
+            conn.execute('DELETE FROM leader_leases WHERE name = ? AND owner = ?', (self.name, self.owner))
+
+    def start(self):
+        """Campaign for the lease in a background thread"""
+        self.try_acquire()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._renew_loop, name=f"{self.name}-lease", daemon=True)
+            self.thread.start()
+
+    def _renew_loop(self):
+        """Renew (or try to take) the lease until the process exits"""
+        while True:
+            time.sleep(self.ttl_seconds / 3)
+            self.try_acquire()
+
+class InterProcessLock:
+    """
+    Exclusive lock shared by threads in this process and by other worker
+    processes. Threads of the same process share one flock, so concurrent
+    jobs in one process (which share the in-memory registry) don't block
+    each other.
+    """
+
+    def __init__(self, path=REGISTRY_LOCK_FILE):
+        """Lock on path (created if missing)"""
+        self.path = path
+        self.lock = threading.Condition()
+        self.holders = 0
+        self.file = None
+
+    @contextmanager
+    def hold(self):
+        """Hold the lock for the duration of the with-block"""
+        with self.lock:
+            if self.holders == 0 and fcntl is not None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self.file = open(self.path, 'a')
+                # Blocks while another process is writing the registry
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            self.holders += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.holders -= 1
+                if self.holders == 0 and self.file is not None:
+                    fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+                    self.file.close()
+                    self.file = None
+
+# Global instance
+registry_lock = InterProcessLock()
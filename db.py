@@ -36,10 +36,23 @@ def init_db():
             output_path TEXT,
             last_check TEXT,
             next_check TEXT,
-            update_frequency INTEGER DEFAULT 24
+            update_frequency INTEGER DEFAULT 24,
+            priority INTEGER DEFAULT 0,
+            refresh_state TEXT DEFAULT 'idle',
+            last_error TEXT
         )
         ''')
         
+        # Columns added after the first release
+        existing = {row[1] for row in cursor.execute('PRAGMA table_info(m3u_links)')}
+        for column, definition in (
+            ('priority', 'INTEGER DEFAULT 0'),
+            ('refresh_state', "TEXT DEFAULT 'idle'"),
+            ('last_error', 'TEXT')
+        ):
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE m3u_links ADD COLUMN {column} {definition}')
+        
         # Content tracking table
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS content_history (
@@ -87,12 +100,33 @@ def load_config():
         "log_level": "NORMAL",
         "language_filter": "EN",
         "skip_non_english": True,
+        "language_mode": "prefix",
+        "included_languages": [],
+        "excluded_languages": [],
+        "included_groups": [],
+        "excluded_groups": [],
+        "exclude_patterns": [],
         "update_frequency": 24,
+        "refresh_max_concurrent": 2,
+        "refresh_per_host_limit": 1,
+        "refresh_jitter_minutes": 15,
         "processing_batch_size": 100,
         "worker_count": 10,
+        "scan_worker_count": 8,
+        "pipeline_executor": "thread",
+        "checkpoint_interval": 1000,
+        "job_lease_seconds": 300,
+        "m3u_read_mode": "auto",
+        "mmap_threshold_mb": 64,
+        "distributed_mode": "off",
+        "shard_spool_path": "data/shards",
+        "shard_size": 5000,
+        "parse_cache_enabled": True,
+        "parse_cache_size": 50000,
         "ui_theme": "dark",
         "discord_webhook_url": "",
-        "notifications_enabled": False
+        "notifications_enabled": False,
+        "cache_remote_logos": False
     }
     
     with sqlite3.connect(DB_FILE) as conn:
@@ -187,6 +221,33 @@ def update_m3u_link_last_check(url):
         )
         conn.commit()
 
+def update_m3u_link_state(url, state, error=None):
+    """Record the refresh state of an M3U link (and the last error, if any)"""
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        if error is not None:
+            cursor.execute(
+                'UPDATE m3u_links SET refresh_state = ?, last_error = ? WHERE url = ?',
+                (state, error, url)
+            )
+        else:
+            cursor.execute(
+                'UPDATE m3u_links SET refresh_state = ? WHERE url = ?',
+                (state, url)
+            )
+        conn.commit()
+
+def update_m3u_link_priority(url, priority):
+    """Set the refresh priority of an M3U link (higher runs first)"""
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'UPDATE m3u_links SET priority = ? WHERE url = ?',
+            (priority, url)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
 def load_m3u_links():
     """Load all M3U links from database with better error handling"""
     try:
@@ -0,0 +1,263 @@
+import os
+import io
+import json
+import queue
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+import requests
+import db
+
+try:
+    from PIL import Image
+except ImportError:  # No thumbnails; their URLs redirect to the original image
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Where images and their thumbnails are stored, by content hash
+IMAGE_STORAGE_DIR = 'data/channel_images'
+
+# Thumbnail sizes (px) that can be requested; a thumbnail fits in a square of its size
+THUMBNAIL_SIZES = (64, 128, 256)
+DEFAULT_THUMBNAIL_SIZE = 128
+
+# Images are served with this max-age (a year) and marked immutable, as their URLs name their content
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Largest image accepted, uploaded or fetched
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+# Timeouts (connect, read) of remote logo downloads, in seconds
+FETCH_TIMEOUT = (10, 30)
+
+# A remote logo that failed to download is tried again after this long
+FETCH_RETRY_AFTER = timedelta(hours=24)
+
+# Leading bytes of the accepted image formats and the content type each is served with
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'RIFF', 'image/webp')
+)
+
+def image_content_type(data):
+    """Content type of image data, or None if it is not a PNG, JPEG, GIF or WebP image"""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            if content_type == 'image/webp' and data[8:12] != b'WEBP':
+                return None
+            return content_type
+    return None
+
+class ImageStore:
+    """
+    Channel images, stored once per content hash.
+
+    An image is saved as IMAGE_STORAGE_DIR/<hash[:2]>/<hash>, where hash is
+    the SHA-256 of its bytes, so uploading the same logo for many channels
+    stores it once, and a hash always names the same bytes: its URL can be
+    cached forever. Thumbnails are made on first request with Pillow, when
+    it is installed, and stored next to the image.
+
+    Remote logos (tvg-logo and image URLs) can also be fetched into the
+    store by a background worker, when cache_remote_logos is on in the
+    config; remote_images maps each URL to the hash it was stored under.
+    """
+
+    def __init__(self, db_file=db.DB_FILE, storage_dir=IMAGE_STORAGE_DIR):
+        """Create the image tables if needed"""
+        self.db_file = db_file
+        self.storage_dir = storage_dir
+        self.queue = queue.Queue()
+        # URLs queued or being fetched, so each is fetched once at a time
+        self.fetching = set()
+        self.state = threading.Lock()
+        self.worker = None
+
+        with self._connect() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS images (
+                hash TEXT PRIMARY KEY,
+                content_type TEXT NOT NULL,
+                byte_size INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS remote_images (
+                url TEXT PRIMARY KEY,
+                image_hash TEXT,
+                error TEXT,
+                fetched_at TEXT NOT NULL
+            )
+            ''')
+
+    def _connect(self):
+        """Open a connection that waits for other writers instead of failing"""
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def path(self, image_hash, size=None):
+        """Path of an image, or of its thumbnail of the given size"""
+        name = f"{image_hash}-{size}.png" if size else image_hash
+        return os.path.join(self.storage_dir, image_hash[:2], name)
+
+    def store(self, data):
+        """
+        Store image data unless the same bytes are stored already, and
+        return its hash. Raises ValueError for data that is not an image
+        or is larger than MAX_IMAGE_BYTES.
+        """
+        if len(data) > MAX_IMAGE_BYTES:
+            raise ValueError(f'Image is larger than {MAX_IMAGE_BYTES // (1024 * 1024)} MB')
+        content_type = image_content_type(data)
+        if content_type is None:
+            raise ValueError('Not a PNG, JPEG, GIF or WebP image')
+
+        image_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(image_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO images (hash, content_type, byte_size, created_at) VALUES (?, ?, ?, ?)',
+                (image_hash, content_type, len(data), datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+        return image_hash
+
+    def content_type(self, image_hash):
+        """Content type of a stored image, or None if there is no such image"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT content_type FROM images WHERE hash = ?', (image_hash,)).fetchone()
+            return row['content_type'] if row else None
+
+    def thumbnail(self, image_hash, size):
+        """
+        (path, content type) of the image's thumbnail, made if needed, or
+        None if there is no such image or no thumbnail could be made
+        (Pillow is not installed, or could not read the image). Images
+        already within the size are their own thumbnails.
+        """
+        content_type = self.content_type(image_hash)
+        if content_type is None or not os.path.exists(self.path(image_hash)):
+            return None
+        path = self.path(image_hash, size)
+        if os.path.exists(path):
+            return path, 'image/png'
+        if Image is None:
+            return None
+
+        try:
+            with Image.open(self.path(image_hash)) as image:
+                if image.width <= size and image.height <= size:
+                    return self.path(image_hash), content_type
+                image.thumbnail((size, size))
+                output = io.BytesIO()
+                image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB').save(
+                    output, 'PNG', optimize=True)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not make a {size}px thumbnail of image {image_hash}: {str(e)}")
+            return None
+
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(output.getvalue())
+        os.replace(temp_path, path)
+        return path, 'image/png'
+
+    # Remote logos
+
+    def cached(self, urls):
+        """Hashes of the remote images among urls that are stored, by URL"""
+        urls = [url for url in set(urls) if url]
+        if not urls:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                '''SELECT r.url, r.image_hash FROM json_each(?) page
+                   JOIN remote_images r ON r.url = page.value
+                   WHERE r.image_hash IS NOT NULL''',
+                (json.dumps(urls),)
+            ).fetchall()
+            return {row['url']: row['image_hash'] for row in rows}
+
+    def fetch_enabled(self):
+        return bool(db.load_config().get('cache_remote_logos', False))
+
+    def enqueue(self, urls):
+        """
+        Queue remote images for the background worker to fetch, skipping
+        those stored, queued, or failed within FETCH_RETRY_AFTER. Does
+        nothing unless cache_remote_logos is on.
+        """
+        urls = {url for url in urls if url and url.startswith(('http://', 'https://'))}
+        if not urls or not self.fetch_enabled():
+            return 0
+        retry_before = (datetime.now() - FETCH_RETRY_AFTER).strftime("%Y-%m-%d %H:%M:%S")
+        with self._connect() as conn:
+            done = {
+                row['url'] for row in conn.execute(
+                    '''SELECT r.url FROM json_each(?) page
+                       JOIN remote_images r ON r.url = page.value
+                       WHERE r.image_hash IS NOT NULL OR r.fetched_at > ?''',
+                    (json.dumps(sorted(urls)), retry_before)
+                )
+            }
+        with self.state:
+            new = urls - done - self.fetching
+            self.fetching.update(new)
+            for url in new:
+                self.queue.put(url)
+            if new and self.worker is None:
+                self.worker = threading.Thread(target=self._work, name="image-fetch", daemon=True)
+                self.worker.start()
+        return len(new)
+
+    def _work(self):
+        """Worker loop: fetch queued remote images one at a time"""
+        while True:
+            url = self.queue.get()
+            try:
+                self.fetch(url)
+            except Exception as e:
+                logger.error(f"Error fetching image {url}: {str(e)}")
+            finally:
+                with self.state:
+                    self.fetching.discard(url)
+
+    def fetch(self, url):
+        """Download a remote image into the store and record its hash (or the error); returns the hash or None"""
+        image_hash, error = None, None
+        try:
+            with requests.get(url, stream=True, timeout=FETCH_TIMEOUT) as response:
+                response.raise_for_status()
+                data = bytearray()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    data.extend(chunk)
+                    if len(data) > MAX_IMAGE_BYTES:
+                        raise ValueError(f'Image is larger than {MAX_IMAGE_BYTES // (1024 * 1024)} MB')
+            image_hash = self.store(bytes(data))
+        except (requests.RequestException, ValueError, OSError) as e:
+            error = str(e)
+            logger.debug(f"Could not cache image {url}: {error}")
+
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO remote_images (url, image_hash, error, fetched_at) VALUES (?, ?, ?, ?)',
+                (url, image_hash, error, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+        return image_hash
+
+# Global instance
+image_store = ImageStore()
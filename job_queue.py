@@ -0,0 +1,215 @@
+import os
+import time
+import socket
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+import db
+from checkpoints import playlist_hash
+
+logger = logging.getLogger(__name__)
+
+# Job kinds: 'refresh' downloads the link first, 'import' processes a file already on disk,
+# 'proxy_sync' syncs the proxy named by filename with its upstream url
+JOB_KINDS = ('refresh', 'import', 'proxy_sync')
+
+# Column identifying the target of kinds that are queued at most once at a time
+DEDUPLICATED_KINDS = {
+    'refresh': 'url',
+    'proxy_sync': 'filename'
+}
+
+# Job statuses
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_ERROR = 'error'
+
+def worker_name():
+    """Identifies the process and thread holding a lease"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+class JobQueue:
+    """
+    SQLite-backed queue of M3U refresh and import jobs.
+
+    A worker claims a job by taking a lease on it and renews the lease with
+    heartbeats while it runs. A job whose lease expires (the process died
+    or was restarted) is handed out again, and the last checkpoint stored
+    on the row lets the next worker resume instead of starting over.
+    """
+
+    def __init__(self, db_file=db.DB_FILE, lease_seconds=300):
+        """Create the jobs table if needed"""
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        with self._connect() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS refresh_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT UNIQUE NOT NULL,
+                kind TEXT NOT NULL,
+                url TEXT,
+                filename TEXT NOT NULL,
+                output_path TEXT,
+                priority INTEGER DEFAULT 0,
+                status TEXT NOT NULL,
+                attempts INTEGER DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                heartbeat_at TEXT,
+                checkpoint INTEGER DEFAULT 0,
+                checkpoint_file TEXT,  -- playlist_hash of the checkpointed file
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_refresh_jobs_status ON refresh_jobs (status, priority)')
+
+    def _connect(self):
+        """Open a connection that waits for other writers instead of failing"""
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, job_id, kind, filename, url=None, output_path=None, priority=0):
+        """
+        Add a job and return its job_id. A refresh of a URL (or sync of a
+        proxy) that is already queued or running returns the existing job
+        instead, raised to priority if that is higher.
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if kind in DEDUPLICATED_KINDS:
+                column = DEDUPLICATED_KINDS[kind]
+                row = conn.execute(
+                    f'SELECT job_id FROM refresh_jobs WHERE kind = ? AND {column} = ? AND status IN (?, ?)',
+                    (kind, url if column == 'url' else filename, STATUS_QUEUED, STATUS_RUNNING)
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        'UPDATE refresh_jobs SET priority = ?, updated_at = ? WHERE job_id = ? AND priority < ?',
+                        (priority, now, row['job_id'], priority)
+                    )
+                    return row['job_id']
+            conn.execute(
+                '''INSERT INTO refresh_jobs
+                   (job_id, kind, url, filename, output_path, priority, status, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (job_id, kind, url, filename, output_path, priority, STATUS_QUEUED, now, now)
+            )
+        return job_id
+
+    def claim(self, owner):
+        """Lease the next runnable job to owner and return it as a dict (None if there is none)"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                '''SELECT * FROM refresh_jobs
+                   WHERE status = ? OR (status = ? AND lease_expires < ?)
+                   ORDER BY priority DESC, id
+                   LIMIT 1''',
+                (STATUS_QUEUED, STATUS_RUNNING, now)
+            ).fetchone()
+            if row is None:
+                return None
+
+            if row['status'] == STATUS_RUNNING:
+                logger.warning(f"Lease of job {row['job_id']} held by {row['lease_owner']} expired, resuming at entry {row['checkpoint']}")
+            conn.execute(
+                '''UPDATE refresh_jobs
+                   SET status = ?, lease_owner = ?, lease_expires = ?, heartbeat_at = ?,
+                       attempts = attempts + 1, updated_at = ?
+                   WHERE id = ?''',
+                (STATUS_RUNNING, owner, now + self.lease_seconds,
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S"), row['id'])
+            )
+            job = dict(row)
+            job['status'] = STATUS_RUNNING
+            job['lease_owner'] = owner
+            job['attempts'] += 1
+            return job
+
+    def heartbeat(self, job_id, owner):
+        """Extend owner's lease on a job; returns False if the lease was lost"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                '''UPDATE refresh_jobs SET lease_expires = ?, heartbeat_at = ?
+                   WHERE job_id = ? AND lease_owner = ? AND status = ?''',
+                (time.time() + self.lease_seconds, datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                 job_id, owner, STATUS_RUNNING)
+            )
+            return cursor.rowcount > 0
+
+    def save_checkpoint(self, job_id, owner, index, fingerprint):
+        """Record that every entry before index has been committed"""
+        with self._connect() as conn:
+            conn.execute(
+                '''UPDATE refresh_jobs SET checkpoint = ?, checkpoint_file = ?, updated_at = ?
+                   WHERE job_id = ? AND lease_owner = ?''',
+                (index, fingerprint, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id, owner)
+            )
+
+    def complete(self, job_id, owner, status=STATUS_COMPLETED, error=None):
+        """Finish a job and release its lease"""
+        with self._connect() as conn:
+            conn.execute(
+                '''UPDATE refresh_jobs
+                   SET status = ?, error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?
+                   WHERE job_id = ? AND lease_owner = ?''',
+                (status, error, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id, owner)
+            )
+
+    def get_job(self, job_id):
+        """Return a job as a dict, or None"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM refresh_jobs WHERE job_id = ?', (job_id,)).fetchone()
+            return dict(row) if row else None
+
+    def get_counts(self):
+        """Return the number of jobs per status"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) AS count FROM refresh_jobs GROUP BY status').fetchall()
+            return {row['status']: row['count'] for row in rows}
+
+    def prune(self, keep_days=7):
+        """Delete finished jobs older than keep_days"""
+        cutoff = datetime.fromtimestamp(time.time() - keep_days * 86400).strftime("%Y-%m-%d %H:%M:%S")
+        with self._connect() as conn:
+            return conn.execute(
+                'DELETE FROM refresh_jobs WHERE status IN (?, ?) AND updated_at < ?',
+                (STATUS_COMPLETED, STATUS_ERROR, cutoff)
+            ).rowcount
+
+class JobCheckpoint:
+    """
+    Resume point of a claimed job, handed to StreamPipeline. The stored
+    entry index only applies to a playlist with the same content hash.
+    """
+
+    def __init__(self, queue, job):
+        """Wrap a job returned by JobQueue.claim"""
+        self.queue = queue
+        self.job_id = job['job_id']
+        self.owner = job['lease_owner']
+        self.index = job.get('checkpoint') or 0
+        self.fingerprint = job.get('checkpoint_file')
+
+    def can_resume(self, filename):
+        """True if filename has the content the checkpoint was recorded for"""
+        return bool(self.index) and os.path.exists(filename) and playlist_hash(filename) == self.fingerprint
+
+    def resume_index(self, filename):
+        """Entry index to resume filename from (0 to start over)"""
+        return self.index if self.can_resume(filename) else 0
+
+    def save(self, index, filename):
+        """Record that every entry of filename before index has been committed"""
+        self.index = index
+        self.fingerprint = playlist_hash(filename)
+        self.queue.save_checkpoint(self.job_id, self.owner, index, self.fingerprint)
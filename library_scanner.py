@@ -0,0 +1,220 @@
+import os
+import json
+import threading
+import logging
+import concurrent.futures
+import db
+
+logger = logging.getLogger(__name__)
+
+# Where scan results are cached between runs
+SCAN_CACHE_FILE = 'data/library_scan_cache.json'
+
+# Serialises reads/writes of the cache file within this process
+_cache_file_lock = threading.Lock()
+
+class LibraryScanner:
+    """
+    Scans the STRM content library (Movies / TV Shows) using os.scandir.
+
+    Top-level movie and show directories are walked in parallel threads.
+    Directory listings are cached together with the directory mtime, so a
+    directory that has not changed since the last scan is not listed again,
+    and STRM files are only re-read when their size or mtime changed.
+    """
+
+    def __init__(self, content_path=None, cache_path=SCAN_CACHE_FILE, max_workers=None):
+        """Initialize the scanner for a content path (defaults to the configured output path)"""
+        config = db.load_config()
+        self.content_path = content_path or config.get("output_path", "content")
+        self.max_workers = max_workers or config.get("scan_worker_count", 8)
+        self.cache_path = cache_path
+        self.cache = self._load_cache()
+
+    def _load_cache(self):
+        """Load the scan cache from disk"""
+        empty = {"dirs": {}, "strm": {}}
+        if not os.path.exists(self.cache_path):
+            return empty
+
+        try:
+            with _cache_file_lock:
+                with open(self.cache_path, 'r') as f:
+                    cache = json.load(f)
+            cache.setdefault("dirs", {})
+            cache.setdefault("strm", {})
+            return cache
+        except Exception as e:
+            logger.error(f"Error loading library scan cache: {str(e)}")
+            return empty
+
+    def _save_cache(self):
+        """Atomically write the scan cache to disk"""
+        try:
+            cache_dir = os.path.dirname(self.cache_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+
+            tmp_path = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with _cache_file_lock:
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.cache, f)
+                os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.error(f"Error saving library scan cache: {str(e)}")
+
+    def _list_dir(self, path, dirs_out):
+        """
+        List a directory, returning {"subdirs": [...], "files": [...]} where files
+        are .strm names. Reuses the cached listing if the directory mtime is unchanged.
+        """
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        cached = self.cache["dirs"].get(path)
+        if cached and cached.get("mtime_ns") == mtime_ns:
+            dirs_out[path] = cached
+            return cached
+
+        subdirs = []
+        files = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            subdirs.append(entry.name)
+                        elif entry.name.endswith(".strm") and entry.is_file():
+                            files.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.error(f"Error scanning directory {path}: {str(e)}")
+            return None
+
+        listing = {"mtime_ns": mtime_ns, "subdirs": sorted(subdirs), "files": sorted(files)}
+        dirs_out[path] = listing
+        return listing
+
+    def _read_strm(self, path, strm_out):
+        """Return the URL stored in a STRM file, re-reading it only if size or mtime changed"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        cached = self.cache["strm"].get(path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            strm_out[path] = cached
+            return cached[2]
+
+        try:
+            with open(path, 'r') as f:
+                url = f.read().strip()
+        except (OSError, UnicodeDecodeError) as e:
+            logger.error(f"Error reading STRM file {path}: {str(e)}")
+            return None
+
+        strm_out[path] = [st.st_size, st.st_mtime_ns, url]
+        return url
+
+    def _scan_title_dir(self, kind, root, name, read_urls):
+        """Scan one top-level movie or show directory (runs in a worker thread)"""
+        dirs_out = {}
+        strm_out = {}
+        found = {}
+
+        title_path = os.path.join(root, name)
+        listing = self._list_dir(title_path, dirs_out)
+        if listing is None:
+            return found, dirs_out, strm_out
+
+        for file in listing["files"]:
+            file_path = os.path.join(title_path, file)
+            found[os.path.join(name, file)] = self._read_strm(file_path, strm_out) if read_urls else None
+
+        # Movies are flat, TV shows may contain season directories
+        if kind == "tv":
+            for season in listing["subdirs"]:
+                season_path = os.path.join(title_path, season)
+                season_listing = self._list_dir(season_path, dirs_out)
+                if season_listing is None:
+                    continue
+                for file in season_listing["files"]:
+                    file_path = os.path.join(season_path, file)
+                    found[os.path.join(name, season, file)] = self._read_strm(file_path, strm_out) if read_urls else None
+
+        return found, dirs_out, strm_out
+
+    def scan(self, read_urls=False):
+        """
+        Scan the library and return {"movies": {relpath: url}, "tv": {relpath: url}}.
+        Paths are relative to the Movies / TV Shows folders; urls are None unless read_urls is set.
+        """
+        roots = {
+            "movies": os.path.join(self.content_path, 'Movies'),
+            "tv": os.path.join(self.content_path, 'TV Shows')
+        }
+
+        result = {"movies": {}, "tv": {}}
+        new_dirs = {}
+        new_strm = {}
+
+        tasks = []
+        for kind, root in roots.items():
+            listing = self._list_dir(root, new_dirs)
+            if listing is None:
+                continue
+            for name in listing["subdirs"]:
+                tasks.append((kind, root, name))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._scan_title_dir, kind, root, name, read_urls): kind
+                for kind, root, name in tasks
+            }
+            for future in concurrent.futures.as_completed(futures):
+                kind = futures[future]
+                try:
+                    found, dirs_out, strm_out = future.result()
+                except Exception as e:
+                    logger.error(f"Error scanning library directory: {str(e)}")
+                    continue
+                result[kind].update(found)
+                new_dirs.update(dirs_out)
+                new_strm.update(strm_out)
+
+        # Keep cached STRM records for files that still exist but were not read this time
+        if not read_urls:
+            for path, record in self.cache["strm"].items():
+                if path not in new_strm and os.path.dirname(path) in new_dirs:
+                    new_strm[path] = record
+
+        self.cache = {"dirs": new_dirs, "strm": new_strm}
+        self._save_cache()
+
+        logger.debug(f"Library scan found {len(result['movies'])} movie files and {len(result['tv'])} TV files")
+        return result
+
+    def list_content(self):
+        """Return {"movies": set(relpaths), "tv": set(relpaths)} of all STRM files"""
+        result = self.scan(read_urls=False)
+        return {
+            "movies": set(result["movies"]),
+            "tv": set(result["tv"])
+        }
+
+    def count_titles(self):
+        """Return (movie_count, show_count) based on the top-level directories"""
+        new_dirs = {}
+        counts = []
+        for folder in ('Movies', 'TV Shows'):
+            listing = self._list_dir(os.path.join(self.content_path, folder), new_dirs)
+            counts.append(len(listing["subdirs"]) if listing else 0)
+        return counts[0], counts[1]
+
+def scan_content_dirs(content_path=None):
+    """Scan content directories to build a list of current STRM files"""
+    return LibraryScanner(content_path).list_content()
@@ -1,13 +1,223 @@
 import re
 import os
+import gzip
+import json
 import uuid
 import logging
 import hashlib
+import threading
 import urllib.parse
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Files kept next to a proxy's playlist.m3u with its pre-rendered output
+RENDERED_FILE = "rendered.m3u"
+RENDERED_GZIP_FILE = "rendered.m3u.gz"
+RENDERED_META_FILE = "rendered.json"
+
+# Channels encoded per chunk when exporting a playlist as a stream
+EXPORT_CHUNK_CHANNELS = 1000
+
+# key="value" attributes and the duration of an EXTINF line
+EXTINF_ATTRIBUTE_PATTERN = re.compile(r'([a-zA-Z0-9-]+)="([^"]*)"')
+EXTINF_DURATION_PATTERN = re.compile(r'#EXTINF:([-0-9.]+)')
+
+# Signs that a playlist entry is VOD rather than a live channel
+VOD_EXTENSIONS = ['.mp4', '.mkv', '.avi', '.mpg', '.mpeg', '.mov']
+VOD_GROUP_KEYWORDS = ['vod', 'movie', 'film', 'series', 'show', 'episode']
+VOD_TVG_ID_KEYWORDS = ['movie', 'film', 'series']
+
+# Standard channel-name optimizations, in the order they apply (every option defaults to on)
+NAME_OPTIONS = (
+    'remove_country_prefix', 'remove_quality_prefix', 'remove_brackets', 'remove_special_chars',
+    'remove_suffixes', 'remove_symbols', 'fix_spacing'
+)
+
+# Country prefix (e.g., "US: ", "UK - ") and quality prefix (e.g., "HD: ", "4K - ", "FHD |")
+COUNTRY_PREFIX_PATTERN = re.compile(r'^[A-Z]{2}[\s:-]+')
+QUALITY_PREFIX_PATTERN = re.compile(r'^(HD|SD|FHD|UHD|4K|1080p|720p)[\s:|-]+', re.IGNORECASE)
+PREFIXES_PATTERN = re.compile(r'^(?:[A-Z]{2}[\s:-]+)?(?:(?i:HD|SD|FHD|UHD|4K|1080p|720p)[\s:|-]+)?')
+
+# Text in brackets and special characters like ᵁᴴᴰ
+BRACKETS_PATTERN = re.compile(r'\([^)]*\)|\[[^\]]*\]|\{[^}]*\}')
+SPECIAL_CHARS_PATTERN = re.compile(r'[^\x00-\x7F]+')
+BRACKETS_AND_SPECIAL_CHARS_PATTERN = re.compile(r'\([^)]*\)|\[[^\]]*\]|\{[^}]*\}|[^\x00-\x7F]+')
+
+# Quality, version and country code (2-letter codes at the end like FI, RO, UK) suffixes
+QUALITY_SUFFIX_PATTERN = re.compile(r'\s+(HD|SD|FHD|UHD|4K|UHDHDR|1080p|720p)(\s+|$)', re.IGNORECASE)
+VERSION_SUFFIX_PATTERN = re.compile(r'\s+V\d+(\s+|$)', re.IGNORECASE)
+COUNTRY_SUFFIX_PATTERN = re.compile(r'\s+[A-Z]{2}$')
+
+# Symbols, alone or with the country code suffix
+SYMBOLS_PATTERN = re.compile(r'[^\w\s]+')
+COUNTRY_SUFFIX_AND_SYMBOLS_PATTERN = re.compile(r'\s+[A-Z]{2}$|[^\w\s]+')
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+class NameOptimizer:
+    """
+    Compiled channel-name optimization plan: the enabled standard options
+    followed by custom regex patterns ({'pattern', 'replacement'}) in order.
+    Neighbouring options are fused into one regex pass where that gives the
+    same result as applying them one by one. Results are memoized by input
+    name, as playlists repeat names a lot. Raises re.error for an invalid
+    custom pattern.
+    """
+    
+    def __init__(self, options=None, custom_patterns=()):
+        if options is None:
+            options = {}
+        enabled = {option for option in NAME_OPTIONS if options.get(option, True)}
+        
+        steps = []
+        if {'remove_country_prefix', 'remove_quality_prefix'} <= enabled:
+            steps.append((PREFIXES_PATTERN, ''))
+        elif 'remove_country_prefix' in enabled:
+            steps.append((COUNTRY_PREFIX_PATTERN, ''))
+        elif 'remove_quality_prefix' in enabled:
+            steps.append((QUALITY_PREFIX_PATTERN, ''))
+        
+        if {'remove_brackets', 'remove_special_chars'} <= enabled:
+            steps.append((BRACKETS_AND_SPECIAL_CHARS_PATTERN, ''))
+        elif 'remove_brackets' in enabled:
+            steps.append((BRACKETS_PATTERN, ''))
+        elif 'remove_special_chars' in enabled:
+            steps.append((SPECIAL_CHARS_PATTERN, ''))
+        
+        if 'remove_suffixes' in enabled:
+            steps.append((QUALITY_SUFFIX_PATTERN, ' '))
+            steps.append((VERSION_SUFFIX_PATTERN, ' '))
+            if 'remove_symbols' in enabled:
+                steps.append((COUNTRY_SUFFIX_AND_SYMBOLS_PATTERN, ''))
+            else:
+                steps.append((COUNTRY_SUFFIX_PATTERN, ''))
+        elif 'remove_symbols' in enabled:
+            steps.append((SYMBOLS_PATTERN, ''))
+        
+        self.fix_spacing = 'fix_spacing' in enabled
+        self.standard_steps = steps
+        self.custom_patterns = [
+            (re.compile(pattern_data['pattern']), pattern_data.get('replacement', ''))
+            for pattern_data in custom_patterns if pattern_data.get('pattern')
+        ]
+        self.cache = {}
+    
+    def __call__(self, name):
+        """Optimized form of name"""
+        optimized = self.cache.get(name)
+        if optimized is None:
+            optimized = name
+            for regex, replacement in self.standard_steps:
+                optimized = regex.sub(replacement, optimized)
+            if self.fix_spacing:
+                optimized = WHITESPACE_PATTERN.sub(' ', optimized).strip()
+            for regex, replacement in self.custom_patterns:
+                optimized = regex.sub(replacement, optimized)
+            self.cache[name] = optimized
+        return optimized
+    
+    def optimize_names(self, names):
+        """Optimized form of each distinct name, as {name: optimized name}"""
+        return {name: self(name) for name in set(names)}
+
+def optimize_channel_name(name, options=None):
+    """Optimize a channel name based on options (every option defaults to on)"""
+    return NameOptimizer(options)(name)
+
+def existing_channel_number(tvg_chno):
+    """A channel's tvg-chno as a number, or None if it has none"""
+    try:
+        return int(tvg_chno) if tvg_chno else None
+    except (TypeError, ValueError):
+        return None
+
+def assign_channel_numbers(channels, start_number=1, by_group=False, group_order=None,
+                           group_starts=None, preserve_existing=False):
+    """
+    Channel numbers for channels, a sequence of (group title, existing
+    number or None) in playlist order, as a list of (index, number) for the
+    channels to number. Works in one bucket pass over the channels.
+    
+    Numbers run from start_number in playlist order, or group by group when
+    by_group is set (ungrouped channels are left as they are): groups listed
+    in group_order come first in that order, then the others sorted by
+    title. group_starts ({group: number}) starts a group's range at its own
+    number; later groups carry on from the end of it. With preserve_existing,
+    channels that have a number keep it and no other channel is given a
+    number already in use.
+    """
+    taken = set()
+    numbered = []
+    for index, (group, existing) in enumerate(channels):
+        if preserve_existing and existing is not None:
+            taken.add(existing)
+        elif group or not by_group:
+            numbered.append(index)
+    
+    if by_group:
+        buckets = {}
+        for index in numbered:
+            buckets.setdefault(channels[index][0], []).append(index)
+        rank = {group: position for position, group in enumerate(group_order or ())}
+        groups = sorted(buckets, key=lambda group: (0, rank[group], '') if group in rank else (1, 0, group))
+        group_starts = group_starts or {}
+        ranges = [(group_starts.get(group), buckets[group]) for group in groups]
+    else:
+        ranges = [(None, numbered)]
+    
+    # Numbers only collide when some are kept or a group range restarts the count
+    if not preserve_existing and not any(range_start is not None for range_start, _ in ranges):
+        number = start_number
+        assignments = []
+        for _, indices in ranges:
+            assignments.extend(zip(indices, range(number, number + len(indices))))
+            number += len(indices)
+        return assignments
+    
+    assignments = []
+    number = start_number
+    for range_start, indices in ranges:
+        if range_start is not None:
+            number = range_start
+        for index in indices:
+            while number in taken:
+                number += 1
+            taken.add(number)
+            assignments.append((index, number))
+            number += 1
+    return assignments
+
+def is_vod_entry(url, group_title, tvg_id):
+    """Determine if a playlist entry is VOD content (not live)"""
+    # Check URL for common VOD extensions
+    url_lower = url.lower()
+    for ext in VOD_EXTENSIONS:
+        if url_lower.endswith(ext):
+            return True
+    
+    # Check group title for VOD indicators
+    if group_title:
+        group_lower = group_title.lower()
+        for keyword in VOD_GROUP_KEYWORDS:
+            if keyword in group_lower:
+                return True
+    
+    # If tvg-id contains movie or series identifiers
+    if tvg_id and any(x in tvg_id.lower() for x in VOD_TVG_ID_KEYWORDS):
+        return True
+    
+    return False
+
+def format_extinf(duration, attributes, name):
+    """Build an EXTINF line; the tvg-name attribute always carries name"""
+    attr_str = ""
+    for key, value in attributes.items():
+        if key == 'tvg-name':
+            value = name  # Use the potentially modified name
+        attr_str += f' {key}="{value}"'
+    return f'#EXTINF:{duration}{attr_str}, {name}'
+
 class M3UChannel:
     """Represents a single channel in an M3U playlist"""
     def __init__(self, info_line="", url=""):
@@ -29,8 +239,7 @@ class M3UChannel:
             return attributes
         
         # Match attributes in format: key="value"
-        attr_pattern = re.compile(r'([a-zA-Z0-9-]+)="([^"]*)"')
-        matches = attr_pattern.findall(info_line)
+        matches = EXTINF_ATTRIBUTE_PATTERN.findall(info_line)
         for key, value in matches:
             attributes[key] = value
             
@@ -49,56 +258,8 @@ class M3UChannel:
     
     def optimize_name(self, options=None):
         """Optimize channel name based on options"""
-        if options is None:
-            options = {
-                'remove_country_prefix': True,
-                'remove_quality_prefix': True,
-                'remove_symbols': True,
-                'remove_brackets': True,
-                'fix_spacing': True,
-                'remove_special_chars': True,
-                'remove_suffixes': True
-            }
-        
-        name = self.name
-        
-        # Remove country prefix (e.g., "US: ", "UK - ")
-        if options.get('remove_country_prefix', True):
-            name = re.sub(r'^[A-Z]{2}[\s:-]+', '', name)
-        
-        # Remove quality prefixes (e.g., "HD: ", "4K - ", "FHD |")
-        if options.get('remove_quality_prefix', True):
-            name = re.sub(r'^(HD|SD|FHD|UHD|4K|1080p|720p)[\s:|-]+', '', name, flags=re.IGNORECASE)
-        
-        # Remove text in brackets
-        if options.get('remove_brackets', True):
-            name = re.sub(r'\([^)]*\)|\[[^\]]*\]|\{[^}]*\}', '', name)
-        
-        # Remove special characters like ᵁᴴᴰ
-        if options.get('remove_special_chars', True):
-            name = re.sub(r'[^\x00-\x7F]+', '', name)
-        
-        # Remove suffixes (quality indicators, version numbers, country codes)
-        if options.get('remove_suffixes', True):
-            # Remove quality suffixes (HD, SD, FHD, UHD, 4K, UHDHDR, etc.)
-            name = re.sub(r'\s+(HD|SD|FHD|UHD|4K|UHDHDR|1080p|720p)(\s+|$)', ' ', name, flags=re.IGNORECASE)
-            
-            # Remove version suffixes (V1, V2, etc.)
-            name = re.sub(r'\s+V\d+(\s+|$)', ' ', name, flags=re.IGNORECASE)
-            
-            # Remove country code suffixes (2-letter codes at the end like FI, RO, UK, etc.)
-            name = re.sub(r'\s+[A-Z]{2}$', '', name)
-        
-        # Remove symbols
-        if options.get('remove_symbols', True):
-            name = re.sub(r'[^\w\s]', '', name)
-        
-        # Fix spacing (multiple spaces to single space)
-        if options.get('fix_spacing', True):
-            name = re.sub(r'\s+', ' ', name).strip()
-        
-        self.name = name
-        return name
+        self.name = optimize_channel_name(self.name, options)
+        return self.name
     
     def set_channel_number(self, number):
         """Set the channel number"""
@@ -109,18 +270,10 @@ class M3UChannel:
     def to_extinf_line(self):
         """Convert back to EXTINF line format"""
         # Start with the duration part
-        duration_match = re.search(r'#EXTINF:([-0-9.]+)', self.info_line)
+        duration_match = EXTINF_DURATION_PATTERN.search(self.info_line)
         duration = "-1" if not duration_match else duration_match.group(1)
         
-        # Build attributes string
-        attr_str = ""
-        for key, value in self.attributes.items():
-            if key == 'tvg-name':
-                value = self.name  # Use the potentially modified name
-            attr_str += f' {key}="{value}"'
-        
-        # Construct the full EXTINF line
-        return f'#EXTINF:{duration}{attr_str}, {self.name}'
+        return format_extinf(duration, self.attributes, self.name)
 
 
 class M3UEditor:
@@ -195,25 +348,7 @@ class M3UEditor:
     
     def is_vod_channel(self, channel):
         """Determine if a channel is VOD content (not live)"""
-        # Check URL for common VOD extensions
-        vod_extensions = ['.mp4', '.mkv', '.avi', '.mpg', '.mpeg', '.mov']
-        for ext in vod_extensions:
-            if channel.url.lower().endswith(ext):
-                return True
-        
-        # Check group title for VOD indicators
-        vod_keywords = ['vod', 'movie', 'film', 'series', 'show', 'episode']
-        if channel.group_title:
-            group_lower = channel.group_title.lower()
-            for keyword in vod_keywords:
-                if keyword in group_lower:
-                    return True
-        
-        # If tvg-id contains movie or series identifiers
-        if channel.tvg_id and any(x in channel.tvg_id.lower() for x in ['movie', 'film', 'series']):
-            return True
-        
-        return False
+        return is_vod_entry(channel.url, channel.group_title, channel.tvg_id)
 
     def filter_vod_content(self, keep_live_only=True):
         """Filter out VOD content, keeping only live channels"""
@@ -231,26 +366,21 @@ class M3UEditor:
     
     def optimize_channel_names(self, options=None):
         """Optimize all channel names based on options"""
+        optimizer = NameOptimizer(options)
         for channel in self.channels:
-            channel.optimize_name(options)
+            channel.name = optimizer(channel.name)
         return self
     
-    def renumber_channels(self, start_number=1, by_group=False):
-        """Add channel numbers, optionally by group"""
-        if by_group:
-            # Get all unique groups
-            groups = sorted(set(channel.group_title for channel in self.channels if channel.group_title))
-            
-            current_number = start_number
-            for group in groups:
-                for channel in [c for c in self.channels if c.group_title == group]:
-                    channel.set_channel_number(current_number)
-                    current_number += 1
-        else:
-            # Simple sequential numbering
-            for i, channel in enumerate(self.channels, start=start_number):
-                channel.set_channel_number(i)
-                
+    def renumber_channels(self, start_number=1, by_group=False, group_order=None,
+                          group_starts=None, preserve_existing=False):
+        """Add channel numbers, optionally by group (see assign_channel_numbers)"""
+        channels = [
+            (channel.group_title, existing_channel_number(channel.tvg_chno) if preserve_existing else None)
+            for channel in self.channels
+        ]
+        for index, number in assign_channel_numbers(channels, start_number, by_group, group_order,
+                                                    group_starts, preserve_existing):
+            self.channels[index].set_channel_number(number)
         return self
     
     def filter_channels(self, group=None, name_contains=None):
@@ -284,27 +414,53 @@ class M3UEditor:
         return [(group, count) for group, count in groups.items()]
     
     def save_to_file(self, filepath):
-        """Save the current M3U to a file"""
-        content = self.export_to_string()
-        
+        """Save the current M3U to a file, streaming it in chunks"""
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(content)
+            with open(tmp_path, 'wb') as f:
+                for chunk in self.iter_export():
+                    f.write(chunk)
+            # Readers never see a half-written playlist
+            os.replace(tmp_path, filepath)
             logger.info(f"Saved M3U to file: {filepath}")
             return True
         except Exception as e:
             logger.error(f"Error saving M3U to file: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
             return False
     
-    def export_to_string(self):
-        """Export the M3U as a string"""
-        lines = self.headers.copy()
-        
+    def iter_lines(self):
+        """Yield the lines of the exported M3U"""
+        yield from self.headers
+        for channel in self.channels:
+            yield channel.to_extinf_line()
+            yield channel.url
+    
+    def iter_export(self, chunk_channels=EXPORT_CHUNK_CHANNELS):
+        """
+        Yield the exported M3U as UTF-8 encoded chunks of chunk_channels
+        channels, so large playlists can be written or sent with bounded
+        memory. The chunks join to export_to_string().encode('utf-8').
+        """
+        lines = list(self.headers)
+        separator = ''
+        pending = 0
         for channel in self.channels:
             lines.append(channel.to_extinf_line())
             lines.append(channel.url)
-        
-        return '\n'.join(lines)
+            pending += 1
+            if pending >= chunk_channels:
+                yield (separator + '\n'.join(lines)).encode('utf-8')
+                separator = '\n'
+                lines = []
+                pending = 0
+        if lines:
+            yield (separator + '\n'.join(lines)).encode('utf-8')
+    
+    def export_to_string(self):
+        """Export the M3U as a string"""
+        return '\n'.join(self.iter_lines())
     
     def generate_proxy_id(self, host=None):
         """Generate a unique ID for this M3U for proxying"""
@@ -313,7 +469,10 @@ class M3UEditor:
             return self.id
             
         # Generate a unique ID based on content and timestamp
-        content_hash = hashlib.md5(self.export_to_string().encode()).hexdigest()[:8]
+        digest = hashlib.md5()
+        for chunk in self.iter_export():
+            digest.update(chunk)
+        content_hash = digest.hexdigest()[:8]
         timestamp = int(datetime.now().timestamp())
         self.id = f"{content_hash}-{timestamp}"
         
@@ -331,6 +490,17 @@ class M3UEditor:
         return f"{protocol}://{host}/proxy/m3u/{proxy_id}/playlist.m3u"
 
 
+class RenderedPlaylist:
+    """Pre-rendered output of a proxy playlist, stored as files ready to be served"""
+
+    def __init__(self, path, gzip_path, etag, source_key):
+        self.path = path
+        self.gzip_path = gzip_path
+        self.etag = etag
+        # (mtime_ns, size) of the playlist.m3u this was rendered from
+        self.source_key = source_key
+
+
 class M3UProxyManager:
     """Manages M3U proxy instances and their storage"""
     
@@ -338,6 +508,10 @@ class M3UProxyManager:
         self.storage_dir = storage_dir
         if not os.path.exists(storage_dir):
             os.makedirs(storage_dir, exist_ok=True)
+
+        # Rendered playlists by proxy ID, checked against playlist.m3u with a stat
+        self._rendered = {}
+        self._render_lock = threading.Lock()
     
     def save_m3u(self, m3u_editor, name=None):
         """Save an M3U editor instance for proxying"""
@@ -361,15 +535,115 @@ class M3UProxyManager:
             "channel_count": len(m3u_editor.channels)
         }
         
-        metadata_path = os.path.join(m3u_dir, "metadata.json")
-        import json
-        with open(metadata_path, 'w') as f:
+        self._write_metadata(proxy_id, metadata)
+
+        self.invalidate_rendered(proxy_id)
+
+        # Index the channels now so they are searchable and editable without first being browsed
+        from channel_store import channel_store, entry_hash
+        # Channels fingerprinted as upstream wrote them (info_line is the line as read), so syncs diff against upstream
+        source_hashes = [entry_hash(channel.info_line, channel.url) for channel in m3u_editor.channels] if m3u_editor.m3u_url else None
+        try:
+            channel_store.reload(proxy_id, source_hashes=source_hashes)
+        except Exception as e:
+            logger.error(f"Error indexing channels of proxy {proxy_id}: {str(e)}")
+        return proxy_id
+    
+    def _write_metadata(self, proxy_id, metadata):
+        with open(os.path.join(self.storage_dir, proxy_id, "metadata.json"), 'w') as f:
             json.dump(metadata, f)
+    
+    def get_metadata(self, proxy_id):
+        """A proxy's metadata.json, or None if the proxy doesn't exist"""
+        try:
+            with open(os.path.join(self.storage_dir, proxy_id, "metadata.json"), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            return None
+    
+    def update_metadata(self, proxy_id, **fields):
+        """Update fields of a proxy's metadata.json, keeping the others"""
+        metadata_path = os.path.join(self.storage_dir, proxy_id, "metadata.json")
+        try:
+            with open(metadata_path, 'r') as f:
+                metadata = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        metadata.update(fields)
+        self._write_metadata(proxy_id, metadata)
+    
+    def _materialize(self, proxy_id):
+        """Write playlist.m3u from the channel table if the proxy was edited since it was last written"""
+        from channel_store import channel_store
+        channel_store.materialize(proxy_id)
+    
+    # Edits are applied to the channel table; playlist.m3u is written when next served
+    
+    def optimize_channel_names(self, proxy_id, options=None, custom_patterns=()):
+        """
+        Optimize a proxy's channel names, then apply custom regex patterns
+        ({'pattern', 'replacement'}) in order. Raises re.error for an invalid
+        pattern; returns the edit's result, or None if the proxy doesn't exist.
+        """
+        optimizer = NameOptimizer(options, custom_patterns)
+        
+        from channel_store import channel_store
+        return channel_store.rename_channels(proxy_id, optimizer, 'optimize_names', {
+            'options': options or {},
+            'custom_patterns': [{'pattern': regex.pattern, 'replacement': replacement} for regex, replacement in optimizer.custom_patterns]
+        })
+    
+    def renumber_channels(self, proxy_id, start_number=1, by_group=False, group_order=None,
+                          group_starts=None, preserve_existing=False):
+        """Renumber a proxy's channels; returns the edit's result, or None if the proxy doesn't exist"""
+        from channel_store import channel_store
+        return channel_store.renumber_channels(
+            proxy_id, start_number=start_number, by_group=by_group, group_order=group_order,
+            group_starts=group_starts, preserve_existing=preserve_existing
+        )
+    
+    def filter_vod_content(self, proxy_id, keep_live_only=True):
+        """Remove a proxy's VOD entries (or its live channels); returns the edit's result, or None if the proxy doesn't exist"""
+        from channel_store import channel_store
+        result = channel_store.filter_vod(proxy_id, keep_live_only=keep_live_only)
+        if result and result['changed']:
+            self.update_metadata(proxy_id, channel_count=result['channel_count'])
+        return result
+    
+    def filter_channels(self, proxy_id, group=None, name_contains=None, name=None):
+        """
+        Save the channels of a proxy in group and/or whose name contains
+        name_contains as a new proxy; returns (new proxy ID, channel count),
+        or None if the proxy doesn't exist.
+        """
+        from channel_store import channel_store
+        new_proxy_id = str(uuid.uuid4())
+        os.makedirs(os.path.join(self.storage_dir, new_proxy_id), exist_ok=True)
+        
+        count = channel_store.copy_filtered(proxy_id, new_proxy_id, group=group, name_contains=name_contains)
+        if count is None:
+            os.rmdir(os.path.join(self.storage_dir, new_proxy_id))
+            return None
         
-        return proxy_id
+        original_url = None
+        try:
+            with open(os.path.join(self.storage_dir, proxy_id, "metadata.json"), 'r') as f:
+                original_url = json.load(f).get("original_url")
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        
+        self._write_metadata(new_proxy_id, {
+            "id": new_proxy_id,
+            "name": name or f"Proxy M3U {new_proxy_id}",
+            "original_url": original_url,
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "channel_count": count
+        })
+        return new_proxy_id, count
     
     def get_m3u(self, proxy_id):
         """Get an M3U editor instance by proxy ID"""
+        self._materialize(proxy_id)
         m3u_path = os.path.join(self.storage_dir, proxy_id, "playlist.m3u")
         
         if not os.path.exists(m3u_path):
@@ -388,6 +662,94 @@ class M3UProxyManager:
         
         return m3u_editor
     
+    def get_rendered(self, proxy_id):
+        """
+        Get the RenderedPlaylist served for proxy_id (None if it doesn't exist).
+        Pending edits are first written to playlist.m3u, which is only parsed
+        and rendered again when it changed since the last render, so an
+        unchanged playlist costs a revision lookup and a stat.
+        """
+        # Absolute, since Flask's send_file resolves relative paths against the app
+        m3u_dir = os.path.abspath(os.path.join(self.storage_dir, proxy_id))
+        self._materialize(proxy_id)
+        try:
+            stat = os.stat(os.path.join(m3u_dir, "playlist.m3u"))
+        except (FileNotFoundError, NotADirectoryError):
+            self._rendered.pop(proxy_id, None)
+            return None
+        source_key = (stat.st_mtime_ns, stat.st_size)
+
+        rendered = self._rendered.get(proxy_id)
+        if rendered is not None and rendered.source_key == source_key:
+            return rendered
+
+        with self._render_lock:
+            # Another worker process may already have rendered this version
+            rendered = self._load_rendered(m3u_dir, source_key) or self._render(proxy_id, m3u_dir, source_key)
+            if rendered is not None:
+                self._rendered[proxy_id] = rendered
+        return rendered
+
+    def _load_rendered(self, m3u_dir, source_key):
+        """Return the rendered files on disk if they were made from source_key"""
+        try:
+            with open(os.path.join(m3u_dir, RENDERED_META_FILE), 'r') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        rendered = RenderedPlaylist(
+            os.path.join(m3u_dir, RENDERED_FILE),
+            os.path.join(m3u_dir, RENDERED_GZIP_FILE),
+            meta.get("etag"),
+            tuple(meta.get("source_key", ()))
+        )
+        if rendered.source_key != source_key or not os.path.exists(rendered.path) or not os.path.exists(rendered.gzip_path):
+            return None
+        return rendered
+
+    def _render(self, proxy_id, m3u_dir, source_key):
+        """Render the playlist once and store it plain and gzipped, streaming the export"""
+        m3u = self.get_m3u(proxy_id)
+        if m3u is None:
+            return None
+
+        rendered = RenderedPlaylist(
+            os.path.join(m3u_dir, RENDERED_FILE),
+            os.path.join(m3u_dir, RENDERED_GZIP_FILE),
+            None,
+            source_key
+        )
+
+        # Write to temporary names so concurrent readers never see partial files
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        digest = hashlib.sha1()
+        size = 0
+        with open(rendered.path + suffix, 'wb') as plain, open(rendered.gzip_path + suffix, 'wb') as compressed:
+            with gzip.GzipFile(filename='', fileobj=compressed, mode='wb', compresslevel=6, mtime=0) as gzipped:
+                for chunk in m3u.iter_export():
+                    plain.write(chunk)
+                    gzipped.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        rendered.etag = digest.hexdigest()
+        with open(os.path.join(m3u_dir, RENDERED_META_FILE) + suffix, 'w') as f:
+            json.dump({"etag": rendered.etag, "source_key": list(source_key)}, f)
+        os.replace(rendered.path + suffix, rendered.path)
+        os.replace(rendered.gzip_path + suffix, rendered.gzip_path)
+        os.replace(os.path.join(m3u_dir, RENDERED_META_FILE) + suffix, os.path.join(m3u_dir, RENDERED_META_FILE))
+
+        logger.info(f"Rendered proxy playlist {proxy_id}: {len(m3u.channels)} channels, {size} bytes")
+        return rendered
+
+    def invalidate_rendered(self, proxy_id):
+        """Forget the rendered output of proxy_id so the next request renders it again"""
+        self._rendered.pop(proxy_id, None)
+        try:
+            os.remove(os.path.join(self.storage_dir, proxy_id, RENDERED_META_FILE))
+        except FileNotFoundError:
+            pass
+
     def get_all_m3us(self):
         """Get metadata for all saved M3Us"""
         m3us = []
@@ -417,6 +779,11 @@ class M3UProxyManager:
         import shutil
         try:
             shutil.rmtree(m3u_dir)
+            self._rendered.pop(proxy_id, None)
+
+            # Drop the Channel Manager's indexed copy as well
+            from channel_store import channel_store
+            channel_store.drop(proxy_id)
             return True
         except Exception as e:
             logger.error(f"Error deleting M3U {proxy_id}: {str(e)}")
@@ -0,0 +1,200 @@
+import os
+import re
+import mmap
+import logging
+
+logger = logging.getLogger(__name__)
+
+TVG_NAME = b'tvg-name="'
+TVG_TYPE = b'tvg-type="'
+LANGUAGE_SEPARATOR = b' - '
+
+EXTM3U_PATTERN = re.compile(rb'EXTM3U', re.IGNORECASE)
+LONE_CR_PATTERN = re.compile(rb'\r(?!\n)')
+
+# Read modes: 'read' loads the file into memory, 'mmap' maps it, 'auto' picks by size
+READ_MODES = ('auto', 'read', 'mmap')
+
+class M3UReader:
+    """
+    Reads and tokenizes an M3U playlist directly from bytes.
+
+    An entry is a line carrying a tvg-name followed by its URL, optionally
+    with one extra # line (e.g. #EXTGRP) in between that becomes part of
+    streaminfo. The scan jumps from one tvg-name to the next with
+    bytes.find, and a byte-level prefilter rejects live streams and entries
+    whose language prefix the StreamFilter would reject. Rejected entries
+    are never decoded to str; accepted ones are decoded as UTF-8, falling
+    back to Latin-1.
+
+    In 'mmap' mode the file is memory-mapped and scanned in place: lines
+    are located by offset and only accepted entries are decoded from
+    memoryview slices, so memory use does not grow with the playlist size.
+
+    Nothing makes a pass over the whole file besides the scan itself: line
+    endings are checked up to the first entry (old Mac playlists, which end
+    lines with a lone \r, are then read into memory and normalised), and
+    other spellings of tvg-type only on lines that have a lowercase one.
+    """
+
+    def __init__(self, filename, stream_filter=None, skip_live=True, on_reject=None, mode='auto', mmap_threshold=64 * 1024 * 1024):
+        """Prepare a reader; on_reject(reason) is called for each prefiltered entry"""
+        self.filename = filename
+        self.skip_live = skip_live
+        self.on_reject = on_reject
+        self.mode = mode if mode in READ_MODES else 'auto'
+        self.mmap_threshold = mmap_threshold
+
+        # Byte versions of the language rules (None means "any language")
+        self.included_languages = None
+        self.excluded_languages = frozenset()
+        self.language_window = 0
+        if stream_filter is not None:
+            if stream_filter.included_languages is not None:
+                self.included_languages = frozenset(
+                    language.encode('utf-8') for language in stream_filter.included_languages
+                )
+            self.excluded_languages = frozenset(
+                language.encode('utf-8') for language in stream_filter.excluded_languages
+            )
+            self.language_window = stream_filter.max_language_length + len(LANGUAGE_SEPARATOR)
+        self.filters_language = self.included_languages is not None or bool(self.excluded_languages)
+
+    def _check_file(self):
+        """Raise if the playlist is missing or empty, otherwise return its size"""
+        if not os.path.exists(self.filename):
+            raise FileNotFoundError(f"Error: M3U file not found at {self.filename}")
+        size = os.path.getsize(self.filename)
+        if size == 0:
+            raise ValueError(f"Error: M3U file is empty ({self.filename})")
+        return size
+
+    def read(self):
+        """Return the whole playlist as bytes"""
+        self._check_file()
+        with open(self.filename, 'rb') as file:
+            return file.read()
+
+    def entries(self):
+        """Yield decoded (streaminfo, streamURL) pairs for entries that pass the prefilter"""
+        size = self._check_file()
+        use_mmap = self.mode == 'mmap' or (self.mode == 'auto' and size >= self.mmap_threshold)
+        if not use_mmap:
+            yield from self.scan(self.read())
+            return
+
+        with open(self.filename, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                logger.debug(f"Scanning memory-mapped playlist {self.filename} ({size} bytes)")
+                yield from self.scan(mapped)
+
+    def scan(self, buf):
+        """Yield (streaminfo, streamURL) pairs found in a bytes or mmap buffer"""
+        size = len(buf)
+        find = buf.find
+        pos = 0
+
+        def line_bounds(start):
+            # (end of line content, start of next line) for the line containing start
+            end = find(b'\n', start)
+            if end == -1:
+                end = size
+            if end > start and buf[end - 1] == 13:  # \r of a \r\n line ending
+                return end - 1, end + 1
+            return end, end + 1
+
+        start = find(TVG_NAME)
+        first_break = find(b'\n', start) if start != -1 else -1
+        # A lone \r up to the first entry's line break means old Mac line endings
+        if start != -1 and LONE_CR_PATTERN.search(buf, 0, size if first_break == -1 else first_break + 1):
+            logger.info(f"{self.filename} uses CR line endings, normalising them in memory")
+            yield from self.scan(bytes(buf).replace(b'\r\n', b'\n').replace(b'\r', b'\n'))
+            return
+
+        with memoryview(buf) as view:
+            while True:
+                start = find(TVG_NAME, pos)
+                if start == -1:
+                    return
+
+                line_start = buf.rfind(b'\n', pos, start) + 1 or pos
+                line_end, next_start = line_bounds(start)
+                if next_start >= size:
+                    return
+
+                # Every EXTM3U spelling contains "3U" or "3u"
+                if (find(b'3U', line_start, line_end) != -1 or find(b'3u', line_start, line_end) != -1) \
+                        and EXTM3U_PATTERN.search(buf, line_start, line_end):
+                    pos = next_start
+                    continue
+
+                next_end, after_next = line_bounds(next_start)
+
+                if buf[line_start:line_start + 1] == b'#' and buf[next_start:next_start + 1] == b'#':
+                    url_start = after_next
+                    url_end, after_url = line_bounds(url_start)
+                    if url_start >= size or find(b'://', url_start, url_end) == -1:
+                        logger.warning(f"Invalid stream format at byte {line_start}")
+                        pos = next_start
+                        continue
+                    info_parts = ((line_start, line_end), (next_start, next_end))
+                    pos = after_url
+                elif find(b'://', next_start, next_end) != -1:
+                    info_parts = ((line_start, line_end),)
+                    url_start, url_end = next_start, next_end
+                    pos = after_next
+                else:
+                    pos = next_start
+                    continue
+
+                reason = self._prefilter(buf, start, line_end, info_parts)
+                if reason:
+                    if self.on_reject:
+                        self.on_reject(reason)
+                    continue
+
+                streaminfo = ' '.join(_decode(view[part_start:part_end]) for part_start, part_end in info_parts)
+                yield streaminfo, _decode(view[url_start:url_end])
+
+    def _prefilter(self, buf, name_start, line_end, info_parts):
+        """Return a skip reason if the raw entry is certainly rejected, otherwise None"""
+        if self.skip_live:
+            for index, (part_start, part_end) in enumerate(info_parts):
+                type_start = buf.find(TVG_TYPE, part_start, part_end)
+                if type_start == -1:
+                    continue
+                value_start = type_start + len(TVG_TYPE)
+                if buf[value_start:value_start + 5] == b'live"':
+                    # The classifier matches tvg-type case-insensitively, so only reject when no
+                    # other spelling comes first (anything found before this one is another spelling)
+                    earlier = info_parts[:index] + ((part_start, type_start),)
+                    if not any(TVG_TYPE in buf[earlier_start:earlier_end].lower() for earlier_start, earlier_end in earlier):
+                        return 'live'
+                break
+
+        if self.filters_language:
+            value_start = name_start + len(TVG_NAME)
+            value_end = buf.find(b'"', value_start, line_end)
+            if value_end == -1:
+                # tvg-name continues past this line; leave it to the full filter
+                return None
+            head = buf[value_start:min(value_end, value_start + self.language_window)]
+            if not head.isascii():
+                return None
+            separator = head.find(LANGUAGE_SEPARATOR)
+            language = head[:separator] if separator > 0 else None
+            if self.included_languages is not None and language not in self.included_languages:
+                return 'language'
+            if language in self.excluded_languages:
+                return 'language'
+
+        return None
+
+def _decode(raw):
+    """Decode an entry line as UTF-8, falling back to Latin-1"""
+    try:
+        return str(raw, 'utf-8')
+    except UnicodeDecodeError:
+        return str(raw, 'latin-1')
@@ -0,0 +1,206 @@
+import os
+import json
+import atexit
+import hashlib
+import inspect
+import logging
+import sqlite3
+import threading
+import collections
+import multiprocessing.util
+from datetime import datetime
+import db
+import tools
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate every cached parse without touching tools.py
+PARSE_CACHE_VERSION = 1
+
+# Functions whose behaviour determines the result of tools.parseEpisode
+PARSER_FUNCTIONS = (
+    tools.parseEpisode, tools.airDateMatch, tools.sxxExxMatch, tools.seasonMatch,
+    tools.seasonMatch2, tools.episodeMatch, tools.episodeMatch2,
+    tools.languageMatch, tools.stripSxxExx
+)
+
+# Pending rows are written to SQLite in batches of this size
+FLUSH_BATCH_SIZE = 500
+
+_parse_cache = None
+_parse_cache_lock = threading.Lock()
+
+def parser_version():
+    """Stamp derived from the source of the parsing functions"""
+    digest = hashlib.sha1(str(PARSE_CACHE_VERSION).encode())
+    for func in PARSER_FUNCTIONS:
+        digest.update(inspect.getsource(func).encode())
+    return digest.hexdigest()[:16]
+
+class ParseCache:
+    """
+    Memoizes tools.parseEpisode with an in-memory LRU in front of an SQLite
+    table. Rows are stamped with the parser version, so any change to the
+    parsing functions invalidates the cache automatically.
+    """
+
+    def __init__(self, db_file=db.DB_FILE, max_size=50000):
+        """Open the back store and drop rows written by other parser versions"""
+        self.version = parser_version()
+        self.max_size = max_size
+        self.lru = collections.OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS parse_cache (
+                title_hash TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                result TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            ''')
+            deleted = self.conn.execute('DELETE FROM parse_cache WHERE version != ?', (self.version,)).rowcount
+        if deleted:
+            logger.info(f"Parse cache: discarded {deleted} entries from an older parser version")
+
+    @staticmethod
+    def title_hash(title):
+        """Cache key for a title"""
+        return hashlib.sha1(title.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    def parse_episode(self, title):
+        """Cached equivalent of tools.parseEpisode(title)"""
+        if title is None:
+            return tools.parseEpisode(title)
+
+        key = self.title_hash(title)
+        encoded = self._get(key)
+        if encoded is None:
+            result = tools.parseEpisode(title)
+            self._put(key, json.dumps(result))
+            return result
+
+        # A cached "no match" is stored as JSON null, so it is not a miss
+        return json.loads(encoded)
+
+    def _get(self, key):
+        """Look a key up in the LRU, then in SQLite"""
+        with self.lock:
+            encoded = self.lru.get(key)
+            if encoded is not None:
+                self.lru.move_to_end(key)
+                self.hits += 1
+                return encoded
+
+            encoded = self.pending.get(key)
+            if encoded is None:
+                row = self.conn.execute(
+                    'SELECT result FROM parse_cache WHERE title_hash = ? AND version = ?',
+                    (key, self.version)
+                ).fetchone()
+                encoded = row[0] if row else None
+
+            if encoded is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._remember(key, encoded)
+            return encoded
+
+    def _put(self, key, encoded):
+        """Store a freshly parsed result"""
+        with self.lock:
+            self._remember(key, encoded)
+            self.pending[key] = encoded
+            if len(self.pending) >= FLUSH_BATCH_SIZE:
+                self._flush_locked()
+
+    def _remember(self, key, encoded):
+        """Add a key to the LRU, evicting the least recently used entry"""
+        self.lru[key] = encoded
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.max_size:
+            self.lru.popitem(last=False)
+
+    def flush(self):
+        """Write pending results to SQLite"""
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        """Write pending results; the caller holds self.lock"""
+        if not self.pending:
+            return
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [(key, self.version, encoded, now) for key, encoded in self.pending.items()]
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO parse_cache (title_hash, version, result, updated_at) VALUES (?, ?, ?, ?)',
+                    rows
+                )
+            self.pending.clear()
+        except sqlite3.Error as e:
+            logger.error(f"Error writing parse cache: {str(e)}")
+
+    def clear(self):
+        """Drop every cached result"""
+        with self.lock:
+            self.lru.clear()
+            self.pending.clear()
+            with self.conn:
+                self.conn.execute('DELETE FROM parse_cache')
+
+    def get_stats(self):
+        """Return hit/miss counters for logging"""
+        with self.lock:
+            return {
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self.lru)
+            }
+
+def get_parse_cache(config=None):
+    """Return the process-wide ParseCache, or None when caching is disabled"""
+    global _parse_cache
+    config = config or db.load_config()
+    if not config.get("parse_cache_enabled", True):
+        return None
+
+    if _parse_cache is None:
+        with _parse_cache_lock:
+            if _parse_cache is None:
+                cache = ParseCache(max_size=config.get("parse_cache_size", 50000))
+                # Flush on interpreter exit and when a pipeline worker process exits
+                atexit.register(cache.flush)
+                multiprocessing.util.Finalize(cache, cache.flush, exitpriority=10)
+                _parse_cache = cache
+    return _parse_cache
+
+def _forget_after_fork():
+    """A forked child (a process pool worker) opens its own cache: SQLite connections must not cross fork()"""
+    global _parse_cache, _parse_cache_lock
+    _parse_cache = None
+    _parse_cache_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_after_fork)
+
+def parse_episode(title, config=None):
+    """tools.parseEpisode backed by the parse cache when it is enabled"""
+    cache = get_parse_cache(config)
+    if cache is None:
+        return tools.parseEpisode(title)
+    return cache.parse_episode(title)
+
+def flush():
+    """Write any pending cache entries to SQLite"""
+    if _parse_cache is not None:
+        _parse_cache.flush()
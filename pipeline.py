@@ -0,0 +1,391 @@
+import time
+import heapq
+import hashlib
+import logging
+import threading
+import collections
+import concurrent.futures
+import db
+import parse_cache
+from processing_monitor import processing_monitor
+from sse_notifications import send_status_update
+from content_comparison import get_content_registry
+from stream_filter import get_stream_filter
+from stream_classifier import get_stream_classifier
+from m3u_reader import M3UReader
+
+logger = logging.getLogger(__name__)
+
+# Supported executors for the plan/commit stages
+EXECUTORS = ('serial', 'thread', 'process')
+
+# Minimum seconds between progress updates
+PROGRESS_INTERVAL = 2
+
+# Planner used by _plan_stream (one per process)
+_planner = None
+_planner_lock = threading.Lock()
+
+# Classifier of the pipeline a process pool worker plans for (see _init_process_worker)
+_worker_classifier = None
+
+class PipelineStats:
+    """Counters collected by the record stage of a StreamPipeline"""
+
+    def __init__(self):
+        self.movies_count = 0
+        self.tv_count = 0
+        self.skip_count = 0
+        self.error_count = 0
+        self.entries = 0
+        self.resumed = 0
+        self.skip_reasons = collections.Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def processed(self):
+        """Number of entries that have been fully handled (including those done before a resume)"""
+        return self.movies_count + self.tv_count + self.skip_count + self.resumed
+
+    def as_dict(self):
+        """Return the stats in the dict shape used by both entry points"""
+        return {
+            "movies_count": self.movies_count,
+            "tv_count": self.tv_count,
+            "skip_count": self.skip_count,
+            "error_count": self.error_count
+        }
+
+class StreamPipeline:
+    """
+    Single staged pipeline for turning an M3U file into STRM files:
+    read -> tokenize -> filter -> classify -> plan -> commit -> record.
+
+    Reading and tokenizing are done on bytes by M3UReader, which prefilters
+    entries before decoding them; tokenizing and filtering are lazy. Classify and plan
+    run on the chosen executor ('serial', 'thread' or 'process'); commits run
+    in this process, either inline or on single-threaded lanes keyed by
+    title so every entry for a movie/show is written in playlist order.
+
+    With a checkpoint (job_queue.JobCheckpoint or checkpoints.StoredCheckpoint),
+    the index below which every entry has been committed is saved every
+    checkpoint_interval entries, right after the registry is flushed, and
+    a resumed run of the same playlist content skips those entries without
+    parsing them again.
+
+    With an entry_range (start, end), only entries start <= index < end are
+    processed; shard_queue uses this to split one playlist across workers.
+    """
+
+    def __init__(self, filename, provider_url=None, job_id=None, executor=None, worker_count=None, window_size=None, checkpoint=None,
+                 entry_range=None, registry=None):
+        """Configure the pipeline (executor, workers and window default to config)"""
+        config = db.load_config()
+        self.filename = filename
+        self.provider_url = provider_url
+        self.job_id = job_id
+        self.executor = executor or config.get("pipeline_executor", "thread")
+        if self.executor not in EXECUTORS:
+            logger.warning(f"Unknown pipeline executor '{self.executor}', using 'thread'")
+            self.executor = 'thread'
+        self.worker_count = max(1, worker_count or config.get("worker_count", 10))
+        self.window_size = max(1, window_size or config.get("processing_batch_size", 100))
+        self.stream_filter = get_stream_filter(config)
+        self.classifier = get_stream_classifier(config)
+        self.read_mode = config.get("m3u_read_mode", "auto")
+        self.mmap_threshold = config.get("mmap_threshold_mb", 64) * 1024 * 1024
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = max(1, config.get("checkpoint_interval", 1000))
+
+        self.stats = PipelineStats()
+        self.registry = registry or get_content_registry()
+        self._last_progress = 0
+
+        # Entries outside [range_start, range_end) belong to another shard
+        self.range_start, self.range_end = entry_range or (0, None)
+        self._position = 0
+
+        # Entries below start_index were committed by an earlier run
+        self.start_index = 0
+        self._finished = []
+        self._watermark = 0
+        self._checkpointed = 0
+        self._checkpoint_lock = threading.Lock()
+
+    def run(self):
+        """Run every stage and return the PipelineStats"""
+        logger.info(f"Running {self.executor} pipeline for {self.filename}")
+        if self.checkpoint is not None:
+            self.start_index = self.checkpoint.resume_index(self.filename)
+            if self.start_index:
+                logger.info(f"Resuming {self.filename} after entry {self.start_index}")
+        self.start_index = max(self.start_index, self.range_start)
+        self._watermark = self._checkpointed = self.start_index
+
+        reader = M3UReader(
+            self.filename,
+            self.stream_filter,
+            on_reject=self._reject,
+            mode=self.read_mode,
+            mmap_threshold=self.mmap_threshold
+        )
+        entries = self.filter(reader.entries())
+
+        # Other worker processes may have written the shared registry; writes merge into their version
+        self.registry.reload_if_stale()
+
+        # Write the registry once at the end instead of after every entry
+        with self.registry.deferred_save():
+            if self.executor == 'serial':
+                self._run_serial(entries)
+            else:
+                self._run_parallel(entries)
+
+        parse_cache.flush()
+        self._report_progress(force=True)
+        logger.info(f"Pipeline finished: {self.stats.as_dict()}")
+        return self.stats
+
+    # Stages: read and tokenize
+
+    def _next_index(self):
+        """Number the next entry in playlist order; None if it is outside the range or already committed"""
+        index = self._position
+        self._position += 1
+        if index < self.range_start or (self.range_end is not None and index >= self.range_end):
+            return None
+        self.stats.entries += 1
+        if index < self.start_index:
+            self.stats.resumed += 1
+            return None
+        return index
+
+    def _reject(self, reason):
+        """Count an entry rejected by the reader's byte-level prefilter"""
+        index = self._next_index()
+        if index is None:
+            return
+        self.stats.skip_reasons[reason] += 1
+        self._record(None, index=index)
+
+    # Stage: filter
+
+    def filter(self, pairs):
+        """Yield (index, streaminfo, streamURL) for entries that pass the StreamFilter, counting the rest as skipped"""
+        check = self.stream_filter.check
+        for streaminfo, streamURL in pairs:
+            if self.range_end is not None and self._position >= self.range_end:
+                break
+            index = self._next_index()
+            if index is None:
+                continue
+            reason = check(streaminfo)
+            if reason:
+                logger.debug(f"Skipping stream ({reason} filter): {streaminfo}")
+                self.stats.skip_reasons[reason] += 1
+                self._record(None, index=index)
+                continue
+            yield index, streaminfo, streamURL
+
+    # Stages: commit and record
+
+    def commit(self, item):
+        """Create the STRM file and registry record for a planned entry"""
+        item.makeStream(self.provider_url, self.registry)
+
+    def _record(self, item, error=None, index=None):
+        """Count one finished entry, advance the checkpoint and report progress"""
+        with self.stats.lock:
+            if error is not None:
+                logger.error(f"Error processing stream: {str(error)}")
+                self.stats.error_count += 1
+                self.stats.skip_count += 1
+            elif item is None:
+                self.stats.skip_count += 1
+            elif hasattr(item, 'showtitle'):
+                self.stats.tv_count += 1
+            else:
+                self.stats.movies_count += 1
+
+            if index is not None:
+                # Entries finish out of order; the watermark only passes contiguous runs
+                heapq.heappush(self._finished, index)
+                while self._finished and self._finished[0] == self._watermark:
+                    heapq.heappop(self._finished)
+                    self._watermark += 1
+            watermark = self._watermark
+
+        if self.checkpoint is not None and watermark - self._checkpointed >= self.checkpoint_interval:
+            self._save_checkpoint(watermark)
+        self._report_progress()
+
+    def _save_checkpoint(self, watermark):
+        """Flush the registry, then record that every entry below watermark is committed"""
+        with self._checkpoint_lock:
+            if watermark <= self._checkpointed:
+                return
+            self.registry.flush()
+            parse_cache.flush()
+            self.checkpoint.save(watermark, self.filename)
+            self._checkpointed = watermark
+            logger.debug(f"Checkpoint saved at entry {watermark}")
+
+    def _report_progress(self, force=False):
+        """Push progress to processing_monitor and the browser, throttled to PROGRESS_INTERVAL"""
+        if not self.job_id:
+            return
+        now = time.time()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+
+        stats = self.stats
+        current_item = f"Creating STRM files: {stats.processed} streams processed"
+        processing_monitor.update_job(
+            self.job_id,
+            current_item=current_item,
+            items_processed=stats.processed,
+            errors=stats.error_count
+        )
+        send_status_update({
+            "jobId": self.job_id,
+            "processed": stats.processed,
+            "total": stats.entries,
+            "movies": stats.movies_count,
+            "tv": stats.tv_count,
+            "skipped": stats.skip_count,
+            "errors": stats.error_count,
+            "currentItem": current_item
+        })
+
+    # Executors
+
+    def _run_serial(self, entries):
+        """Classify, plan and commit each entry inline, in playlist order"""
+        for index, streaminfo, streamURL in entries:
+            try:
+                item = _plan_stream(streaminfo, streamURL, classifier=self.classifier)
+                if item:
+                    self.commit(item)
+            except Exception as e:
+                self._record(None, error=e, index=index)
+                continue
+            self._record(item, index=index)
+
+    def _run_parallel(self, entries):
+        """
+        Classify and plan on a thread or process pool, then commit on
+        single-threaded lanes keyed by title. At most window_size entries
+        are in flight at once.
+        """
+        if self.executor == 'process':
+            # The classifier is sent to each worker once, not with every entry
+            pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.worker_count,
+                initializer=_init_process_worker,
+                initargs=(self.classifier,)
+            )
+            classifier = None
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.worker_count)
+            classifier = self.classifier
+        lanes = [concurrent.futures.ThreadPoolExecutor(max_workers=1) for _ in range(self.worker_count)]
+
+        planned = collections.deque()
+        commits = set()
+        state = threading.Condition()
+        inflight = [0]
+
+        def finished(index, future=None, item=None, error=None):
+            # Runs on a lane thread (commits) or inline (skips and plan errors)
+            if future is not None:
+                error = future.exception()
+            self._record(item if error is None else None, error=error, index=index)
+            with state:
+                if future is not None:
+                    commits.discard(future)
+                inflight[0] -= 1
+                state.notify_all()
+
+        def dispatch(index, future):
+            # Hand a planned entry to the lane owning its title
+            try:
+                item = future.result()
+            except Exception as e:
+                finished(index, error=e)
+                return
+            if item is None:
+                finished(index)
+                return
+            lane = lanes[int(_lane_key(item)[:8], 16) % len(lanes)]
+            commit = lane.submit(self.commit, item)
+            with state:
+                commits.add(commit)
+            commit.add_done_callback(lambda f: finished(index, f, item))
+
+        try:
+            for index, streaminfo, streamURL in entries:
+                # Backpressure: dispatch in order until a window slot frees up
+                while True:
+                    with state:
+                        if inflight[0] < self.window_size:
+                            inflight[0] += 1
+                            break
+                        if not planned:
+                            state.wait()
+                            continue
+                    dispatch(*planned.popleft())
+
+                planned.append((index, pool.submit(_plan_stream, streaminfo, streamURL, classifier=classifier)))
+                while planned and planned[0][1].done():
+                    dispatch(*planned.popleft())
+
+            while planned:
+                dispatch(*planned.popleft())
+            with state:
+                while inflight[0]:
+                    state.wait()
+        finally:
+            pool.shutdown(wait=True)
+            for lane in lanes:
+                lane.shutdown(wait=True)
+
+def _get_planner():
+    """Return this process's bare rawStreamList used for its classify/plan rules"""
+    global _planner
+    if _planner is None:
+        with _planner_lock:
+            if _planner is None:
+                from streamClasses import rawStreamList
+
+                planner = rawStreamList.__new__(rawStreamList)
+                planner.log = logging.getLogger("temp")
+                planner.m3u_url = None
+                planner.classifier = None
+                planner.error_count = 0
+                planner.skip_count = 0
+                _planner = planner
+    return _planner
+
+def _init_process_worker(classifier):
+    """Process pool initializer: keep the pipeline's classifier for _plan_stream"""
+    global _worker_classifier
+    _worker_classifier = classifier
+
+def _plan_stream(streaminfo, streamURL, stream_type=None, classifier=None):
+    """
+    Classify (with classifier, or the process worker's) and plan one entry,
+    returning a Movie/TVEpisode or None (runs on any executor)
+    """
+    from streamClasses import StreamEntry
+
+    stream = StreamEntry(streaminfo, streamURL, stream_type)
+    return _get_planner().planStreamEntry(stream, classifier or _worker_classifier)
+
+def _lane_key(item):
+    """
+    Lane key for a planned Movie/TVEpisode: the normalised movie/show title.
+    Entries sharing a registry hash or a STRM path always share a title.
+    """
+    title = item.showtitle if hasattr(item, 'showtitle') else item.title
+    return hashlib.md5(title.lower().strip().encode()).hexdigest()
@@ -1,182 +1,244 @@
 import time
 import threading
 import logging
+import sqlite3
 from datetime import datetime
 import json
 import os
+import db
 
 logger = logging.getLogger(__name__)
 
+# Columns of processing_jobs, in the order of the job dicts returned by the monitor
+JOB_COLUMNS = (
+    'id', 'description', 'status', 'start_time', 'last_update', 'end_time',
+    'elapsed_seconds', 'current_item', 'items_processed', 'errors', 'error'
+)
+
+# Statuses of jobs that are still listed as active
+ACTIVE_STATUSES = ('running', 'stuck')
+
 class ProcessingMonitor:
-    """Monitor and track the status of processing jobs"""
-    
-    def __init__(self, timeout_seconds=300):
+    """
+    Monitor and track the status of processing jobs.
+
+    Jobs are stored in the processing_jobs table, so every worker process
+    of the app sees the same active jobs and history.
+    """
+
+    def __init__(self, timeout_seconds=300, db_file=db.DB_FILE):
         """Initialize the monitor with a timeout value (default 5 minutes)"""
-        self.active_jobs = {}
         self.timeout_seconds = timeout_seconds
+        self.db_file = db_file
         self.lock = threading.Lock()
-        self.jobs_history = []
         self.max_history = 20
-        
-        # Ensure the status directory exists
-        os.makedirs('data/status', exist_ok=True)
+
         self.status_file = 'data/status/processing_status.json'
-        
-        # Load any existing status
-        self._load_status()
-        
+        self._init_table()
+
         # Start the monitoring thread
         self.monitor_thread = threading.Thread(target=self._monitor_thread, daemon=True)
         self.monitor_thread.start()
-    
-    def _load_status(self):
-        """Load processing status from file"""
+
+    def _connect(self):
+        """Open a connection that waits for other writers instead of failing"""
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_table(self):
+        """Create the jobs table, importing history from the old status file once"""
+        with self._connect() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS processing_jobs (
+                id TEXT PRIMARY KEY,
+                description TEXT,
+                status TEXT NOT NULL,
+                start_time TEXT NOT NULL,
+                last_update TEXT NOT NULL,
+                end_time TEXT,
+                elapsed_seconds INTEGER DEFAULT 0,
+                current_item TEXT,
+                items_processed INTEGER DEFAULT 0,
+                errors INTEGER DEFAULT 0,
+                error TEXT
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_processing_jobs_status ON processing_jobs (status, end_time)')
+            empty = conn.execute('SELECT COUNT(*) FROM processing_jobs').fetchone()[0] == 0
+
+        if empty and os.path.exists(self.status_file):
+            self._import_status_file()
+
+    def _import_status_file(self):
+        """Copy the job history from processing_status.json into the table"""
         try:
-            if os.path.exists(self.status_file):
-                with open(self.status_file, 'r') as f:
-                    data = json.load(f)
-                    self.jobs_history = data.get('history', [])
+            with open(self.status_file, 'r') as f:
+                history = json.load(f).get('history', [])
+            with self._connect() as conn:
+                for job in history:
+                    conn.execute(
+                        f'INSERT OR IGNORE INTO processing_jobs ({", ".join(JOB_COLUMNS)}) VALUES ({", ".join("?" * len(JOB_COLUMNS))})',
+                        tuple(job.get(column) for column in JOB_COLUMNS)
+                    )
+            logger.info(f"Imported {len(history)} jobs from {self.status_file}")
         except Exception as e:
             logger.error(f"Error loading status file: {e}")
-            self.jobs_history = []
-    
-    def _save_status(self):
-        """Save processing status to file"""
-        try:
-            status_data = {
-                'active': list(self.active_jobs.values()),
-                'history': self.jobs_history
-            }
-            
-            with open(self.status_file, 'w') as f:
-                json.dump(status_data, f)
-        except Exception as e:
-            logger.error(f"Error saving status file: {e}")
-    
+
+    @staticmethod
+    def _job_dict(row):
+        """Convert a processing_jobs row to the job dict used by the API and templates"""
+        job_info = dict(row)
+        for optional in ('end_time', 'error'):
+            if job_info[optional] is None:
+                del job_info[optional]
+        return job_info
+
+    @staticmethod
+    def _elapsed(start_time):
+        """Seconds since a job's start_time"""
+        start = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
+        return int((datetime.now() - start).total_seconds())
+
     def start_job(self, job_id, description):
         """Register the start of a new processing job"""
-        with self.lock:
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            job_info = {
-                'id': job_id,
-                'description': description,
-                'status': 'running',
-                'start_time': now,
-                'last_update': now,
-                'elapsed_seconds': 0,
-                'current_item': None,
-                'items_processed': 0,
-                'errors': 0
-            }
-            
-            self.active_jobs[job_id] = job_info
-            self._save_status()
-            return job_info
-    
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        job_info = {
+            'id': job_id,
+            'description': description,
+            'status': 'running',
+            'start_time': now,
+            'last_update': now,
+            'elapsed_seconds': 0,
+            'current_item': None,
+            'items_processed': 0,
+            'errors': 0
+        }
+
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                '''INSERT OR REPLACE INTO processing_jobs
+                   (id, description, status, start_time, last_update, elapsed_seconds, current_item, items_processed, errors)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (job_id, description, 'running', now, now, 0, None, 0, 0)
+            )
+        return job_info
+
     def update_job(self, job_id, current_item=None, items_processed=None, errors=None, status=None):
         """Update the status of an active job"""
-        with self.lock:
-            if job_id not in self.active_jobs:
+        with self.lock, self._connect() as conn:
+            row = conn.execute(
+                f'SELECT * FROM processing_jobs WHERE id = ? AND status IN ({", ".join("?" * len(ACTIVE_STATUSES))})',
+                (job_id,) + ACTIVE_STATUSES
+            ).fetchone()
+            if row is None:
                 return None
-            
-            job_info = self.active_jobs[job_id]
+
+            job_info = self._job_dict(row)
             job_info['last_update'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
+
             if current_item is not None:
                 job_info['current_item'] = current_item
-            
+
             if items_processed is not None:
                 job_info['items_processed'] = items_processed
-            
+
             if errors is not None:
                 job_info['errors'] = errors
-            
+
             if status is not None:
                 job_info['status'] = status
-            
+
             # Calculate elapsed time
-            start_time = datetime.strptime(job_info['start_time'], "%Y-%m-%d %H:%M:%S")
-            elapsed = (datetime.now() - start_time).total_seconds()
-            job_info['elapsed_seconds'] = int(elapsed)
-            
-            self._save_status()
+            job_info['elapsed_seconds'] = self._elapsed(job_info['start_time'])
+
+            conn.execute(
+                '''UPDATE processing_jobs
+                   SET last_update = ?, current_item = ?, items_processed = ?, errors = ?, status = ?, elapsed_seconds = ?
+                   WHERE id = ?''',
+                (job_info['last_update'], job_info['current_item'], job_info['items_processed'],
+                 job_info['errors'], job_info['status'], job_info['elapsed_seconds'], job_id)
+            )
             return job_info
-    
+
     def complete_job(self, job_id, status='completed', error=None):
         """Mark a job as completed and move it to history"""
-        with self.lock:
-            if job_id not in self.active_jobs:
+        with self.lock, self._connect() as conn:
+            row = conn.execute('SELECT start_time, status FROM processing_jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None or row['status'] not in ACTIVE_STATUSES:
                 return
-            
-            job_info = self.active_jobs[job_id]
-            job_info['status'] = status
-            job_info['end_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            if error:
-                job_info['error'] = str(error)
-            
-            # Calculate elapsed time
-            start_time = datetime.strptime(job_info['start_time'], "%Y-%m-%d %H:%M:%S")
-            elapsed = (datetime.now() - start_time).total_seconds()
-            job_info['elapsed_seconds'] = int(elapsed)
-            
-            # Add to history and maintain max history size
-            self.jobs_history.insert(0, job_info)
-            self.jobs_history = self.jobs_history[:self.max_history]
-            
-            # Remove from active jobs
-            del self.active_jobs[job_id]
-            self._save_status()
-    
+
+            conn.execute(
+                '''UPDATE processing_jobs
+                   SET status = ?, end_time = ?, error = ?, elapsed_seconds = ?
+                   WHERE id = ?''',
+                (status, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), str(error) if error else None,
+                 self._elapsed(row['start_time']), job_id)
+            )
+
+            # Maintain max history size
+            conn.execute(
+                f'''DELETE FROM processing_jobs
+                   WHERE status NOT IN ({", ".join("?" * len(ACTIVE_STATUSES))})
+                   AND id NOT IN (
+                       SELECT id FROM processing_jobs
+                       WHERE status NOT IN ({", ".join("?" * len(ACTIVE_STATUSES))})
+                       ORDER BY end_time DESC LIMIT ?
+                   )''',
+                ACTIVE_STATUSES + ACTIVE_STATUSES + (self.max_history,)
+            )
+
     def get_active_jobs(self):
         """Get all active jobs"""
-        with self.lock:
-            return list(self.active_jobs.values())
-    
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT * FROM processing_jobs WHERE status IN ({", ".join("?" * len(ACTIVE_STATUSES))}) ORDER BY start_time',
+                ACTIVE_STATUSES
+            ).fetchall()
+            return [self._job_dict(row) for row in rows]
+
     def get_job(self, job_id):
         """Get a specific job by ID"""
-        with self.lock:
-            if job_id in self.active_jobs:
-                return self.active_jobs[job_id]
-            
-            # Check history
-            for job in self.jobs_history:
-                if job['id'] == job_id:
-                    return job
-            
-            return None
-    
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM processing_jobs WHERE id = ?', (job_id,)).fetchone()
+            return self._job_dict(row) if row else None
+
     def get_job_history(self):
         """Get the job history"""
-        with self.lock:
-            return self.jobs_history.copy()
-    
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'''SELECT * FROM processing_jobs
+                   WHERE status NOT IN ({", ".join("?" * len(ACTIVE_STATUSES))})
+                   ORDER BY end_time DESC LIMIT ?''',
+                ACTIVE_STATUSES + (self.max_history,)
+            ).fetchall()
+            return [self._job_dict(row) for row in rows]
+
     def _monitor_thread(self):
         """Background thread to monitor for stuck jobs"""
         while True:
             try:
-                now = datetime.now()
-                stuck_jobs = []
-                
-                with self.lock:
-                    for job_id, job_info in list(self.active_jobs.items()):
-                        last_update = datetime.strptime(job_info['last_update'], "%Y-%m-%d %H:%M:%S")
-                        elapsed = (now - last_update).total_seconds()
-                        
-                        # Mark as stuck if timeout exceeded
-                        if elapsed > self.timeout_seconds and job_info['status'] == 'running':
-                            job_info['status'] = 'stuck'
-                            stuck_jobs.append(job_info)
-                            logger.warning(f"Job {job_id} appears to be stuck (no updates for {elapsed:.1f} seconds)")
-                
+                cutoff = datetime.fromtimestamp(time.time() - self.timeout_seconds).strftime("%Y-%m-%d %H:%M:%S")
+
+                # Mark as stuck if timeout exceeded (harmless if another process does it too)
+                with self.lock, self._connect() as conn:
+                    stuck_jobs = [
+                        self._job_dict(row) for row in conn.execute(
+                            "SELECT * FROM processing_jobs WHERE status = 'running' AND last_update < ?",
+                            (cutoff,)
+                        ).fetchall()
+                    ]
+                    if stuck_jobs:
+                        conn.execute(
+                            "UPDATE processing_jobs SET status = 'stuck' WHERE status = 'running' AND last_update < ?",
+                            (cutoff,)
+                        )
+
                 # No need to hold the lock while logging
                 for job in stuck_jobs:
+                    logger.warning(f"Job {job['id']} appears to be stuck (no updates since {job['last_update']})")
                     logger.error(f"Stuck job detected: {job['id']} - {job['description']} - Last item: {job['current_item']}")
-                
-                # Save status if there were changes
-                if stuck_jobs:
-                    self._save_status()
-                
+
                 # Check every 30 seconds
                 time.sleep(30)
             except Exception as e:
@@ -184,4 +246,4 @@ class ProcessingMonitor:
                 time.sleep(30)  # Still sleep on error
 
 # Global instance
-processing_monitor = ProcessingMonitor(timeout_seconds=300)
\ No newline at end of file
+processing_monitor = ProcessingMonitor(timeout_seconds=300)
@@ -0,0 +1,193 @@
+import os
+import hashlib
+import logging
+import contextlib
+from datetime import datetime
+import requests
+from m3u_editor import NameOptimizer, is_vod_entry
+from channel_store import channel_store, parse_m3u_playlist
+
+logger = logging.getLogger(__name__)
+
+# Timeouts (connect, read) of upstream playlist downloads, in seconds
+DOWNLOAD_TIMEOUT = (60, 180)
+
+# Bytes written per chunk while downloading an upstream playlist
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Browser-like headers, as some providers block other clients
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.5'
+}
+
+# Operations of the log that are not replayed on new channels
+SKIPPED_OPERATIONS = ('sync',)
+
+def build_recipe(operations):
+    """
+    The transformation recipe of a proxy from its operation log: a function
+    applying its filters and name rules, in order, to a list of channels
+    (returning those kept), and the options of its last renumbering (None
+    if it was never renumbered).
+    """
+    steps = []
+    renumber = None
+    for operation in operations:
+        name, params = operation['operation'], operation['params']
+        if name in SKIPPED_OPERATIONS:
+            continue
+        if name == 'optimize_names':
+            steps.append(_rename_step(NameOptimizer(params.get('options'), params.get('custom_patterns', ()))))
+        elif name == 'filter_vod':
+            keep_vod = not params.get('keep_live_only', True)
+            steps.append(lambda channels, keep_vod=keep_vod: [
+                channel for channel in channels
+                if is_vod_entry(channel['url'], channel['group'], channel['tvg_id']) == keep_vod
+            ])
+        elif name == 'copy_filtered':
+            steps.append(_filter_step(params.get('group'), params.get('name_contains')))
+        elif name == 'renumber':
+            renumber = params
+        else:
+            logger.debug(f"Operation {name} is not replayed on synced channels")
+
+    def apply(channels):
+        for step in steps:
+            channels = step(channels)
+        return channels
+
+    return apply, renumber
+
+def _rename_step(optimizer):
+    def rename(channels):
+        for channel in channels:
+            # The tvg-name attribute is always written with the channel name
+            channel['name'] = channel['tvg_name'] = optimizer(channel['name'])
+        return channels
+    return rename
+
+def _filter_step(group, name_contains):
+    needle = (name_contains or '').lower()
+    return lambda channels: [
+        channel for channel in channels
+        if (not group or channel['group'] == group) and needle in channel['name'].lower()
+    ]
+
+class ProxySync:
+    """
+    Keeps proxies created from a URL in step with their upstream playlist.
+
+    A sync downloads the upstream playlist with the validators of the last
+    download (If-None-Match / If-Modified-Since), so an unchanged playlist
+    costs a 304. A changed one is diffed against the proxy's channels by
+    channel_store.sync_channels, and only new or changed channels go
+    through the proxy's recipe, rebuilt from its operation log. The rendered
+    playlist is then updated in place. Sync settings and state live in the
+    proxy's metadata.json under 'sync'.
+    """
+
+    def __init__(self, proxy_manager):
+        self.proxy_manager = proxy_manager
+
+    def settings(self, proxy_id):
+        """The proxy's sync settings and state ({} if it was never synced)"""
+        metadata = self.proxy_manager.get_metadata(proxy_id) or {}
+        return metadata.get('sync') or {}
+
+    def configure(self, proxy_id, enabled, hours=24):
+        """Turn syncing of a proxy on or off; returns its settings, or None if the proxy doesn't exist"""
+        metadata = self.proxy_manager.get_metadata(proxy_id)
+        if metadata is None:
+            return None
+        sync = dict(metadata.get('sync') or {}, enabled=bool(enabled), hours=hours)
+        self.proxy_manager.update_metadata(proxy_id, sync=sync)
+        return sync
+
+    def synced_proxies(self):
+        """(proxy ID, upstream URL, hours) of every proxy with syncing on"""
+        return [
+            (metadata['id'], metadata['original_url'], metadata['sync'].get('hours', 24))
+            for metadata in self.proxy_manager.get_all_m3us()
+            if (metadata.get('sync') or {}).get('enabled') and metadata.get('original_url')
+        ]
+
+    def sync(self, proxy_id, host_slot=None):
+        """
+        Sync a proxy with its upstream playlist. host_slot(url), if given,
+        is held while downloading. Returns a result dict.
+        """
+        metadata = self.proxy_manager.get_metadata(proxy_id)
+        if metadata is None:
+            return {'status': 'error', 'message': 'M3U not found'}
+        url = metadata.get('original_url')
+        if not url:
+            return {'status': 'error', 'message': 'Proxy was not created from a URL'}
+        state = dict(metadata.get('sync') or {})
+
+        download_path = os.path.join(self.proxy_manager.storage_dir, proxy_id, f"upstream.{os.getpid()}.tmp")
+        try:
+            with (host_slot(url) if host_slot else contextlib.nullcontext()):
+                download = self._download(url, download_path, state)
+            state['last_sync'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            if download is None or download['hash'] == state.get('upstream_hash'):
+                logger.info(f"Upstream playlist of proxy {proxy_id} is unchanged")
+                result = {'status': 'success', 'message': 'Upstream playlist unchanged', 'changed': 0}
+            else:
+                headers, channels = parse_m3u_playlist(download_path)
+                prepare, renumber = build_recipe(channel_store.operations(proxy_id))
+                edit = channel_store.sync_channels(proxy_id, headers, channels, prepare, renumber)
+                if edit is None:
+                    return {'status': 'error', 'message': 'M3U not found'}
+                state['upstream_hash'] = download['hash']
+                logger.info(f"Synced proxy {proxy_id}: {edit['added']} added, {edit['updated']} updated, {edit['removed']} removed")
+                result = dict(edit, status='success', message='Proxy synced with its upstream playlist')
+                if edit['changed']:
+                    self.proxy_manager.update_metadata(proxy_id, channel_count=edit['channel_count'])
+                    # Render now, so players polling the proxy get the new playlist straight away
+                    self.proxy_manager.get_rendered(proxy_id)
+
+            if download is not None:
+                state['etag'] = download['etag']
+                state['last_modified'] = download['last_modified']
+            state['last_result'] = result['message']
+            self.proxy_manager.update_metadata(proxy_id, sync=state)
+            return result
+        except (requests.RequestException, OSError) as e:
+            logger.error(f"Error syncing proxy {proxy_id}: {str(e)}")
+            state['last_result'] = f"Error: {str(e)}"
+            self.proxy_manager.update_metadata(proxy_id, sync=state)
+            return {'status': 'error', 'message': f'Error syncing proxy: {str(e)}'}
+        finally:
+            if os.path.exists(download_path):
+                os.remove(download_path)
+
+    @staticmethod
+    def _download(url, path, state):
+        """
+        Download url to path unless it is unchanged since the validators in
+        state; returns None for 304 Not Modified, else the new validators
+        and the SHA-256 of the body.
+        """
+        headers = dict(DOWNLOAD_HEADERS)
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+
+        with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            digest = hashlib.sha256()
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+            return {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'hash': digest.hexdigest()
+            }
@@ -0,0 +1,371 @@
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+import contextlib
+import concurrent.futures
+from datetime import datetime
+from urllib.parse import urlparse
+import db
+from job_queue import JobQueue, JobCheckpoint, worker_name, STATUS_QUEUED, STATUS_RUNNING, STATUS_COMPLETED, STATUS_ERROR
+
+logger = logging.getLogger(__name__)
+
+# Link states stored in m3u_links.refresh_state
+STATE_IDLE = 'idle'
+STATE_QUEUED = 'queued'
+STATE_RUNNING = 'running'
+STATE_ERROR = 'error'
+
+# Priority given to manual "check now" requests so they jump the queue
+MANUAL_PRIORITY = 1000
+
+# How long a manual request waits for its job, and how often it checks the job's row meanwhile
+MANUAL_WAIT_SECONDS = 300
+JOB_POLL_SECONDS = 2
+
+class JobFuture(concurrent.futures.Future):
+    """Future for the result of a queued job; job_id names its refresh_jobs row"""
+
+    def __init__(self, job_id=None):
+        super().__init__()
+        self.job_id = job_id
+
+class RefreshScheduler:
+    """
+    Runs scheduled M3U refreshes, imports and proxy syncs as jobs from the
+    persistent job_queue.JobQueue instead of letting every APScheduler
+    interval job download and process at once.
+
+    Interval jobs only enqueue their link. A fixed number of worker threads
+    (the global concurrency cap) claim jobs from the queue, highest
+    priority first, and renew their lease while a job runs. Downloads to
+    the same host are limited by a per-host semaphore (see host_slot).
+    Interval triggers get random jitter so links added together drift
+    apart. Jobs interrupted by a restart are claimed again once their
+    lease expires and resume from their last checkpoint.
+
+    When several worker processes share the database, pass a
+    coordination.LeaderLease: every process runs workers, but only the
+    leader turns interval triggers into jobs.
+    """
+
+    def __init__(self, scheduler, run_func, max_concurrent=2, per_host_limit=1, jitter_minutes=15,
+                 lease_seconds=300, poll_seconds=15, leader=None):
+        """run_func(job, checkpoint) performs one job and returns its result dict"""
+        self.scheduler = scheduler
+        self.run_func = run_func
+        self.leader = leader
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_host_limit = max(1, per_host_limit)
+        self.jitter_minutes = max(0, jitter_minutes)
+        self.poll_seconds = poll_seconds
+
+        self.job_queue = JobQueue(lease_seconds=lease_seconds)
+        self.futures = {}
+        self.running = 0
+        self.host_slots = {}
+        self.state = threading.Condition()
+        self.workers = []
+
+    @classmethod
+    def from_config(cls, scheduler, run_func, config=None, leader=None):
+        """Create a RefreshScheduler using the refresh_* config values"""
+        config = config or db.load_config()
+        return cls(
+            scheduler,
+            run_func,
+            leader=leader,
+            max_concurrent=config.get("refresh_max_concurrent", 2),
+            per_host_limit=config.get("refresh_per_host_limit", 1),
+            jitter_minutes=config.get("refresh_jitter_minutes", 15),
+            lease_seconds=config.get("job_lease_seconds", 300)
+        )
+
+    @staticmethod
+    def job_id(url):
+        """APScheduler job id for a link"""
+        return f"m3u_refresh:{url}"
+
+    def start(self):
+        """Start the workers, which also pick up jobs left over from a previous run"""
+        pruned = self.job_queue.prune()
+        if pruned:
+            logger.info(f"Removed {pruned} finished jobs from the job queue")
+        with self.state:
+            self._start_workers()
+            self.state.notify_all()
+
+    def schedule(self, url, hours=24):
+        """Create or replace the interval job that enqueues url every `hours` hours"""
+        job = self.scheduler.add_job(
+            self._scheduled,
+            'interval',
+            hours=hours,
+            jitter=self.jitter_minutes * 60 or None,
+            args=[url],
+            id=self.job_id(url),
+            replace_existing=True
+        )
+        self._update_next_check(url, job)
+        return job
+
+    def unschedule(self, url):
+        """Remove the interval job for url, if there is one"""
+        if self.scheduler.get_job(self.job_id(url)):
+            self.scheduler.remove_job(self.job_id(url))
+
+    @staticmethod
+    def proxy_sync_job_id(proxy_id):
+        """APScheduler job id for a proxy's sync"""
+        return f"proxy_sync:{proxy_id}"
+
+    def schedule_proxy_sync(self, proxy_id, url, hours=24):
+        """Create or replace the interval job that queues a sync of the proxy every `hours` hours"""
+        return self.scheduler.add_job(
+            self._scheduled_proxy_sync,
+            'interval',
+            hours=hours,
+            jitter=self.jitter_minutes * 60 or None,
+            args=[proxy_id, url],
+            id=self.proxy_sync_job_id(proxy_id),
+            replace_existing=True
+        )
+
+    def unschedule_proxy_sync(self, proxy_id):
+        """Remove the interval job syncing the proxy, if there is one"""
+        if self.scheduler.get_job(self.proxy_sync_job_id(proxy_id)):
+            self.scheduler.remove_job(self.proxy_sync_job_id(proxy_id))
+
+    def _scheduled_proxy_sync(self, proxy_id, url):
+        """Interval trigger: queue a proxy sync if this process is the scheduler leader"""
+        if self.leader is not None and not self.leader.is_leader:
+            return
+        self.enqueue_proxy_sync(proxy_id, url)
+
+    def enqueue_proxy_sync(self, proxy_id, url, priority=0):
+        """Queue a sync of a proxy with its upstream url and return a Future for its result"""
+        job_id = self.job_queue.enqueue(str(uuid.uuid4()), 'proxy_sync', proxy_id, url=url, priority=priority)
+        return self._submitted(job_id, proxy_id, priority)
+
+    def _scheduled(self, url):
+        """Interval trigger: queue a refresh if this process is the scheduler leader"""
+        if self.leader is not None and not self.leader.is_leader:
+            logger.debug(f"Not the scheduler leader, leaving the refresh of {url} to the leader")
+            return
+        self.enqueue(url)
+
+    def enqueue(self, url, priority=None):
+        """
+        Queue a refresh of a saved link and return a Future for its result.
+        A link that is already queued or running is not queued twice.
+        """
+        link = _find_link(url)
+        if not link:
+            logger.info(f"Not queueing refresh of removed link {url}")
+            future = JobFuture()
+            future.set_result({'status': 'error', 'message': f'Link not found: {url}'})
+            return future
+        if priority is None:
+            priority = link.get('priority') or 0
+
+        new_job_id = str(uuid.uuid4())
+        job_id = self.job_queue.enqueue(
+            new_job_id, 'refresh', link['filename'],
+            url=url, output_path=link.get('output_path'), priority=priority
+        )
+        if job_id == new_job_id:
+            db.update_m3u_link_state(url, STATE_QUEUED)
+        return self._submitted(job_id, url, priority)
+
+    def enqueue_import(self, job_id, filename, url=None, output_path=None, priority=0):
+        """Queue processing of a playlist already on disk and return a Future for its result"""
+        self.job_queue.enqueue(job_id, 'import', filename, url=url, output_path=output_path, priority=priority)
+        return self._submitted(job_id, filename, priority)
+
+    def _submitted(self, job_id, name, priority):
+        """Wake a worker for a queued job and return the Future its result is delivered to"""
+        with self.state:
+            future = self.futures.get(job_id)
+            if future is None:
+                future = JobFuture(job_id)
+                self.futures[job_id] = future
+            self._start_workers()
+            self.state.notify()
+        logger.info(f"Queued job {job_id} for {name} (priority {priority})")
+        return future
+
+    def run_now(self, url, timeout=MANUAL_WAIT_SECONDS):
+        """Queue url ahead of scheduled refreshes and wait up to timeout seconds for its result"""
+        return self.wait(self.enqueue(url, priority=MANUAL_PRIORITY), timeout)
+
+    def wait(self, future, timeout=MANUAL_WAIT_SECONDS):
+        """
+        Wait up to timeout seconds for the result of a queued job. A worker
+        of another process may run the job, so its row is checked as well;
+        a job still unfinished at the timeout gives a 'queued' or 'running'
+        result carrying its job_id.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return future.result(timeout=max(0, min(JOB_POLL_SECONDS, deadline - time.monotonic())))
+            except concurrent.futures.TimeoutError:
+                pass
+
+            job = self.job_queue.get_job(future.job_id)
+            if job is None or job['status'] in (STATUS_COMPLETED, STATUS_ERROR):
+                # Finished elsewhere; a local worker that ran it has taken the future out already
+                with self.state:
+                    pending = self.futures.pop(future.job_id, None)
+                if pending is not None:
+                    pending.set_result(_job_result(future.job_id, job))
+                return future.result()
+            if time.monotonic() >= deadline:
+                return {
+                    'status': job['status'],
+                    'job_id': future.job_id,
+                    'message': f"Job {future.job_id} is still {job['status']}"
+                }
+
+    @contextlib.contextmanager
+    def host_slot(self, url):
+        """Hold one of the per-host download slots for url's host"""
+        host = urlparse(url).hostname or ''
+        with self.state:
+            slot = self.host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host_limit)
+                self.host_slots[host] = slot
+        with slot:
+            yield
+
+    def get_status(self):
+        """Return queue and worker counts for the status API"""
+        counts = self.job_queue.get_counts()
+        with self.state:
+            return {
+                "queued": counts.get(STATUS_QUEUED, 0),
+                "running": self.running,
+                "running_anywhere": counts.get(STATUS_RUNNING, 0),
+                "max_concurrent": self.max_concurrent,
+                "per_host_limit": self.per_host_limit,
+                "scheduler_leader": self.leader.is_leader if self.leader is not None else True
+            }
+
+    def _start_workers(self):
+        """Start the worker threads on first use (caller holds self.state)"""
+        while len(self.workers) < self.max_concurrent:
+            worker = threading.Thread(
+                target=self._work,
+                name=f"m3u-refresh-{len(self.workers) + 1}",
+                daemon=True
+            )
+            self.workers.append(worker)
+            worker.start()
+
+    def _work(self):
+        """Worker loop: claim jobs from the queue and run them one at a time"""
+        owner = worker_name()
+        while True:
+            try:
+                job = self.job_queue.claim(owner)
+            except sqlite3.Error as e:
+                logger.error(f"Error claiming refresh job: {str(e)}")
+                job = None
+
+            if job is None:
+                # Also wakes up periodically for expired leases and other processes' jobs
+                with self.state:
+                    self.state.wait(timeout=self.poll_seconds)
+                continue
+
+            with self.state:
+                self.running += 1
+            try:
+                result = self._run(job)
+            except Exception as e:
+                logger.error(f"Error running job {job['job_id']}: {str(e)}")
+                result = {'status': 'error', 'message': str(e)}
+            finally:
+                with self.state:
+                    self.running -= 1
+
+            status = STATUS_COMPLETED if result.get('status') == 'success' else STATUS_ERROR
+            self.job_queue.complete(job['job_id'], owner, status=status, error=result.get('message') if status == STATUS_ERROR else None)
+
+            with self.state:
+                future = self.futures.pop(job['job_id'], None)
+            if future is not None:
+                future.set_result(result)
+
+    def _run(self, job):
+        """Run one claimed job while a heartbeat thread keeps its lease alive"""
+        url = job['url']
+        if job['kind'] == 'refresh':
+            if not _find_link(url):
+                logger.info(f"Skipping refresh of removed link {url}")
+                return {'status': 'error', 'message': f'Link not found: {url}'}
+            db.update_m3u_link_state(url, STATE_RUNNING)
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat,
+            args=(job['job_id'], job['lease_owner'], stop),
+            name=f"heartbeat-{job['job_id'][:8]}",
+            daemon=True
+        )
+        heartbeat.start()
+
+        started = datetime.now()
+        checkpoint = JobCheckpoint(self.job_queue, job)
+        try:
+            result = self.run_func(job, checkpoint)
+        except Exception as e:
+            if job['kind'] == 'refresh':
+                db.update_m3u_link_state(url, STATE_ERROR, error=str(e))
+            raise
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        if job['kind'] == 'refresh':
+            if result.get('status') == 'success':
+                db.update_m3u_link_state(url, STATE_IDLE)
+            else:
+                db.update_m3u_link_state(url, STATE_ERROR, error=result.get('message'))
+            self._update_next_check(url, self.scheduler.get_job(self.job_id(url)))
+        logger.info(f"Job {job['job_id']} ({job['kind']}) finished in {(datetime.now() - started).total_seconds():.1f}s")
+        return result
+
+    def _heartbeat(self, job_id, owner, stop):
+        """Renew a job's lease until stop is set"""
+        interval = max(1, self.job_queue.lease_seconds / 3)
+        while not stop.wait(interval):
+            try:
+                if not self.job_queue.heartbeat(job_id, owner):
+                    logger.warning(f"Lost the lease on job {job_id}")
+            except sqlite3.Error as e:
+                logger.error(f"Error renewing lease on job {job_id}: {str(e)}")
+
+    def _update_next_check(self, url, job):
+        """Store the job's next run time in m3u_links.next_check"""
+        next_run = getattr(job, 'next_run_time', None) if job else None
+        if next_run:
+            db.update_m3u_link_next_check(url, next_run.strftime("%Y-%m-%d %H:%M:%S"))
+
+def _job_result(job_id, job):
+    """Result of a job run by another process, from its refresh_jobs row (None if it was pruned)"""
+    if job is None:
+        return {'status': 'error', 'message': f'Job {job_id} no longer exists'}
+    if job['status'] == STATUS_COMPLETED:
+        return {'status': 'success', 'message': f'Job {job_id} was completed by another worker process'}
+    return {'status': 'error', 'message': job['error'] or f'Job {job_id} failed'}
+
+def _find_link(url):
+    """Return the saved m3u_links row for url, or None"""
+    for link in db.load_m3u_links():
+        if link['url'] == url:
+            return link
+    return None
@@ -0,0 +1,99 @@
+import logging
+import threading
+from flask import Blueprint, request, jsonify
+from search_index import search_index, KINDS
+from content_comparison import get_content_registry
+from channel_store import channel_store
+
+logger = logging.getLogger(__name__)
+
+# Largest page the search API returns
+MAX_PAGE_SIZE = 100
+
+# Create blueprint
+search_api = Blueprint('search_api', __name__)
+
+@search_api.route('/api/search', methods=['GET'])
+def search():
+    """
+    API endpoint to search movies, episodes, providers and proxy channels.
+
+    Every word of q matches as a prefix; results are ranked best first.
+    kind is a comma-separated list of document kinds, proxy_id limits
+    channel results to one proxy.
+    """
+    try:
+        query = request.args.get('q', '').strip()
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('pageSize', 20)), 1), MAX_PAGE_SIZE)
+        kinds = [kind for kind in request.args.get('kind', '').split(',') if kind]
+        proxy_id = request.args.get('proxy_id') or None
+
+        unknown = [kind for kind in kinds if kind not in KINDS]
+        if unknown:
+            return jsonify({
+                'status': 'error',
+                'message': f'Unknown kind: {", ".join(unknown)}'
+            }), 400
+
+        total, results = search_index.search(
+            query, kinds=kinds, scope=proxy_id,
+            limit=page_size, offset=(page - 1) * page_size
+        )
+
+        return jsonify({
+            'status': 'success',
+            'query': query,
+            'results': results,
+            'total': total,
+            'page': page,
+            'pageSize': page_size,
+            'totalPages': (total + page_size - 1) // page_size
+        })
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'page and pageSize must be numbers'
+        }), 400
+    except Exception as e:
+        logger.error(f"Error searching: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Search failed: {str(e)}'
+        }), 500
+
+@search_api.route('/api/search/rebuild', methods=['POST'])
+def rebuild_search_index():
+    """API endpoint to rebuild the whole search index in the background"""
+    threading.Thread(target=_rebuild, daemon=True).start()
+    return jsonify({
+        'status': 'success',
+        'message': 'Search index rebuild started'
+    })
+
+@search_api.route('/api/search/stats', methods=['GET'])
+def search_index_stats():
+    """API endpoint to get the number of indexed documents per kind"""
+    return jsonify({
+        'status': 'success',
+        'enabled': search_index.enabled,
+        'counts': search_index.get_counts()
+    })
+
+def _rebuild(only_if_empty=False):
+    try:
+        registry = get_content_registry()
+        with registry.lock:
+            if not only_if_empty or search_index.needs_rebuild(registry.registry):
+                search_index.rebuild(registry.registry)
+        channel_store.reindex_search(only_missing=only_if_empty)
+    except Exception as e:
+        logger.error(f"Error rebuilding search index: {str(e)}")
+
+def start_search_index_build():
+    """Build the search index in the background on first start"""
+    threading.Thread(target=_rebuild, kwargs={'only_if_empty': True}, daemon=True).start()
+
+# Register the blueprint
+def register_search_api(app):
+    app.register_blueprint(search_api)
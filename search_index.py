@@ -0,0 +1,309 @@
+import re
+import json
+import logging
+import sqlite3
+import threading
+import db
+
+logger = logging.getLogger(__name__)
+
+# Kinds of documents in the index
+KINDS = ('movie', 'episode', 'provider', 'channel')
+
+# Registry section holding each kind of content document
+SECTION_KINDS = {
+    'movies': 'movie',
+    'tv_shows': 'episode'
+}
+
+# Words of a search query; each becomes a prefix term
+QUERY_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# bm25 weights of the indexed columns (title, subtitle)
+RANK_WEIGHTS = (10.0, 1.0)
+
+class SearchIndex:
+    """
+    Full-text index over registry titles (movies and episodes), provider
+    names and proxy channel names.
+
+    Documents live in the search_documents table, keyed by (kind, ref);
+    search_fts is an external-content FTS5 index over their title and
+    subtitle kept in sync by triggers, so write paths only upsert or
+    delete document rows. ContentRegistry pushes the items it changed each
+    time it writes the registry, and the channel store replaces a proxy's
+    channel documents whenever it re-indexes the proxy.
+    """
+
+    def __init__(self, db_file=db.DB_FILE):
+        """Create the index tables if needed"""
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.enabled = True
+
+        try:
+            with self._connect() as conn:
+                self._create_tables(conn)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 unavailable, search is disabled: {str(e)}")
+            self.enabled = False
+
+    def _connect(self):
+        """Open a connection that waits for other writers instead of failing"""
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _create_tables(conn):
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS search_documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            ref TEXT NOT NULL,
+            scope TEXT,
+            title TEXT NOT NULL,
+            subtitle TEXT,
+            payload TEXT,
+            UNIQUE(kind, ref)
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_search_documents_scope ON search_documents (kind, scope)')
+        conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+            title, subtitle,
+            content='search_documents', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''')
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+            INSERT INTO search_fts (rowid, title, subtitle) VALUES (new.id, new.title, new.subtitle);
+        END
+        ''')
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+            INSERT INTO search_fts (search_fts, rowid, title, subtitle) VALUES ('delete', old.id, old.title, old.subtitle);
+        END
+        ''')
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN
+            INSERT INTO search_fts (search_fts, rowid, title, subtitle) VALUES ('delete', old.id, old.title, old.subtitle);
+            INSERT INTO search_fts (rowid, title, subtitle) VALUES (new.id, new.title, new.subtitle);
+        END
+        ''')
+
+    @staticmethod
+    def _upsert(conn, documents):
+        """Insert or update (kind, ref, scope, title, subtitle, payload) documents"""
+        conn.executemany(
+            '''INSERT INTO search_documents (kind, ref, scope, title, subtitle, payload)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(kind, ref) DO UPDATE SET
+                   scope = excluded.scope, title = excluded.title,
+                   subtitle = excluded.subtitle, payload = excluded.payload
+               WHERE title IS NOT excluded.title OR subtitle IS NOT excluded.subtitle
+                   OR payload IS NOT excluded.payload OR scope IS NOT excluded.scope''',
+            documents
+        )
+
+    # Documents
+
+    @staticmethod
+    def content_document(section, content_hash, item):
+        """Search document for a registry movie or episode"""
+        if section == 'movies':
+            subtitle = str(item.get('year') or '')
+            payload = {'year': item.get('year')}
+        else:
+            subtitle = f"S{item.get('season')}E{item.get('episode')}" if item.get('season') and item.get('episode') else ''
+            payload = {'season': item.get('season'), 'episode': item.get('episode')}
+        payload.update(resolution=item.get('resolution'), filepath=item.get('filepath'))
+        return (SECTION_KINDS[section], content_hash, None, item.get('title') or '', subtitle, json.dumps(payload))
+
+    @staticmethod
+    def provider_document(provider_id, provider):
+        """Search document for a provider"""
+        payload = {'url': provider.get('url'), 'content_count': provider.get('content_count', 0)}
+        return ('provider', provider_id, None, provider.get('name') or '', '', json.dumps(payload))
+
+    # Write paths
+
+    def index_registry_changes(self, registry, changes):
+        """Upsert the documents of changed registry items and providers ({section: set of keys})"""
+        if not self.enabled:
+            return
+        documents = []
+        for section in SECTION_KINDS:
+            items = registry.get(section, {})
+            documents.extend(
+                self.content_document(section, content_hash, items[content_hash])
+                for content_hash in changes.get(section, ()) if content_hash in items
+            )
+        providers = registry.get('providers', {})
+        documents.extend(
+            self.provider_document(provider_id, providers[provider_id])
+            for provider_id in changes.get('providers', ()) if provider_id in providers
+        )
+        if not documents:
+            return
+        with self.lock, self._connect() as conn:
+            self._upsert(conn, documents)
+
+    def rename_provider(self, provider_id, name):
+        """Update a provider's document after it was renamed"""
+        if not self.enabled:
+            return
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE search_documents SET title = ? WHERE kind = 'provider' AND ref = ?",
+                (name, provider_id)
+            )
+
+    def replace_channels(self, conn, proxy_id):
+        """Replace a proxy's channel documents from its proxy_channels rows (in the caller's transaction)"""
+        if not self.enabled:
+            return
+        self.drop_channels(conn, proxy_id)
+        conn.execute(
+            '''INSERT INTO search_documents (kind, ref, scope, title, subtitle, payload)
+               SELECT 'channel', proxy_id || ':' || channel_id, proxy_id, name, group_title,
+                      json_object('tvg_id', tvg_id, 'tvg_logo', tvg_logo)
+               FROM proxy_channels WHERE proxy_id = ?
+               ORDER BY position''',
+            (proxy_id,)
+        )
+
+    def apply_channel_edits(self, conn, pending_table, proxy_id):
+        """
+        Delete the proxy's channel documents listed in pending_table (id,
+        ref, name; name NULL for removed channels) and write the others from
+        their proxy_channels rows, in the caller's transaction
+        """
+        if not self.enabled:
+            return
+        conn.execute(
+            f'''DELETE FROM search_documents
+               WHERE kind = 'channel' AND ref IN (SELECT ref FROM {pending_table} WHERE proxy_id = ? AND name IS NULL)''',
+            (proxy_id,)
+        )
+        conn.execute(
+            f'''INSERT INTO search_documents (kind, ref, scope, title, subtitle, payload)
+               SELECT 'channel', p.ref, pc.proxy_id, pc.name, pc.group_title,
+                      json_object('tvg_id', pc.tvg_id, 'tvg_logo', pc.tvg_logo)
+               FROM {pending_table} p JOIN proxy_channels pc ON pc.id = p.id
+               WHERE p.proxy_id = ? AND p.name IS NOT NULL
+               ON CONFLICT(kind, ref) DO UPDATE SET
+                   title = excluded.title, subtitle = excluded.subtitle, payload = excluded.payload''',
+            (proxy_id,)
+        )
+
+    def drop_channels(self, conn, proxy_id):
+        """Delete a proxy's channel documents (in the caller's transaction)"""
+        if not self.enabled:
+            return
+        conn.execute("DELETE FROM search_documents WHERE kind = 'channel' AND scope = ?", (proxy_id,))
+
+    def rebuild(self, registry):
+        """Replace the documents of every registry item and provider (channels are rebuilt by the channel store)"""
+        if not self.enabled:
+            return
+        documents = []
+        for section in SECTION_KINDS:
+            documents.extend(
+                self.content_document(section, content_hash, item)
+                for content_hash, item in registry.get(section, {}).items()
+            )
+        documents.extend(
+            self.provider_document(provider_id, provider)
+            for provider_id, provider in registry.get('providers', {}).items()
+        )
+        with self.lock, self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("DELETE FROM search_documents WHERE kind != 'channel'")
+            self._upsert(conn, documents)
+            conn.commit()
+        logger.info(f"Indexed {len(documents)} registry documents for search")
+
+    def needs_rebuild(self, registry):
+        """True on first start, when the registry has content but the index has none"""
+        if not self.enabled or not any(registry.get(section) for section in SECTION_KINDS):
+            return False
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM search_documents WHERE kind != 'channel' LIMIT 1").fetchone() is None
+
+    # Queries
+
+    @staticmethod
+    def match_expression(query):
+        """
+        FTS5 query matching every word of query as a prefix, or None if it
+        has no words. Each word is also matched whole, so exact words rank
+        above longer words they are a prefix of.
+        """
+        tokens = QUERY_TOKEN_PATTERN.findall(query or '')
+        if not tokens:
+            return None
+        return ' AND '.join(f'("{token}" OR "{token}"*)' for token in tokens)
+
+    def search(self, query, kinds=None, scope=None, limit=20, offset=0):
+        """
+        Best matches first (bm25, titles weighted over subtitles), as
+        (total, results). kinds limits the document kinds and scope the
+        proxy of channel documents.
+        """
+        match = self.match_expression(query)
+        if not self.enabled or match is None:
+            return 0, []
+
+        clauses = ['search_fts MATCH ?']
+        params = [match]
+        if kinds:
+            clauses.append(f'd.kind IN ({", ".join("?" * len(kinds))})')
+            params.extend(kinds)
+        if scope:
+            clauses.append('d.scope = ?')
+            params.append(scope)
+        where = ' AND '.join(clauses)
+
+        with self._connect() as conn:
+            total = conn.execute(
+                f'SELECT COUNT(*) FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid WHERE {where}',
+                params
+            ).fetchone()[0]
+            rows = conn.execute(
+                f'''SELECT d.kind, d.ref, d.scope, d.title, d.subtitle, d.payload,
+                           bm25(search_fts, {RANK_WEIGHTS[0]}, {RANK_WEIGHTS[1]}) AS score
+                    FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid
+                    WHERE {where}
+                    ORDER BY score, d.id
+                    LIMIT ? OFFSET ?''',
+                params + [limit, offset]
+            ).fetchall()
+
+        results = []
+        for row in rows:
+            result = {
+                'kind': row['kind'],
+                'id': row['ref'],
+                'title': row['title'],
+                'subtitle': row['subtitle'],
+                'score': round(-row['score'], 4)
+            }
+            if row['scope']:
+                result['proxy_id'] = row['scope']
+            if row['payload']:
+                result.update(json.loads(row['payload']))
+            results.append(result)
+        return total, results
+
+    def get_counts(self):
+        """Number of indexed documents per kind"""
+        if not self.enabled:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute('SELECT kind, COUNT(*) AS count FROM search_documents GROUP BY kind').fetchall()
+            return {row['kind']: row['count'] for row in rows}
+
+# Global instance
+search_index = SearchIndex()
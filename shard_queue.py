@@ -0,0 +1,470 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import argparse
+import collections
+from datetime import datetime
+import db
+from content_comparison import ContentRegistry, get_content_registry
+from coordination import registry_lock, process_name
+from m3u_reader import M3UReader
+from pipeline import StreamPipeline, PipelineStats
+from processing_monitor import processing_monitor
+import tools
+
+logger = logging.getLogger(__name__)
+
+# Registry sections holding content items
+CONTENT_SECTIONS = ('movies', 'tv_shows')
+
+# Spool subdirectories: a shard file moves pending -> claimed, and its result appears in done
+SPOOL_DIRS = ('jobs', 'pending', 'claimed', 'done')
+
+def _write_json(path, data):
+    """Write a JSON file atomically, so readers in other processes never see half of it"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+class ShardSpool:
+    """
+    Shared directory through which a coordinator hands playlist shards to
+    worker processes, possibly on other hosts mounting the same directory.
+
+    jobs/<job_id>/ holds a copy of the playlist and the registry snapshot the
+    shards start from. A shard descriptor is written to pending/, claimed by
+    atomically renaming it into claimed/ (only one rename can succeed), and
+    its result is written to done/. Workers touch their claimed file while
+    they run, so a shard whose worker died can be put back in pending/.
+    """
+
+    def __init__(self, path):
+        """Use (and create) the spool directory at path"""
+        self.path = path
+        for name in SPOOL_DIRS:
+            os.makedirs(os.path.join(path, name), exist_ok=True)
+
+    def dir(self, name):
+        return os.path.join(self.path, name)
+
+    def job_dir(self, job_id):
+        return os.path.join(self.path, 'jobs', job_id)
+
+    @staticmethod
+    def shard_name(job_id, shard):
+        return f"{job_id}.{shard:05d}.json"
+
+    def job_shards(self, name, job_id):
+        """Shard file names of job_id in one of the spool directories"""
+        prefix = f"{job_id}."
+        return sorted(
+            entry for entry in os.listdir(self.dir(name))
+            if entry.startswith(prefix) and entry.endswith('.json')
+        )
+
+    def add(self, descriptor):
+        """Queue a shard descriptor"""
+        name = self.shard_name(descriptor['job_id'], descriptor['shard'])
+        _write_json(os.path.join(self.dir('pending'), name), descriptor)
+
+    def claim(self, job_id=None):
+        """Take a pending shard (of job_id, or of any job) and return (name, descriptor), or None"""
+        names = self.job_shards('pending', job_id) if job_id else sorted(
+            entry for entry in os.listdir(self.dir('pending')) if entry.endswith('.json')
+        )
+        for name in names:
+            claimed = os.path.join(self.dir('claimed'), name)
+            try:
+                os.rename(os.path.join(self.dir('pending'), name), claimed)
+            except FileNotFoundError:
+                # Another worker renamed it first
+                continue
+            os.utime(claimed)
+            return name, _read_json(claimed)
+        return None
+
+    def touch(self, name):
+        """Mark a claimed shard as still being worked on"""
+        try:
+            os.utime(os.path.join(self.dir('claimed'), name))
+        except FileNotFoundError:
+            pass
+
+    def finish(self, name, result):
+        """Publish a shard's result and drop the claim"""
+        _write_json(os.path.join(self.dir('done'), name), result)
+        try:
+            os.remove(os.path.join(self.dir('claimed'), name))
+        except FileNotFoundError:
+            pass
+
+    def requeue_stale(self, job_id, lease_seconds):
+        """Put back claimed shards whose worker stopped touching them; returns how many"""
+        requeued = 0
+        cutoff = time.time() - lease_seconds
+        for name in self.job_shards('claimed', job_id):
+            claimed = os.path.join(self.dir('claimed'), name)
+            try:
+                if os.stat(claimed).st_mtime >= cutoff:
+                    continue
+                os.rename(claimed, os.path.join(self.dir('pending'), name))
+            except FileNotFoundError:
+                continue
+            logger.warning(f"Shard {name} was not touched for {lease_seconds}s, queueing it again")
+            requeued += 1
+        return requeued
+
+    def remove_job(self, job_id):
+        """Delete every file belonging to job_id"""
+        for name in ('pending', 'claimed', 'done'):
+            for entry in self.job_shards(name, job_id):
+                try:
+                    os.remove(os.path.join(self.dir(name), entry))
+                except FileNotFoundError:
+                    pass
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+class ShardRegistry(ContentRegistry):
+    """
+    Private registry a worker processes one shard against. Besides the
+    usual bookkeeping it remembers every STRM write the shard made, as
+    [section, content_hash, filepath, url, resolution], so the coordinator
+    can replay them. Writes to one path always come from one title, hence
+    one commit lane, so they are listed in playlist order.
+    """
+
+    def __init__(self, registry_path):
+        super().__init__(registry_path=registry_path, index_search=False)
+        self.writes = []
+
+    def _remember_write(self, content_type, title, filepath, url, year, season, episode, resolution):
+        section = 'movies' if content_type == 'movie' else 'tv_shows'
+        content_hash = self.generate_content_hash(title, year, season, episode)
+        with self.lock:
+            self.writes.append([section, content_hash, filepath, url, resolution])
+
+    def register_content(self, content_type, title, url, filepath, provider_url, year=None, season=None, episode=None, resolution=None):
+        self._remember_write(content_type, title, filepath, url, year, season, episode, resolution)
+        return super().register_content(content_type, title, url, filepath, provider_url, year, season, episode, resolution)
+
+    def update_content(self, content_type, title, url, filepath, provider_url, year=None, season=None, episode=None, resolution=None):
+        self._remember_write(content_type, title, filepath, url, year, season, episode, resolution)
+        return super().update_content(content_type, title, url, filepath, provider_url, year, season, episode, resolution)
+
+def registry_delta(snapshot, registry):
+    """
+    Changes a shard made to its registry copy: new items in full, changed
+    items with only the provider entries that differ, and changed providers
+    """
+    delta = {section: {} for section in CONTENT_SECTIONS}
+    for section in CONTENT_SECTIONS:
+        before_items = snapshot.get(section, {})
+        for content_hash, item in registry[section].items():
+            before = before_items.get(content_hash)
+            if before == item:
+                continue
+            if before is not None:
+                item = dict(item)
+                item['providers'] = {
+                    provider_id: provider for provider_id, provider in item['providers'].items()
+                    if before['providers'].get(provider_id) != provider
+                }
+            delta[section][content_hash] = item
+    delta['providers'] = {
+        provider_id: provider for provider_id, provider in registry['providers'].items()
+        if snapshot.get('providers', {}).get(provider_id) != provider
+    }
+    return delta
+
+class ShardWorker:
+    """Claims shards from a ShardSpool and runs the standard pipeline on their entry range"""
+
+    def __init__(self, spool, executor=None, touch_seconds=30):
+        self.spool = spool
+        self.executor = executor
+        self.touch_seconds = touch_seconds
+        self.name = process_name()
+
+    def run_once(self, job_id=None):
+        """Process one pending shard; returns False if there was none"""
+        claimed = self.spool.claim(job_id)
+        if claimed is None:
+            return False
+        name, descriptor = claimed
+        logger.info(f"{self.name} processing shard {name} (entries {descriptor['start']}-{descriptor['end']})")
+
+        stop = threading.Event()
+        toucher = threading.Thread(target=self._touch_loop, args=(name, stop), daemon=True)
+        toucher.start()
+        try:
+            result = self.process(descriptor)
+        except Exception as e:
+            logger.error(f"Error processing shard {name}: {str(e)}")
+            result = dict(descriptor, worker=self.name, error=str(e))
+        finally:
+            stop.set()
+            toucher.join()
+        self.spool.finish(name, result)
+        return True
+
+    def run_forever(self, poll_seconds=5):
+        """Worker mode: keep claiming shards of any job"""
+        logger.info(f"Shard worker {self.name} watching {self.spool.path}")
+        while True:
+            try:
+                if not self.run_once():
+                    time.sleep(poll_seconds)
+            except Exception as e:
+                logger.error(f"Error in shard worker: {str(e)}")
+                time.sleep(poll_seconds)
+
+    def _touch_loop(self, name, stop):
+        while not stop.wait(self.touch_seconds):
+            self.spool.touch(name)
+
+    def process(self, descriptor):
+        """Run the pipeline on the shard's entry range against a private copy of the snapshot"""
+        job_dir = self.spool.job_dir(descriptor['job_id'])
+        snapshot_path = os.path.join(job_dir, 'registry.json')
+        work_dir = tempfile.mkdtemp(prefix='shard-')
+        try:
+            registry_path = os.path.join(work_dir, 'content_registry.json')
+            shutil.copyfile(snapshot_path, registry_path)
+            registry = ShardRegistry(registry_path)
+
+            pipeline = StreamPipeline(
+                os.path.join(job_dir, 'playlist.m3u'),
+                provider_url=descriptor['provider_url'],
+                executor=self.executor,
+                entry_range=(descriptor['start'], descriptor['end']),
+                registry=registry
+            )
+            stats = pipeline.run()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        return dict(
+            descriptor,
+            worker=self.name,
+            stats=dict(stats.as_dict(), entries=stats.entries, skip_reasons=dict(stats.skip_reasons)),
+            delta=registry_delta(_read_json(snapshot_path), registry.registry),
+            writes=registry.writes
+        )
+
+class ShardCoordinator:
+    """
+    Splits a playlist into entry-range shards, waits for workers (and
+    itself) to process them, then merges their registry deltas into the
+    shared registry in shard order.
+
+    The merge reproduces a sequential run: a new item keeps the filepath
+    of its first shard, providers are unioned (a later URL replaces an
+    earlier one), a strictly better resolution takes over the preferred
+    provider, and a provider's content_count grows once per item it is
+    newly attached to. STRM writes of items or paths touched by more than
+    one shard are replayed so only the files a sequential run would have
+    written remain, with the URL it would have written last.
+    """
+
+    def __init__(self, spool_path=None, shard_size=None, lease_seconds=None, executor=None, config=None):
+        """Spool path, shard size and lease default to config"""
+        config = config or db.load_config()
+        self.spool = ShardSpool(spool_path or config.get("shard_spool_path", "data/shards"))
+        self.shard_size = max(1, shard_size or config.get("shard_size", 5000))
+        self.lease_seconds = lease_seconds or config.get("job_lease_seconds", 300)
+        self.worker = ShardWorker(self.spool, executor=executor)
+
+    def submit(self, filename, provider_url, job_id):
+        """Copy the playlist and a registry snapshot to the spool and queue its shards; returns the shard count"""
+        if not provider_url:
+            raise ValueError("Distributed processing needs a provider URL to merge shard results")
+
+        job_dir = self.spool.job_dir(job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        shutil.copyfile(filename, os.path.join(job_dir, 'playlist.m3u'))
+
+        registry = get_content_registry()
+        with registry_lock.hold():
+            registry.reload_if_stale()
+            with registry.lock:
+                _write_json(os.path.join(job_dir, 'registry.json'), registry.registry)
+
+        total = sum(1 for _ in M3UReader(filename, skip_live=False).entries())
+        shards = max(1, -(-total // self.shard_size))
+        for shard in range(shards):
+            self.spool.add({
+                'job_id': job_id,
+                'shard': shard,
+                'shards': shards,
+                'start': shard * self.shard_size,
+                'end': (shard + 1) * self.shard_size if shard < shards - 1 else None,
+                'provider_url': provider_url,
+                'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+        logger.info(f"Split {filename} ({total} entries) into {shards} shards for job {job_id}")
+        return shards
+
+    def wait(self, job_id, shards, poll_seconds=1):
+        """Wait for every shard's result, working on pending shards meanwhile; returns them in shard order"""
+        while True:
+            done = self.spool.job_shards('done', job_id)
+            processing_monitor.update_job(job_id, current_item=f"{len(done)} of {shards} shards finished")
+            if len(done) >= shards:
+                return [_read_json(os.path.join(self.spool.dir('done'), name)) for name in done]
+            if not self.worker.run_once(job_id):
+                self.spool.requeue_stale(job_id, self.lease_seconds)
+                time.sleep(poll_seconds)
+
+    def run(self, filename, provider_url, job_id):
+        """Process filename across the spool's workers and return the combined PipelineStats"""
+        try:
+            shards = self.submit(filename, provider_url, job_id)
+            results = self.wait(job_id, shards)
+            failed = [result for result in results if result.get('error')]
+            if failed:
+                raise RuntimeError(f"{len(failed)} of {shards} shards failed: {failed[0]['error']}")
+            snapshot = _read_json(os.path.join(self.spool.job_dir(job_id), 'registry.json'))
+            self.merge(snapshot, results)
+            return self._combined_stats(results)
+        finally:
+            self.spool.remove_job(job_id)
+
+    def merge(self, snapshot, results):
+        """Apply the shard deltas to the shared registry in shard order"""
+        registry = get_content_registry()
+
+        with registry_lock.hold():
+            registry.reload_if_stale()
+            with registry.lock, registry.deferred_save():
+                data = registry.registry
+                for result in results:
+                    delta = result['delta']
+                    for provider_id, provider in delta['providers'].items():
+                        merged = data['providers'].setdefault(provider_id, dict(provider, content_count=0))
+                        merged.update({key: value for key, value in provider.items() if key != 'content_count'})
+                        registry.mark_search_changed('providers', provider_id)
+
+                    for section in CONTENT_SECTIONS:
+                        for content_hash, item in delta[section].items():
+                            registry.merge_item(data, section, content_hash, item)
+                            registry.mark_search_changed(section, content_hash)
+                registry._save_registry()
+
+        self._replay_writes(snapshot, results, registry)
+
+    @staticmethod
+    def _replay_writes(snapshot, results, registry):
+        """
+        Fix the STRM files shards wrote independently of each other. For an
+        item written by several shards, a sequential run only makes the
+        first write of a new item and then strictly better resolutions; a
+        path written by several shards keeps the URL of the last write kept.
+        """
+        item_shards = collections.defaultdict(set)
+        path_shards = collections.defaultdict(set)
+        for shard, result in enumerate(results):
+            for section, content_hash, filepath, url, resolution in result['writes']:
+                item_shards[(section, content_hash)].add(shard)
+                path_shards[filepath].add(shard)
+
+        affected = {filepath for filepath, shards in path_shards.items() if len(shards) > 1}
+        state = {}
+        final = {}
+        for result in results:
+            for section, content_hash, filepath, url, resolution in result['writes']:
+                key = (section, content_hash)
+                if len(item_shards[key]) > 1:
+                    if key not in state:
+                        before = snapshot[section].get(content_hash)
+                        state[key] = (before is not None, before.get('resolution') if before else None)
+                    exists, current = state[key]
+                    if exists and not registry._is_better_resolution(resolution, current):
+                        affected.add(filepath)
+                        continue
+                    state[key] = (True, resolution)
+                final[filepath] = url
+
+        for filepath in affected:
+            if filepath in final:
+                tools.makeStrm(filepath, final[filepath])
+            elif os.path.exists(filepath):
+                os.remove(filepath)
+                logger.debug(f"Removed STRM file a sequential run would not have written: {filepath}")
+
+    @staticmethod
+    def _combined_stats(results):
+        """Sum the shards' counters into one PipelineStats"""
+        stats = PipelineStats()
+        for result in results:
+            shard_stats = result['stats']
+            stats.movies_count += shard_stats['movies_count']
+            stats.tv_count += shard_stats['tv_count']
+            stats.skip_count += shard_stats['skip_count']
+            stats.error_count += shard_stats['error_count']
+            stats.entries += shard_stats['entries']
+            stats.skip_reasons.update(shard_stats['skip_reasons'])
+        return stats
+
+def start_worker_thread(config=None):
+    """Start a background ShardWorker when distributed_mode is 'worker'; returns the thread or None"""
+    config = config or db.load_config()
+    if config.get("distributed_mode", "off") != "worker":
+        return None
+    worker = ShardWorker(ShardSpool(config.get("shard_spool_path", "data/shards")))
+    thread = threading.Thread(target=worker.run_forever, name="shard-worker", daemon=True)
+    thread.start()
+    return thread
+
+def main(argv=None):
+    """Command line entry point: run a coordinator for one playlist, or a worker"""
+    parser = argparse.ArgumentParser(description="Process an M3U playlist in shards across several processes")
+    parser.add_argument('--spool', help="shared spool directory (default: shard_spool_path from config)")
+    parser.add_argument('--executor', choices=('serial', 'thread', 'process'))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    coordinator = commands.add_parser('coordinator', help="split a playlist, help process it and merge the results")
+    coordinator.add_argument('playlist')
+    coordinator.add_argument('--url', required=True, help="provider URL the playlist came from")
+    coordinator.add_argument('--shard-size', type=int)
+    coordinator.add_argument('--job-id')
+
+    worker = commands.add_parser('worker', help="process shards until interrupted")
+    worker.add_argument('--once', action='store_true', help="exit when no shard is pending")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'coordinator':
+        job_id = args.job_id or f"shards-{os.getpid()}-{int(time.time())}"
+        processing_monitor.start_job(job_id, f"Processing M3U file in shards: {os.path.basename(args.playlist)}")
+        try:
+            coordinator = ShardCoordinator(args.spool, shard_size=args.shard_size, executor=args.executor)
+            stats = coordinator.run(args.playlist, args.url, job_id)
+        except Exception as e:
+            processing_monitor.complete_job(job_id, status='error', error=str(e))
+            raise
+        processing_monitor.complete_job(job_id, status='completed')
+        print(json.dumps(stats.as_dict()))
+        return 0
+
+    config = db.load_config()
+    worker = ShardWorker(ShardSpool(args.spool or config.get("shard_spool_path", "data/shards")), executor=args.executor)
+    if args.once:
+        while worker.run_once():
+            pass
+    else:
+        worker.run_forever()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,18 +3,52 @@ import json
 import time
 import threading
 import queue
+import sqlite3
 import logging
+import db
+from coordination import process_name
 
 logger = logging.getLogger(__name__)
 
+# Seconds between checks for events published by other worker processes
+EVENT_POLL_INTERVAL = 1
+
+# Published events are kept this long for workers to pick up
+EVENT_RETENTION_SECONDS = 120
+
 class SSEManager:
-    """Manager for Server-Sent Events (SSE) notifications"""
+    """
+    Manager for Server-Sent Events (SSE) notifications.
     
-    def __init__(self):
+    Messages go straight to this process's clients and are also published
+    to the sse_events table, which every other worker process polls and
+    relays to its own clients.
+    """
+    
+    def __init__(self, db_file=db.DB_FILE):
         self.clients = []
         self.lock = threading.Lock()
+        self.db_file = db_file
+        self.origin = process_name()
+        self.last_event_id = self._init_events()
         self.keep_alive_thread = threading.Thread(target=self._keep_alive_thread, daemon=True)
         self.keep_alive_thread.start()
+        self.relay_thread = threading.Thread(target=self._relay_thread, daemon=True)
+        self.relay_thread.start()
+    
+    def _init_events(self):
+        """Create the events table and return the newest event id"""
+        with sqlite3.connect(self.db_file, timeout=30) as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS sse_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT NOT NULL,
+                event_type TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            ''')
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM sse_events').fetchone()[0]
     
     def register_client(self, client_queue):
         """Register a new client"""
@@ -30,12 +64,27 @@ class SSEManager:
                 logger.debug(f"Client removed, remaining clients: {len(self.clients)}")
     
     def send_message(self, event_type, data):
-        """Send a message to all connected clients"""
-        message = {
+        """Send a message to all connected clients, in this and every other worker process"""
+        self._deliver({
             "type": event_type,
             "data": data
-        }
-        
+        })
+        self._publish(event_type, data)
+    
+    def _publish(self, event_type, data):
+        """Store a message for the other worker processes"""
+        try:
+            with sqlite3.connect(self.db_file, timeout=30) as conn:
+                conn.execute(
+                    'INSERT INTO sse_events (origin, event_type, data, created_at) VALUES (?, ?, ?, ?)',
+                    (self.origin, event_type, json.dumps(data), time.time())
+                )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.error(f"Error publishing {event_type} event: {e}")
+    
+    def _deliver(self, message):
+        """Put a message on the queue of every client connected to this process"""
+        event_type = message["type"]
         with self.lock:
             dead_clients = []
             
@@ -53,6 +102,30 @@ class SSEManager:
             
             logger.debug(f"Message sent to {len(self.clients)} clients, type: {event_type}")
     
+    def _relay_thread(self):
+        """Relay events published by other worker processes to this process's clients"""
+        polls = 0
+        while True:
+            try:
+                time.sleep(EVENT_POLL_INTERVAL)
+                with sqlite3.connect(self.db_file, timeout=30) as conn:
+                    rows = conn.execute(
+                        'SELECT id, origin, event_type, data FROM sse_events WHERE id > ? ORDER BY id',
+                        (self.last_event_id,)
+                    ).fetchall()
+                    
+                    # Drop old events now and then
+                    polls += 1
+                    if polls % 60 == 0:
+                        conn.execute('DELETE FROM sse_events WHERE created_at < ?', (time.time() - EVENT_RETENTION_SECONDS,))
+                
+                for event_id, origin, event_type, data in rows:
+                    self.last_event_id = event_id
+                    if origin != self.origin and self.clients:
+                        self._deliver({"type": event_type, "data": json.loads(data)})
+            except Exception as e:
+                logger.error(f"Error in event relay thread: {e}")
+    
     def _keep_alive_thread(self):
         """Send keep-alive messages to prevent connection timeouts"""
         while True:
@@ -4,17 +4,21 @@ import os
 import re
 import tools
 import db
+import parse_cache
 import notifications
 import json
-import time
 import uuid
 import threading
 import signal
 import concurrent.futures
 from datetime import datetime
 from processing_monitor import processing_monitor
-from sse_notifications import send_notification, send_status_update
-from logger import LogLevel
+from sse_notifications import send_notification
+from library_scanner import scan_content_dirs
+from content_comparison import get_content_registry
+from stream_classifier import get_stream_classifier
+from stream_filter import get_stream_filter, stream_attribute
+from checkpoints import StoredCheckpoint
 
 
 # Initialize logger
@@ -47,15 +51,22 @@ class Movie(object):
         movie_path = f'{content_path}/Movies/' + self.title.replace(':','-').replace('*','_').replace('/','_').replace('?','')
         return movie_path + "/" + ' - '.join(filestring) + ".strm"
     
-    def makeStream(self, provider_url=None):
+    def makeStream(self, provider_url=None, registry=None):
         """Create or update STRM file for a movie with content registry and provider tracking"""
         filename = self.getFilename()
         logger.debug(f"Creating movie stream for: {filename}")
         
-        # Get content registry
-        from content_comparison import ContentRegistry
-        registry = ContentRegistry()
+        # Get the shared content registry
+        if registry is None:
+            registry = get_content_registry()
         
+        # Hold the per-title lock so concurrent workers can't interleave the
+        # exists / better-resolution / write sequence for the same movie
+        with registry.content_lock("movie", self.title, year=self.year):
+            self._makeStream(filename, provider_url, registry)
+    
+    def _makeStream(self, filename, provider_url, registry):
+        """Write the movie STRM file and record it in the registry (caller holds the content lock)"""
         # Create directories if they don't exist
         directories = filename.split('/')
         directories = directories[:-1]
@@ -65,17 +76,17 @@ class Movie(object):
         content_path = config.get("output_path", "content")
         base_dir = content_path
         if not os.path.exists(base_dir):
-            os.makedirs(base_dir)
+            os.makedirs(base_dir, exist_ok=True)
         
         # Create Movies subfolder
         movies_dir = os.path.join(base_dir, 'Movies')
         if not os.path.exists(movies_dir):
-            os.makedirs(movies_dir)
+            os.makedirs(movies_dir, exist_ok=True)
         
         # Create individual movie folder
         movie_dir = '/'.join(directories)
         if not os.path.exists(movie_dir):
-            os.makedirs(movie_dir)
+            os.makedirs(movie_dir, exist_ok=True)
         
         # Check if this content has already been processed
         if registry.content_exists("movie", self.title, year=self.year):
@@ -167,15 +178,22 @@ class TVEpisode(object):
         logger.debug(f"Generated filename: {path}")
         return path
     
-    def makeStream(self, provider_url=None):
+    def makeStream(self, provider_url=None, registry=None):
         """Create or update STRM file for a TV episode with content registry integration"""
         filename = self.getFilename()
         logger.debug(f"Creating TV stream for: {filename}")
         
-        # Get content registry
-        from content_comparison import ContentRegistry
-        registry = ContentRegistry()
+        # Get the shared content registry
+        if registry is None:
+            registry = get_content_registry()
         
+        # Hold the per-episode lock so concurrent workers can't interleave the
+        # exists / better-resolution / write sequence for the same episode
+        with registry.content_lock("tv_show", self.showtitle, season=self.seasonnumber, episode=self.episodenumber):
+            self._makeStream(filename, provider_url, registry)
+    
+    def _makeStream(self, filename, provider_url, registry):
+        """Write the episode STRM file and record it in the registry (caller holds the content lock)"""
         directories = filename.split('/')
         directories = directories[:-1]  # Remove the file name
     
@@ -184,23 +202,23 @@ class TVEpisode(object):
         content_path = config.get("output_path", "content")
         base_dir = content_path
         if not os.path.exists(base_dir):
-            os.makedirs(base_dir)
+            os.makedirs(base_dir, exist_ok=True)
         
         # Create TV Shows subfolder
         tvshows_dir = os.path.join(base_dir, 'TV Shows')
         if not os.path.exists(tvshows_dir):
-            os.makedirs(tvshows_dir)
+            os.makedirs(tvshows_dir, exist_ok=True)
         
         # Create show directory
         showdir = '/'.join(directories[:-1] if len(directories) > 3 else directories)
         if not os.path.exists(showdir):
-            os.makedirs(showdir)
+            os.makedirs(showdir, exist_ok=True)
         
         # Create season directory if it exists
         if len(directories) > 3:  # We have a season directory
             seasondir = '/'.join(directories)
             if not os.path.exists(seasondir):
-                os.makedirs(seasondir)
+                os.makedirs(seasondir, exist_ok=True)
     
         # Check if this content already exists
         if registry.content_exists("tv_show", self.showtitle, season=self.seasonnumber, episode=self.episodenumber):
@@ -287,26 +305,30 @@ def run_with_timeout(func, *args, timeout=PROCESSING_TIMEOUT, **kwargs):
 
 # Define a stream container to hold parsed data
 class StreamEntry:
+    """
+    One M3U entry on its way through the pipeline. Slotted, with tvg_name
+    sliced out of streaminfo on demand, so an entry costs three references.
+    """
+    __slots__ = ('streaminfo', 'streamURL', 'stream_type')
+
     def __init__(self, streaminfo, streamURL, stream_type=None):
         self.streaminfo = streaminfo
         self.streamURL = streamURL
         self.stream_type = stream_type  # Will be determined during parsing
-        self.tvg_name = None
-        
-        # Try to extract the TVG name
-        tvg_name_match = re.search(r'tvg-name="([^"]*)"', streaminfo)
-        if tvg_name_match:
-            self.tvg_name = tvg_name_match.group(1)
+
+    @property
+    def tvg_name(self):
+        """The tvg-name attribute of streaminfo, or None"""
+        return stream_attribute(self.streaminfo, 'tvg-name')
 
 class rawStreamList(object):
-    def __init__(self, filename, job_id=None, m3u_url=None):
+    def __init__(self, filename, job_id=None, m3u_url=None, executor=None):
         # Get log level from config
         config = db.load_config()
         import logger as logger_module
         log_level = getattr(logger_module.LogLevel, config.get("log_level", "NORMAL"))
         self.log = logger_module.Logger(__file__, log_level=log_level)
         
-        self.streams = []  # Will hold StreamEntry objects
         self.filename = filename
         self.movies_count = 0
         self.tv_count = 0
@@ -314,6 +336,8 @@ class rawStreamList(object):
         self.error_count = 0
         self.job_id = job_id or str(uuid.uuid4())
         self.m3u_url = m3u_url  # Store the source URL for provider tracking
+        # Resolved once per list, so classifying an entry costs the same whatever the keyword lists
+        self.classifier = get_stream_classifier(config)
         
         # Initialize processing monitor
         processing_monitor.start_job(
@@ -325,24 +349,23 @@ class rawStreamList(object):
         self.content_before = self._scan_content_dirs()
         
         try:
-            # PHASE 1: Read and parse the M3U file into memory
             send_notification(
                 "Processing Started", 
-                f"Phase 1: Reading M3U file {os.path.basename(filename)}", 
-                "info"
-            )
-            
-            self.readLines()
-            self.parseM3UToMemory()
-            
-            # PHASE 2: Process the parsed entries to create STRM files
-            send_notification(
-                "M3U File Parsed", 
-                f"Phase 2: Creating STRM files from {len(self.streams)} entries", 
+                f"Processing M3U file {os.path.basename(filename)}", 
                 "info"
             )
             
-            self.processStreamEntries()
+            # Read, parse and create STRM files through the shared pipeline;
+            # rerunning a job ID on the same playlist resumes from its checkpoint
+            from pipeline import StreamPipeline
+            checkpoint = StoredCheckpoint(self.job_id)
+            pipeline = StreamPipeline(filename, provider_url=m3u_url, job_id=self.job_id, executor=executor, checkpoint=checkpoint)
+            stats = pipeline.run()
+            checkpoint.clear()
+            self.movies_count = stats.movies_count
+            self.tv_count = stats.tv_count
+            self.skip_count = stats.skip_count
+            self.error_count = stats.error_count
             
             # Check for content changes
             self.content_after = self._scan_content_dirs()
@@ -427,43 +450,7 @@ class rawStreamList(object):
 
     def _scan_content_dirs(self):
         """Scan content directories to build a list of current files"""
-        config = db.load_config()
-        content_path = config.get("output_path", "content")
-        
-        content = {
-            "movies": set(),
-            "tv": set()
-        }
-        
-        # Scan movies
-        movie_path = os.path.join(content_path, 'Movies')
-        if os.path.exists(movie_path):
-            for movie_dir in os.listdir(movie_path):
-                movie_full_path = os.path.join(movie_path, movie_dir)
-                if os.path.isdir(movie_full_path):
-                    for file in os.listdir(movie_full_path):
-                        if file.endswith(".strm"):
-                            content["movies"].add(os.path.join(movie_dir, file))
-        
-        # Scan TV shows
-        tv_path = os.path.join(content_path, 'TV Shows')
-        if os.path.exists(tv_path):
-            for show_dir in os.listdir(tv_path):
-                show_full_path = os.path.join(tv_path, show_dir)
-                if os.path.isdir(show_full_path):
-                    for season_or_file in os.listdir(show_full_path):
-                        season_full_path = os.path.join(show_full_path, season_or_file)
-                        
-                        if os.path.isdir(season_full_path):
-                            # This is a season directory
-                            for episode_file in os.listdir(season_full_path):
-                                if episode_file.endswith(".strm"):
-                                    content["tv"].add(os.path.join(show_dir, season_or_file, episode_file))
-                        elif season_or_file.endswith(".strm"):
-                            # This is a direct episode file
-                            content["tv"].add(os.path.join(show_dir, season_or_file))
-        
-        return content
+        return scan_content_dirs()
 
     def _detect_content_changes(self):
         """Detect content changes by comparing before and after scans"""
@@ -512,435 +499,65 @@ class rawStreamList(object):
         self.changes = changes
         return changes
 
-    def readLines(self):
-        """Read all lines from the M3U file with enhanced error handling"""
+    def processStreamEntry(self, stream):
+        """Process a single stream entry to create STRM file"""
         try:
-            # Check if file exists
-            if not os.path.exists(self.filename):
-                error_msg = f"Error: M3U file not found at {self.filename}"
-                self.log.write_to_log(error_msg, log_level=LogLevel.NORMAL)
-                raise FileNotFoundError(error_msg)
-                
-            # Check if file is empty
-            if os.path.getsize(self.filename) == 0:
-                error_msg = f"Error: M3U file is empty ({self.filename})"
-                self.log.write_to_log(error_msg, log_level=LogLevel.NORMAL)
-                raise ValueError(error_msg)
-                
-            # Try to open the file with different encodings if needed
-            encodings = ['utf-8', 'latin-1', 'cp1252']
-            
-            for encoding in encodings:
-                try:
-                    with open(self.filename, encoding=encoding) as file:
-                        self.lines = [line.rstrip('\n') for line in file]
-                        
-                    # Check for minimum M3U content
-                    if len(self.lines) < 2:
-                        self.log.write_to_log(f"Warning: M3U file has only {len(self.lines)} lines", log_level=LogLevel.NORMAL)
-                    
-                    # Log success
-                    self.log.write_to_log(f"Successfully read {len(self.lines)} lines from M3U file using {encoding} encoding", log_level=LogLevel.NORMAL)
-                    return len(self.lines)
-                except UnicodeDecodeError:
-                    self.log.write_to_log(f"Could not decode file using {encoding} encoding, trying next...", log_level=LogLevel.NORMAL)
-                    continue
-            
-            # If we've tried all encodings and none worked, try one more time with errors='ignore'
-            self.log.write_to_log("Falling back to ignoring encoding errors", log_level=LogLevel.NORMAL)
-            with open(self.filename, encoding='utf-8', errors='ignore') as file:
-                self.lines = [line.rstrip('\n') for line in file]
-                
-            self.log.write_to_log(f"Read {len(self.lines)} lines from M3U file with encoding errors ignored", log_level=LogLevel.NORMAL)
-            return len(self.lines)
-                
-        except Exception as e:
-            error_msg = f"Failed to read M3U file: {str(e)}"
-            self.log.write_to_log(error_msg, log_level=LogLevel.NORMAL)
+            item = self.planStreamEntry(stream)
+            if item:
+                item.makeStream(self.m3u_url)  # Pass the M3U URL as provider URL
+        except Exception:
             self.error_count += 1
-            processing_monitor.update_job(
-                self.job_id,
-                status='error',
-                current_item=f"Error reading M3U file: {str(e)}",
-                errors=self.error_count
-            )
-            raise
-    
-    def parseM3UToMemory(self):
-        """PHASE 1: Parse the M3U file and collect all streams in memory without creating STRM files"""
-        linenumber = 0
-        total_lines = len(self.lines)
-        items_processed = 0
-        last_update_time = time.time()
-        
-        # Update status
-        processing_monitor.update_job(
-            self.job_id,
-            current_item=f"Phase 1: Parsing M3U file",
-            items_processed=0
-        )
-        
-        send_notification(
-            "Parsing M3U", 
-            f"Reading {total_lines} lines", 
-            "info"
-        )
-        
-        # Get language filter from config
-        config = db.load_config()
-        language_filter = config.get("language_filter", "EN")
-        skip_non_english = config.get("skip_non_english", True)
-        
-        while linenumber < total_lines:
-            # Update processing status every 100 lines or 5 seconds
-            if items_processed % 100 == 0 or (items_processed > 0 and time.time() - last_update_time > 5):
-                processing_monitor.update_job(
-                    self.job_id,
-                    current_item=f"Phase 1: Parsing line {linenumber}/{total_lines}",
-                    items_processed=items_processed,
-                    errors=self.error_count
-                )
-                last_update_time = time.time()
-                
-                # Also send status to browser
-                if items_processed % 500 == 0:  # Less frequent to reduce browser load
-                    progress = {
-                        "jobId": self.job_id,
-                        "line": linenumber,
-                        "total_lines": total_lines,
-                        "processed": items_processed,
-                        "currentItem": f"Phase 1: Parsing line {linenumber}/{total_lines}"
-                    }
-                    send_status_update(progress)
-            
-            try:
-                thisline = self.lines[linenumber]
-                
-                # Skip if we're at the end of the file
-                if linenumber + 1 >= total_lines:
-                    break
-                    
-                nextline = self.lines[linenumber + 1]
-                
-                firstline = re.compile('EXTM3U', re.IGNORECASE).search(thisline)
-                if firstline:
-                    linenumber += 1
-                    continue
-                    
-                # Process stream entries
-                tvg_name_match = re.search(r'tvg-name="([^"]*)"', thisline)
-                if tvg_name_match:
-                    tvg_name = tvg_name_match.group(1)
-                    
-                    # Skip non-matching language if filter is enabled
-                    if skip_non_english and language_filter and not tvg_name.startswith(f'{language_filter} - '):
-                        logger.debug(f"Skipping non-{language_filter} stream: {tvg_name}")
-                        self.skip_count += 1
-                        if linenumber + 1 < total_lines and thisline[0] == "#" and nextline[0] == "#":
-                            linenumber += 3 if linenumber + 2 < total_lines else 2
-                        else:
-                            linenumber += 2 if linenumber + 1 < total_lines else 1
-                        continue
-                    
-                    # Process stream
-                    if thisline[0] == "#" and nextline[0] == "#":
-                        if linenumber + 2 < total_lines and tools.verifyURL(self.lines[linenumber+2]):
-                            streaminfo = ' '.join([thisline, nextline])
-                            streamURL = self.lines[linenumber+2]
-                            
-                            # Save the stream entry for later processing
-                            stream_entry = StreamEntry(streaminfo, streamURL)
-                            self.streams.append(stream_entry)
-                            items_processed += 1
-                            
-                            linenumber += 3
-                        else:
-                            logger.warning(f"Invalid stream format at line {linenumber}")
-                            linenumber += 1
-                    elif tools.verifyURL(nextline):
-                        streaminfo = thisline
-                        streamURL = nextline
-                        
-                        # Save the stream entry for later processing
-                        stream_entry = StreamEntry(streaminfo, streamURL)
-                        self.streams.append(stream_entry)
-                        items_processed += 1
-                        
-                        linenumber += 2
-                    else:
-                        linenumber += 1
-                else:
-                    linenumber += 1
-                    
-            except Exception as e:
-                logger.error(f"Error parsing line {linenumber}: {str(e)}")
-                self.error_count += 1
-                linenumber += 1
-        
-        # Update status after phase 1
-        processing_monitor.update_job(
-            self.job_id,
-            current_item=f"Phase 1 complete: Found {len(self.streams)} streams",
-            items_processed=len(self.streams)
-        )
-        
-        # Pre-determine stream types
-        self._determine_stream_types()
-        
-        logger.info(f"Parsed {len(self.streams)} streams from M3U file")
-        send_notification(
-            "M3U Parsing Complete", 
-            f"Found {len(self.streams)} streams in the M3U file", 
-            "success"
-        )
-    
-    def _determine_stream_types(self):
-        """Determine the type of each stream beforehand"""
-        movie_count = 0
-        tv_count = 0
-        
-        for i, stream in enumerate(self.streams):
-            if i % 100 == 0:
-                processing_monitor.update_job(
-                    self.job_id,
-                    current_item=f"Determining stream types: {i}/{len(self.streams)}",
-                    items_processed=i
-                )
-            
-            try:
-                stream_type = self.parseStreamType(stream.streaminfo)
-                stream.stream_type = stream_type
-                
-                if stream_type == 'vodMovie':
-                    movie_count += 1
-                elif stream_type == 'vodTV':
-                    tv_count += 1
-            except Exception as e:
-                logger.error(f"Error determining stream type: {str(e)}")
-                # Default to movie
-                stream.stream_type = 'vodMovie'
-        
-        logger.info(f"Pre-determined stream types: {movie_count} movies, {tv_count} TV shows")
-    
-    def processStreamEntries(self):
-        """PHASE 2: Process all collected stream entries to create STRM files"""
-        total_streams = len(self.streams)
-        items_processed = 0
-        last_update_time = time.time()
-        
-        # Update status
-        processing_monitor.update_job(
-            self.job_id,
-            current_item=f"Phase 2: Creating STRM files",
-            items_processed=0
-        )
-        
-        send_notification(
-            "Creating STRM Files", 
-            f"Processing {total_streams} streams", 
-            "info"
-        )
-        
-        for i, stream in enumerate(self.streams):
-            # Update processing status every 10 items or 5 seconds
-            if i % 10 == 0 or (i > 0 and time.time() - last_update_time > 5):
-                processing_monitor.update_job(
-                    self.job_id,
-                    current_item=f"Phase 2: Processing stream {i+1}/{total_streams}",
-                    items_processed=i,
-                    errors=self.error_count
-                )
-                last_update_time = time.time()
-                
-                # Also send status to browser
-                if i % 50 == 0:  # Less frequent to reduce browser load
-                    progress = {
-                        "jobId": self.job_id,
-                        "processed": i,
-                        "total": total_streams,
-                        "movies": self.movies_count,
-                        "tv": self.tv_count,
-                        "skipped": self.skip_count,
-                        "errors": self.error_count,
-                        "currentItem": f"Phase 2: Processing stream {i+1}/{total_streams}"
-                    }
-                    send_status_update(progress)
-            
-            try:
-                # Process the stream with a timeout
-                run_with_timeout(
-                    self.processStreamEntry,
-                    stream,
-                    timeout=PROCESSING_TIMEOUT
-                )
-                items_processed += 1
-            except Exception as e:
-                logger.error(f"Error processing stream {i}: {str(e)}")
-                self.error_count += 1
-                self.skip_count += 1
-                
-                # Extract stream name for notification if possible
-                stream_name = stream.tvg_name or f"Stream #{i+1}"
-                
-                send_notification(
-                    "Stream Processing Error",
-                    f"Skipped problematic stream: {stream_name}",
-                    "warning"
-                )
-        
-        # Final status update
-        processing_monitor.update_job(
-            self.job_id,
-            current_item="Phase 2 complete: Created STRM files",
-            items_processed=items_processed,
-            errors=self.error_count,
-            status="completed"
-        )
+            self.skip_count += 1
+            raise  # Re-raise to be handled by the caller
         
-        # Also send final status to browser
-        progress = {
-            "jobId": self.job_id,
-            "processed": items_processed,
-            "total": total_streams,
-            "movies": self.movies_count,
-            "tv": self.tv_count,
-            "skipped": self.skip_count,
-            "errors": self.error_count,
-            "currentItem": "Completed",
-            "status": "completed"
-        }
-        send_status_update(progress)
-    
-    def processStreamEntry(self, stream):
-        """Process a single stream entry to create STRM file"""
+        if isinstance(item, TVEpisode):
+            self.tv_count += 1
+        elif isinstance(item, Movie):
+            self.movies_count += 1
+        else:
+            # Live stream or other type - just skip
+            self.skip_count += 1
+
+    def planStreamEntry(self, stream, classifier=None):
+        """Build the Movie/TVEpisode for a stream entry without touching disk (None to skip)"""
         # If stream type wasn't pre-determined, determine it now
         if not stream.stream_type:
-            stream.stream_type = self.parseStreamType(stream.streaminfo)
+            stream.stream_type = self.parseStreamType(stream.streaminfo, classifier)
         
-        # Process based on determined stream type
+        # Plan based on determined stream type
         if stream.stream_type == 'vodTV':
             try:
-                self.parseVodTv(stream.streaminfo, stream.streamURL)
-                self.tv_count += 1
+                return self.planVodTv(stream.streaminfo, stream.streamURL)
             except Exception as e:
                 logger.error(f"ERROR in parseVodTv: {str(e)}")
                 # Try fallback method if standard fails
                 try:
-                    fallback_success = self.createFallbackTVShow(stream.streaminfo, stream.streamURL)
+                    episode = self.planFallbackTVShow(stream.streaminfo, stream.streamURL)
+                    if episode:
+                        return episode
                     
-                    if fallback_success:
-                        self.tv_count += 1
-                    else:
-                        # If all TV show methods fail, process as movie
-                        logger.warning("TV show parsing failed, treating as movie")
-                        self.parseVodMovie(stream.streaminfo, stream.streamURL)
-                        self.movies_count += 1
+                    # If all TV show methods fail, process as movie
+                    logger.warning("TV show parsing failed, treating as movie")
+                    return self.planVodMovie(stream.streaminfo, stream.streamURL)
                 except Exception as fallback_error:
                     logger.error(f"Fallback TV show processing failed: {str(fallback_error)}")
-                    self.error_count += 1
-                    self.skip_count += 1
-                    raise  # Re-raise to be handled by the caller
+                    raise
         elif stream.stream_type == 'vodMovie':
             try:
-                self.parseVodMovie(stream.streaminfo, stream.streamURL)
-                self.movies_count += 1
+                return self.planVodMovie(stream.streaminfo, stream.streamURL)
             except Exception as e:
                 logger.error(f"ERROR in parseVodMovie: {str(e)}")
-                self.error_count += 1
-                self.skip_count += 1
-                raise  # Re-raise to be handled by the caller
-        else:
-            # Live stream or other type - just skip
-            self.skip_count += 1
+                raise
+        return None
 
-    def parseStreamType(self, streaminfo):
-        """Determine the type of stream based on information in the stream metadata."""
+    def parseStreamType(self, streaminfo, classifier=None):
+        """Determine the type of stream based on information in the stream metadata (with self.classifier by default)."""
         logger.debug(f"\nDetermining stream type for: {streaminfo}")
         
-        # Get custom keywords from config
-        config = db.load_config()
-        movie_keywords = config.get("movie_keywords", ["movie", "film", "feature"])
-        tv_keywords = config.get("tv_keywords", ["tv", "show", "series", "episode"])
-        
-        # Log the keywords we're using for detection
-        logger.debug(f"Using movie keywords: {movie_keywords}")
-        logger.debug(f"Using TV keywords: {tv_keywords}")
-        
         try:
-            # Check for explicit type in the stream info
-            typematch = tools.tvgTypeMatch(streaminfo)
-            if typematch:
-                streamtype = tools.getResult(typematch)
-                logger.debug(f"Found explicit type: {streamtype}")
-                if streamtype == 'tvshows':
-                    return 'vodTV'
-                if streamtype == 'movies':
-                    return 'vodMovie'
-                if streamtype == 'live':
-                    return 'live'
-            
-            # Check for season and episode pattern (SxxExx)
-            tvshowmatch = tools.sxxExxMatch(streaminfo)
-            if tvshowmatch:
-                logger.debug(f"Found TV show pattern: {tvshowmatch.group()}")
-                return 'vodTV'
-            
-            # Check for airdate pattern
-            airdatematch = tools.airDateMatch(streaminfo)
-            if airdatematch:
-                logger.debug(f"Found airdate pattern: {airdatematch.group()}")
-                return 'vodTV'
-            
-            # Check for keywords in the title
-            tvg_name_match = tools.tvgNameMatch(streaminfo)
-            if tvg_name_match:
-                title = tools.getResult(tvg_name_match).lower()
-                logger.debug(f"Checking title for keywords: {title}")
-                
-                # Check for TV show keywords
-                for keyword in tv_keywords:
-                    if keyword.lower() in title:
-                        logger.debug(f"Found TV keyword in title: {keyword}")
-                        return 'vodTV'
-                
-                # Check for movie keywords
-                for keyword in movie_keywords:
-                    if keyword.lower() in title:
-                        logger.debug(f"Found movie keyword in title: {keyword}")
-                        return 'vodMovie'
-                
-                # Check for year in parentheses (typical for movies)
-                year_pattern = re.compile(r'\(\d{4}\)').search(title)
-                if year_pattern:
-                    logger.debug(f"Found year pattern in title: {year_pattern.group()}")
-                    return 'vodMovie'
-                
-                # Check for common TV show indicators
-                common_tv_indicators = [
-                    'episode', 'season', 'series', 'show', 
-                    's01', 's02', 's03', 's1', 's2', 's3',
-                    'e01', 'e02', 'e1', 'e2',
-                    ' tv ', ' serie', ' tv-', ' tv:'
-                ]
-                
-                for indicator in common_tv_indicators:
-                    if indicator in title.lower():
-                        logger.debug(f"Found TV indicator in title: {indicator}")
-                        return 'vodTV'
-            
-            # Check if it might be a TV show based on naming convention
-            if tvg_name_match:
-                title = tools.getResult(tvg_name_match)
-                # Look for common TV show indicators like "S01" or "Season 1" or "Episode"
-                tv_indicator = re.compile(r'S\d+|Season \d+|Episode', re.IGNORECASE).search(title)
-                if tv_indicator:
-                    logger.debug(f"Found TV indicator in title: {tv_indicator.group()}")
-                    return 'vodTV'
-            
-            # Default to movie if we can't determine
-            logger.debug("Defaulting to movie type")
-            return 'vodMovie'
-            
+            stream_type = (classifier or self.classifier).classify(streaminfo)
+            logger.debug(f"Determined stream type: {stream_type}")
+            return stream_type
         except Exception as e:
             logger.error(f"Error determining stream type: {str(e)}")
             # Default to movie if there's an error
@@ -948,6 +565,14 @@ class rawStreamList(object):
 
     def createFallbackTVShow(self, streaminfo, streamURL):
         """Create a TV Show entry using fallback methods when standard detection fails"""
+        episode = self.planFallbackTVShow(streaminfo, streamURL)
+        if episode:
+            episode.makeStream(self.m3u_url)  # Pass the M3U URL as provider URL
+            return True
+        return False
+    
+    def planFallbackTVShow(self, streaminfo, streamURL):
+        """Build a TVEpisode using fallback methods when standard detection fails (None if impossible)"""
         logger.debug("\n=== FALLBACK TV SHOW PROCESSING START ===")
         logger.debug(f"Using fallback TV show detection for: {streaminfo}")
         
@@ -958,11 +583,7 @@ class rawStreamList(object):
             
             # Remove language prefix if exists
             config = db.load_config()
-            language_filter = config.get("language_filter", "EN")
-            if language_filter and original_title.startswith(f'{language_filter} - '):
-                title = original_title[len(language_filter) + 3:]
-            else:
-                title = original_title
+            title = get_stream_filter(config).strip_language(original_title)
                 
             # Remove year pattern if exists
             title = re.sub(r'\s*\(\d{4}\)$', '', title)
@@ -991,9 +612,8 @@ class rawStreamList(object):
                 
                 if episode:
                     logger.debug(f"Created fallback episode: {episode.__dict__}")
-                    episode.makeStream(self.m3u_url)  # Pass the M3U URL as provider URL
                     logger.debug("=== FALLBACK TV SHOW PROCESSING COMPLETE ===\n")
-                    return True
+                    return episode
             else:
                 # If no hyphen, just use the title as show name and "Episode 1" as episode name
                 show_title = title.strip()
@@ -1017,32 +637,35 @@ class rawStreamList(object):
                 
                 if episode:
                     logger.debug(f"Created fallback episode: {episode.__dict__}")
-                    episode.makeStream(self.m3u_url)  # Pass the M3U URL as provider URL
                     logger.debug("=== FALLBACK TV SHOW PROCESSING COMPLETE ===\n")
-                    return True
+                    return episode
         
         logger.debug("Fallback TV show detection failed")
         logger.debug("=== FALLBACK TV SHOW PROCESSING FAILED ===\n")
-        return False
+        return None
     
     def parseVodTv(self, streaminfo, streamURL):
+        episode = self.planVodTv(streaminfo, streamURL)
+        episode.makeStream(self.m3u_url)  # Pass the M3U URL as provider URL
+    
+    def planVodTv(self, streaminfo, streamURL):
+        """Build the TVEpisode for a TV VOD stream, raising if the title can't be parsed"""
         logger.debug("\n=== TV SHOW PROCESSING START ===")
         logger.debug(f"Parsing TV VOD: {streaminfo}")
         
         # Get language filter from config
         config = db.load_config()
-        language_filter = config.get("language_filter", "EN")
+        stream_filter = get_stream_filter(config)
         
         # Get the title from tvg-name
         tvg_name_match = re.search(r'tvg-name="([^"]*)"', streaminfo)
         if tvg_name_match:
             original_title = tvg_name_match.group(1)
-            title = original_title
             logger.debug(f"Original title: {original_title}")
             
             # Remove language prefix if it exists
-            if language_filter and title.startswith(f'{language_filter} - '):
-                title = original_title[len(language_filter) + 3:]  # Remove "XX - " prefix
+            title = stream_filter.strip_language(original_title)
+            if title != original_title:
                 logger.debug(f"Title after language prefix removal: {title}")
             
             # NEW CODE: Check for standalone season number format (like "American Dad 19")
@@ -1077,9 +700,8 @@ class rawStreamList(object):
                         
                         if episode:
                             logger.debug(f"Created episode from standalone season: {episode.__dict__}")
-                            episode.makeStream(self.m3u_url)  # Pass the M3U URL as provider URL
                             logger.debug("=== TV SHOW PROCESSING COMPLETE ===\n")
-                            return
+                            return episode
                 except ValueError:
                     # Not a valid season number, continue with normal processing
                     pass
@@ -1094,7 +716,7 @@ class rawStreamList(object):
                 logger.debug(f"Found resolution: {resolution}")
             
             # Parse episode information
-            episodeinfo = tools.parseEpisode(title)
+            episodeinfo = parse_cache.parse_episode(title, config)
             episode = None
             
             if episodeinfo:
@@ -1122,9 +744,8 @@ class rawStreamList(object):
                 
                 if episode:
                     logger.debug(f"Created episode object: {episode.__dict__}")
-                    logger.debug(f"Episode filename: {episode.getFilename()}")
-                    episode.makeStream(self.m3u_url)  # Pass the M3U URL as provider URL
                     logger.debug("=== TV SHOW PROCESSING COMPLETE ===\n")
+                    return episode
                 else:
                     logger.error("Failed to create episode object")
                     logger.debug("=== TV SHOW PROCESSING FAILED ===\n")
@@ -1143,21 +764,25 @@ class rawStreamList(object):
         pass
 
     def parseVodMovie(self, streaminfo, streamURL):
+        moviestream = self.planVodMovie(streaminfo, streamURL)
+        if moviestream:
+            moviestream.makeStream(self.m3u_url)  # Pass the M3U URL as provider URL
+    
+    def planVodMovie(self, streaminfo, streamURL):
+        """Build the Movie for a movie VOD stream (None if it has no tvg-name)"""
         logger.debug(f"Parsing Movie VOD: {streaminfo}")
         
         # Get language filter from config
         config = db.load_config()
-        language_filter = config.get("language_filter", "EN")
+        stream_filter = get_stream_filter(config)
         
         # Get the title from tvg-name
         tvg_name_match = re.search(r'tvg-name="([^"]*)"', streaminfo)
         if tvg_name_match:
             original_title = tvg_name_match.group(1)
-            title = original_title
             
             # Remove language prefix if it exists
-            if language_filter and title.startswith(f'{language_filter} - '):
-                title = original_title[len(language_filter) + 3:]  # Remove "XX - " prefix
+            title = stream_filter.strip_language(original_title)
                 
             # Remove date/year pattern if it exists
             title = re.sub(r'\s*\(\d{4}\)$', '', title)
@@ -1174,7 +799,10 @@ class rawStreamList(object):
             
             moviestream = Movie(title, streamURL, year=year, resolution=resolution)
             logger.debug(f"Created movie object: {moviestream.__dict__}")
-            moviestream.makeStream(self.m3u_url)  # Pass the M3U URL as provider URL
+            return moviestream
+        
+        logger.debug("No tvg-name found in stream info")
+        return None
             
     def get_stats(self):
         """Return statistics about processed content"""
@@ -0,0 +1,161 @@
+import re
+import logging
+import threading
+import tools
+
+logger = logging.getLogger(__name__)
+
+# Indicators checked after the configured keywords and the year pattern
+COMMON_TV_INDICATORS = (
+    'episode', 'season', 'series', 'show',
+    's01', 's02', 's03', 's1', 's2', 's3',
+    'e01', 'e02', 'e1', 'e2',
+    ' tv ', ' serie', ' tv-', ' tv:'
+)
+
+# Keyword set priorities (lower wins)
+RANK_TV = 0
+RANK_MOVIE = 1
+RANK_COMMON_TV = 2
+NO_MATCH = 3
+
+YEAR_PATTERN = re.compile(r'\(\d{4}\)')
+TV_INDICATOR_PATTERN = re.compile(r'S\d+|Season \d+|Episode', re.IGNORECASE)
+
+# Classifiers already built, keyed by their keyword lists
+_classifiers = {}
+_classifiers_lock = threading.Lock()
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over ranked keywords. A single pass over the text
+    returns the best (lowest) rank of any keyword it contains, so the cost
+    depends on the text length and not on the number of keywords.
+    """
+
+    def __init__(self, ranked_keywords):
+        """Build the automaton from (keyword, rank) pairs"""
+        self.goto = [{}]
+        self.fail = [0]
+        self.best = [NO_MATCH]
+
+        for keyword, rank in ranked_keywords:
+            if not keyword:
+                # An empty keyword matches every title
+                self.best[0] = min(self.best[0], rank)
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.best.append(NO_MATCH)
+                    self.goto[state][char] = next_state
+                state = next_state
+            self.best[state] = min(self.best[state], rank)
+
+        # Breadth-first pass to set failure links and merge outputs
+        queue = list(self.goto[0].values())
+        for state in queue:
+            self.best[state] = min(self.best[state], self.best[0])
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.best[next_state] = min(self.best[next_state], self.best[self.fail[next_state]])
+                queue.append(next_state)
+
+    def best_rank(self, text):
+        """Return the lowest rank of any keyword found in text (NO_MATCH if none)"""
+        goto = self.goto
+        fail = self.fail
+        best = self.best
+        rank = best[0]
+        state = 0
+        for char in text:
+            if rank == 0:
+                break
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if best[state] < rank:
+                rank = best[state]
+        return rank
+
+class StreamClassifier:
+    """
+    Decides whether an M3U entry is a movie, TV episode or live stream.
+
+    All keyword sets are compiled into one automaton that keeps the original
+    priority: TV keywords, then movie keywords, then a year in parentheses,
+    then the common TV indicators.
+    """
+
+    def __init__(self, movie_keywords, tv_keywords):
+        """Compile the keyword sets"""
+        ranked = [(keyword.lower(), RANK_TV) for keyword in tv_keywords]
+        ranked += [(keyword.lower(), RANK_MOVIE) for keyword in movie_keywords]
+        ranked += [(keyword, RANK_COMMON_TV) for keyword in COMMON_TV_INDICATORS]
+        self.automaton = KeywordAutomaton(ranked)
+
+    def classify(self, streaminfo):
+        """Return 'vodTV', 'vodMovie' or 'live' for an EXTINF line"""
+        # Check for explicit type in the stream info
+        typematch = tools.tvgTypeMatch(streaminfo)
+        if typematch:
+            streamtype = tools.getResult(typematch)
+            if streamtype == 'tvshows':
+                return 'vodTV'
+            if streamtype == 'movies':
+                return 'vodMovie'
+            if streamtype == 'live':
+                return 'live'
+
+        # Check for season and episode pattern (SxxExx) or an airdate
+        if tools.sxxExxMatch(streaminfo) or tools.airDateMatch(streaminfo):
+            return 'vodTV'
+
+        tvg_name_match = tools.tvgNameMatch(streaminfo)
+        if not tvg_name_match:
+            return 'vodMovie'
+
+        original_title = tools.getResult(tvg_name_match)
+        title = original_title.lower()
+
+        rank = self.automaton.best_rank(title)
+        if rank == RANK_TV:
+            return 'vodTV'
+        if rank == RANK_MOVIE:
+            return 'vodMovie'
+
+        # A year in parentheses is typical for movies
+        if YEAR_PATTERN.search(title):
+            return 'vodMovie'
+
+        if rank == RANK_COMMON_TV or TV_INDICATOR_PATTERN.search(original_title):
+            return 'vodTV'
+
+        # Default to movie if we can't determine
+        return 'vodMovie'
+
+def get_stream_classifier(config):
+    """Return the classifier for the keyword lists in config, building it on first use"""
+    movie_keywords = tuple(config.get("movie_keywords", ["movie", "film", "feature"]))
+    tv_keywords = tuple(config.get("tv_keywords", ["tv", "show", "series", "episode"]))
+    key = (movie_keywords, tv_keywords)
+
+    classifier = _classifiers.get(key)
+    if classifier is None:
+        with _classifiers_lock:
+            classifier = _classifiers.get(key)
+            if classifier is None:
+                logger.debug(f"Building stream classifier for {len(movie_keywords)} movie and {len(tv_keywords)} TV keywords")
+                classifier = StreamClassifier(movie_keywords, tv_keywords)
+                # Only the current config generation is worth keeping
+                _classifiers.clear()
+                _classifiers[key] = classifier
+    return classifier
@@ -0,0 +1,159 @@
+import re
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Language prefixes look like "EN - Title"; longer heads are not prefixes
+LANGUAGE_SEPARATOR = ' - '
+MAX_LANGUAGE_LENGTH = 6
+
+# Filters already built, keyed by the config values they depend on
+_filters = {}
+_filters_lock = threading.Lock()
+
+def stream_attribute(streaminfo, name):
+    """Return the value of name="..." in an EXTINF line without using regex (None if absent)"""
+    marker = f'{name}="'
+    start = streaminfo.find(marker)
+    if start == -1:
+        return None
+    start += len(marker)
+    end = streaminfo.find('"', start)
+    if end == -1:
+        return None
+    return streaminfo[start:end]
+
+def language_of(title, max_length=MAX_LANGUAGE_LENGTH):
+    """Return the language prefix of a title ("EN - Title" -> "EN"), or None"""
+    end = title.find(LANGUAGE_SEPARATOR, 0, max_length + len(LANGUAGE_SEPARATOR))
+    if end <= 0:
+        return None
+    return title[:end]
+
+class StreamFilter:
+    """
+    Decides which M3U entries are processed, before any other parsing.
+
+    The language prefix is sliced out of tvg-name once and checked against
+    frozensets of included and excluded languages. group-title can be
+    included or excluded by exact name, and tvg-name can be excluded by
+    regular expressions (compiled into a single alternation).
+
+    language_mode is 'disabled' (all languages), 'prefix' (language_filter
+    only) or 'multiple' (included_languages).
+    """
+
+    def __init__(self, language_mode='prefix', language_filter='EN', included_languages=(),
+                 excluded_languages=(), included_groups=(), excluded_groups=(), exclude_patterns=()):
+        """Build the lookup sets and compile the patterns"""
+        self.language_mode = language_mode
+        self.language_filter = language_filter
+
+        if language_mode == 'prefix':
+            self.included_languages = frozenset([language_filter]) if language_filter else None
+        elif language_mode == 'multiple':
+            self.included_languages = frozenset(included_languages) or None
+        else:
+            self.included_languages = None
+        self.excluded_languages = frozenset(excluded_languages)
+        self.included_groups = frozenset(included_groups)
+        self.excluded_groups = frozenset(excluded_groups)
+
+        # Prefixes stripped from titles when building file names
+        strip = set(self.included_languages or ())
+        if language_filter:
+            strip.add(language_filter)
+        self.strip_languages = frozenset(strip)
+
+        known = self.strip_languages | self.excluded_languages
+        self.max_language_length = max([MAX_LANGUAGE_LENGTH] + [len(language) for language in known])
+
+        self.exclude_pattern = None
+        valid_patterns = []
+        for pattern in exclude_patterns:
+            try:
+                re.compile(pattern)
+                valid_patterns.append(f'(?:{pattern})')
+            except re.error as e:
+                logger.error(f"Ignoring invalid filter pattern '{pattern}': {str(e)}")
+        if valid_patterns:
+            self.exclude_pattern = re.compile('|'.join(valid_patterns), re.IGNORECASE)
+
+        self.checks_groups = bool(self.included_groups or self.excluded_groups)
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a filter from the saved filter settings"""
+        if not config.get("skip_non_english", True):
+            language_mode = 'disabled'
+        else:
+            language_mode = config.get("language_mode", 'prefix')
+            if language_mode == 'disabled':
+                language_mode = 'prefix'
+
+        return cls(
+            language_mode=language_mode,
+            language_filter=config.get("language_filter", "EN"),
+            included_languages=config.get("included_languages", []),
+            excluded_languages=config.get("excluded_languages", []),
+            included_groups=config.get("included_groups", []),
+            excluded_groups=config.get("excluded_groups", []),
+            exclude_patterns=config.get("exclude_patterns", [])
+        )
+
+    def check(self, streaminfo):
+        """Return None if the entry should be processed, otherwise the reason it is skipped"""
+        tvg_name = stream_attribute(streaminfo, 'tvg-name')
+        if tvg_name is not None:
+            language = language_of(tvg_name, self.max_language_length)
+            if self.included_languages is not None and language not in self.included_languages:
+                return 'language'
+            if language in self.excluded_languages:
+                return 'language'
+
+        if self.checks_groups:
+            group = stream_attribute(streaminfo, 'group-title')
+            if self.included_groups and group not in self.included_groups:
+                return 'group'
+            if group in self.excluded_groups:
+                return 'group'
+
+        if self.exclude_pattern is not None and tvg_name is not None and self.exclude_pattern.search(tvg_name):
+            return 'pattern'
+
+        return None
+
+    def strip_language(self, title):
+        """Remove a known language prefix ("EN - ") from a title"""
+        language = language_of(title, self.max_language_length)
+        if language in self.strip_languages:
+            return title[len(language) + len(LANGUAGE_SEPARATOR):]
+        return title
+
+def get_stream_filter(config):
+    """Return the StreamFilter for config, building it when the filter settings change"""
+    key = tuple(
+        tuple(value) if isinstance(value, list) else value
+        for value in (
+            config.get("skip_non_english", True),
+            config.get("language_mode", 'prefix'),
+            config.get("language_filter", "EN"),
+            config.get("included_languages", []),
+            config.get("excluded_languages", []),
+            config.get("included_groups", []),
+            config.get("excluded_groups", []),
+            config.get("exclude_patterns", [])
+        )
+    )
+
+    stream_filter = _filters.get(key)
+    if stream_filter is None:
+        with _filters_lock:
+            stream_filter = _filters.get(key)
+            if stream_filter is None:
+                stream_filter = StreamFilter.from_config(config)
+                # Only the current config generation is worth keeping
+                _filters.clear()
+                _filters[key] = stream_filter
+    return stream_filter